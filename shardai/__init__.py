@@ -1,3 +1,15 @@
+from .breaker import Circuit, CircuitBreaker
+from .cache import (AudioCache, BloomFilter, Coalescer, DiskCache, ImageCache,
+                    MemoryCache, ModerationCache, TTLCache)
 from .client import ShardClient
+from .concurrency import AdaptiveLimit, ConcurrencyLimiter
+from .downloader import Downloader
 from .exceptions import *
+from .hedge import HedgePolicy, LatencyHistogram
+from .jsonview import JSONListView, JSONView
+from .keypool import APIKey, APIKeyPool
 from .objects import *
+from .ratelimit import RateLimiter, TokenBucket
+from .retry import RetryPolicy
+from .scheduler import Scheduler
+from .transport import request_options
@@ -0,0 +1,220 @@
+from concurrent import futures
+from contextvars import copy_context
+from time import monotonic
+
+from .transport import current_options, request_options
+
+
+def _call(func, item, defaults: dict):
+    """
+    Call func with a batch item
+
+    A dict item is used as keyword arguments, a list or tuple as positional
+    arguments and anything else as the prompt. The defaults are merged under
+    the item's own keyword arguments.
+    """
+    if isinstance(item, dict):
+        return func(**{**defaults, **item})
+    if isinstance(item, (list, tuple)):
+        return func(*item, **defaults)
+    return func(**{**defaults, "prompt": item})
+
+
+def _timed(func, item, defaults: dict, timeout: float, started: list):
+    """
+    Call func with a batch item under a deadline of timeout seconds, recording
+    when the call started in started
+    """
+    started.append(monotonic())
+    if timeout is None:
+        return _call(func, item, defaults)
+    deadline = current_options().get("deadline")
+    if deadline is not None:
+        timeout = min(deadline, timeout)
+    with request_options(deadline=timeout):
+        return _call(func, item, defaults)
+
+
+async def gather_bounded(
+    func,
+    requests,
+    concurrency: int = 8,
+    return_exceptions: bool = False,
+    **defaults,
+) -> list:
+    """
+    Run a coroutine function over many requests with at most concurrency in flight
+
+    :param func: The coroutine function to call for every request
+    :param requests: An iterable of kwargs dicts, args tuples or prompts
+    :param concurrency: The maximum number of requests in flight
+    :param return_exceptions: Whether to return exceptions instead of raising
+    :param defaults: Keyword arguments shared by every request
+
+    :return: The results in the order of the requests
+    """
+    from asyncio import ensure_future, gather
+
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+    items = list(requests)
+    results = [None] * len(items)
+    pending = iter(enumerate(items))
+
+    async def worker():
+        for index, item in pending:
+            try:
+                results[index] = await _call(func, item, defaults)
+            except Exception as error:
+                if not return_exceptions:
+                    raise
+                results[index] = error
+
+    workers = [ensure_future(worker()) for _ in range(min(concurrency, len(items)))]
+    try:
+        await gather(*workers)
+    except BaseException:
+        for task in workers:
+            task.cancel()
+        await gather(*workers, return_exceptions=True)
+        raise
+    return results
+
+
+async def iter_bounded(
+    func,
+    requests,
+    window: int = 8,
+    return_exceptions: bool = False,
+    **defaults,
+):
+    """
+    Run a coroutine function over many requests, yielding results as they finish
+
+    The requests are consumed lazily and at most window of them are in flight,
+    so memory stays flat however long the iterable is.
+
+    :param func: The coroutine function to call for every request
+    :param requests: An iterable of kwargs dicts, args tuples or prompts
+    :param window: The maximum number of requests in flight
+    :param return_exceptions: Whether to yield exceptions instead of raising
+    :param defaults: Keyword arguments shared by every request
+
+    :return: An async generator of (index, result) tuples in completion order
+    """
+    from asyncio import FIRST_COMPLETED, ensure_future, wait
+
+    if window < 1:
+        raise ValueError("window must be at least 1")
+    pending = enumerate(requests)
+    in_flight = {}
+
+    def fill():
+        while len(in_flight) < window:
+            try:
+                index, item = next(pending)
+            except StopIteration:
+                return
+            in_flight[ensure_future(_call(func, item, defaults))] = index
+
+    try:
+        fill()
+        while in_flight:
+            done, _ = await wait(in_flight, return_when=FIRST_COMPLETED)
+            finished = [(in_flight.pop(task), task) for task in done]
+            fill()
+            for index, task in sorted(finished, key=lambda pair: pair[0]):
+                try:
+                    result = task.result()
+                except Exception as error:
+                    if not return_exceptions:
+                        raise
+                    result = error
+                yield index, result
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+
+def map_bounded(
+    executor,
+    func,
+    requests,
+    max_workers: int = 8,
+    timeout: float = None,
+    return_exceptions: bool = False,
+    **defaults,
+) -> list:
+    """
+    Run a function over many requests on a thread pool, max_workers at a time
+
+    A call that does not finish within timeout seconds of starting fails with
+    concurrent.futures.TimeoutError. Its requests run under a deadline of
+    timeout seconds, so its thread is freed soon after.
+
+    :param executor: The executor to run the calls on
+    :param func: The function to call for every request
+    :param requests: An iterable of kwargs dicts, args tuples or prompts
+    :param max_workers: The maximum number of requests in flight
+    :param timeout: The maximum number of seconds a single call may take
+    :param return_exceptions: Whether to return exceptions instead of raising
+    :param defaults: Keyword arguments shared by every request
+
+    :return: The results in the order of the requests
+    """
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+    items = list(requests)
+    results = [None] * len(items)
+    pending = iter(enumerate(items))
+    in_flight = {}
+
+    def fill():
+        while len(in_flight) < max_workers:
+            try:
+                index, item = next(pending)
+            except StopIteration:
+                return
+            started = []
+            context = copy_context()
+            future = executor.submit(
+                context.run, _timed, func, item, defaults, timeout, started
+            )
+            in_flight[future] = (index, started)
+
+    def wait_for():
+        # A call that has not started yet cannot time out before timeout seconds
+        if timeout is None:
+            return None
+        ends = [started[0] + timeout for _, started in in_flight.values() if started]
+        return max(0, min(ends, default=monotonic() + timeout) - monotonic())
+
+    try:
+        fill()
+        while in_flight:
+            done, _ = futures.wait(
+                in_flight, timeout=wait_for(), return_when=futures.FIRST_COMPLETED
+            )
+            now = monotonic()
+            for future, (index, started) in list(in_flight.items()):
+                if future in done:
+                    error = future.exception()
+                    if error is None:
+                        results[index] = future.result()
+                elif timeout is not None and started and now >= started[0] + timeout:
+                    future.cancel()
+                    error = futures.TimeoutError(
+                        f"Request {index} did not finish within {timeout} seconds"
+                    )
+                else:
+                    continue
+                del in_flight[future]
+                if error is not None:
+                    if not return_exceptions:
+                        raise error
+                    results[index] = error
+            fill()
+    finally:
+        for future in in_flight:
+            future.cancel()
+    return results
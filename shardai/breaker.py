@@ -0,0 +1,219 @@
+from collections import deque
+from threading import Lock
+from time import monotonic
+
+from .exceptions import CircuitOpenError
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class Circuit:
+    """
+    Circuit breaker of one endpoint
+
+    While closed, the outcome of the last window calls is kept. Once at least
+    min_calls were seen, the circuit opens when the share of failed calls
+    (connection errors, timeouts and 5xx) or of slow calls reaches its
+    threshold. An open circuit rejects calls at once with CircuitOpenError.
+    After open_timeout seconds it is half open and lets half_open_calls trial
+    calls through: it closes if they all succeed and opens again otherwise.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        failure_rate: float = 0.5,
+        slow_call_duration: float = None,
+        slow_call_rate: float = 0.5,
+        window: int = 20,
+        min_calls: int = 10,
+        open_timeout: float = 30,
+        half_open_calls: int = 1,
+        on_state_change=None,
+    ):
+        """
+        :param endpoint: The endpoint the circuit protects
+        :param failure_rate: The share of failed calls that opens the circuit
+        :param slow_call_duration: The latency from which a call counts as slow
+        :param slow_call_rate: The share of slow calls that opens the circuit
+        :param window: The number of recent calls the rates are computed over
+        :param min_calls: The number of calls needed before the circuit may open
+        :param open_timeout: How long the circuit stays open, in seconds
+        :param half_open_calls: The trial calls let through while half open
+        :param on_state_change: A function called with (endpoint, old, new) states
+        """
+        self.endpoint = endpoint
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.min_calls = min_calls
+        self.open_timeout = open_timeout
+        self.half_open_calls = half_open_calls
+        self.on_state_change = on_state_change
+        self.state = CLOSED
+        self.calls = deque(maxlen=window)
+        self.opened_at = 0.0
+        self._trials = 0
+        self._successes = 0
+        self._lock = Lock()
+
+    def _move(self, state: str) -> tuple:
+        transition = (self.state, state)
+        self.state = state
+        if state == OPEN:
+            self.opened_at = monotonic()
+        elif state == HALF_OPEN:
+            self._trials = self._successes = 0
+        else:
+            self.calls.clear()
+        return transition
+
+    def _notify(self, transition: tuple):
+        if transition is not None and self.on_state_change is not None:
+            self.on_state_change(self.endpoint, *transition)
+
+    def _tripped(self) -> bool:
+        failures = sum(failed for failed, slow in self.calls) / len(self.calls)
+        if failures >= self.failure_rate:
+            return True
+        if self.slow_call_duration is None:
+            return False
+        slow_calls = sum(slow for failed, slow in self.calls) / len(self.calls)
+        return slow_calls >= self.slow_call_rate
+
+    def acquire(self):
+        """
+        Let a call through, or raise CircuitOpenError if the circuit is open
+        """
+        transition = None
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.open_timeout - monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(
+                        f"Error: the {self.endpoint} circuit is open",
+                        self.endpoint,
+                        remaining,
+                    )
+                transition = self._move(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._trials >= self.half_open_calls:
+                    raise CircuitOpenError(
+                        f"Error: the {self.endpoint} circuit is half open",
+                        self.endpoint,
+                        0.0,
+                    )
+                self._trials += 1
+        self._notify(transition)
+
+    def record(self, failed: bool, latency: float):
+        """
+        Record the outcome of a call let through by acquire
+
+        :param failed: Whether the call failed
+        :param latency: The duration of the call, in seconds
+        """
+        threshold = self.slow_call_duration
+        slow = threshold is not None and latency >= threshold
+        transition = None
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed or slow:
+                    transition = self._move(OPEN)
+                else:
+                    self._successes += 1
+                    if self._successes >= self.half_open_calls:
+                        transition = self._move(CLOSED)
+            elif self.state == CLOSED:
+                self.calls.append((failed, slow))
+                if len(self.calls) >= self.min_calls and self._tripped():
+                    transition = self._move(OPEN)
+        self._notify(transition)
+
+    def release(self):
+        """
+        Give back a call let through by acquire that was abandoned without outcome
+        """
+        with self._lock:
+            if self.state == HALF_OPEN and self._trials > self._successes:
+                self._trials -= 1
+
+    def __repr__(self):
+        return f"<Circuit endpoint={self.endpoint} state={self.state}>"
+
+    def __str__(self):
+        return f"<Circuit endpoint={self.endpoint} state={self.state}>"
+
+
+class CircuitBreaker:
+    """
+    Per endpoint circuits shared by every sub-client
+
+    A degraded endpoint fails fast instead of holding connections and workers
+    that healthy endpoints could use.
+    """
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        slow_call_duration: float = None,
+        slow_call_rate: float = 0.5,
+        window: int = 20,
+        min_calls: int = 10,
+        open_timeout: float = 30,
+        half_open_calls: int = 1,
+        on_state_change=None,
+        limits: dict = None,
+    ):
+        """
+        :param failure_rate: The share of failed calls that opens a circuit
+        :param slow_call_duration: The latency from which a call counts as slow
+        :param slow_call_rate: The share of slow calls that opens a circuit
+        :param window: The number of recent calls the rates are computed over
+        :param min_calls: The number of calls needed before a circuit may open
+        :param open_timeout: How long a circuit stays open, in seconds
+        :param half_open_calls: The trial calls let through while half open
+        :param on_state_change: A function called with (endpoint, old, new) states
+        :param limits: Per endpoint overrides, mapping an endpoint name (chat, sd1x,
+            sdxl, sdxl-turbo, tts, moderation) to a dict of the arguments above
+        """
+        self.settings = {
+            "failure_rate": failure_rate,
+            "slow_call_duration": slow_call_duration,
+            "slow_call_rate": slow_call_rate,
+            "window": window,
+            "min_calls": min_calls,
+            "open_timeout": open_timeout,
+            "half_open_calls": half_open_calls,
+            "on_state_change": on_state_change,
+        }
+        self.limits = limits or {}
+        self._circuits = {}
+        self._lock = Lock()
+
+    def circuit(self, endpoint: str) -> Circuit:
+        """
+        Return the circuit of an endpoint, creating it on first use
+        """
+        circuit = self._circuits.get(endpoint)
+        if circuit is None:
+            with self._lock:
+                circuit = self._circuits.get(endpoint)
+                if circuit is None:
+                    settings = {**self.settings, **self.limits.get(endpoint, {})}
+                    circuit = self._circuits[endpoint] = Circuit(endpoint, **settings)
+        return circuit
+
+    def states(self) -> dict:
+        """
+        Return the state of every circuit used so far
+        """
+        return {endpoint: circuit.state for endpoint, circuit in self._circuits.items()}
+
+    def __repr__(self):
+        return f"<CircuitBreaker circuits={len(self._circuits)}>"
+
+    def __str__(self):
+        return f"<CircuitBreaker circuits={len(self._circuits)}>"
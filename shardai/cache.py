@@ -0,0 +1,614 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from hashlib import blake2b, sha256
+from json import dump, dumps, load
+from math import log
+from os import listdir, makedirs, remove, replace, stat, utime
+from os.path import join
+from threading import Lock
+from time import monotonic, time
+from unicodedata import normalize
+
+from .objects import ImageResponse, ModerationResponse, TTSResponse
+
+_MISSING = object()
+
+
+async def _shared(in_flight: dict, key, factory):
+    """
+    Await factory() in a task shared by every concurrent caller of a key
+
+    Each caller awaits the task through shield, so cancelling one caller (or
+    its timeout) only affects that caller. The task itself is cancelled once
+    the last caller waiting on it is gone.
+    """
+    from asyncio import ensure_future, get_running_loop, shield
+
+    entry = in_flight.get(key)
+    if entry is None or entry[0].get_loop() is not get_running_loop():
+        entry = in_flight[key] = [ensure_future(factory()), 0]
+
+        def forget(task):
+            if in_flight.get(key) is entry:
+                del in_flight[key]
+
+        entry[0].add_done_callback(forget)
+    task = entry[0]
+    entry[1] += 1
+    try:
+        return await shield(task)
+    finally:
+        entry[1] -= 1
+        if not entry[1] and not task.done():
+            task.cancel()
+
+
+class TTLCache:
+    """
+    In-process cache whose entries expire after ttl seconds
+
+    Concurrent misses on the same key are collapsed into a single load
+    (single-flight), both across threads and across coroutines. Entries must be
+    json serializable when the cache is persisted to disk.
+    """
+
+    def __init__(self, ttl: float = 300, path: str = None):
+        """
+        :param ttl: How long an entry stays fresh, in seconds
+        :param path: A json file the entries are persisted to across restarts
+        """
+        self.ttl = ttl
+        self.path = path
+        self._entries = {}
+        self._loading = {}
+        self._loading_async = {}
+        self._lock = Lock()
+        if path is not None:
+            self._restore()
+
+    def _restore(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                entries = load(file)
+        except (OSError, ValueError):
+            return
+        self._entries = {key: tuple(entry) for key, entry in entries.items()}
+
+    def _persist(self):
+        if self.path is None:
+            return
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            dump(self._entries, file)
+        replace(temporary, self.path)
+
+    def get(self, key: str, default=None):
+        """
+        Return the fresh value of a key, or default if it is missing or expired
+        """
+        entry = self._entries.get(key)
+        if entry is None or time() - entry[0] >= self.ttl:
+            return default
+        return entry[1]
+
+    def set(self, key: str, value):
+        """
+        Store a value
+        """
+        with self._lock:
+            self._entries[key] = (time(), value)
+            self._persist()
+
+    def invalidate(self, key: str = None):
+        """
+        Drop a key, or every key if none is given
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+            self._persist()
+
+    def get_or_load(self, key: str, loader, refresh: bool = False):
+        """
+        Return the fresh value of a key, calling loader once on a miss
+
+        :param key: The cache key
+        :param loader: A function returning the value to cache
+        :param refresh: Whether to ignore the cached value and load it again
+        """
+        if not refresh:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+        with self._lock:
+            future = self._loading.get(key)
+            leader = future is None
+            if leader:
+                future = self._loading[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            value = loader()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+
+    async def get_or_load_async(self, key: str, loader, refresh: bool = False):
+        """
+        Return the fresh value of a key, awaiting loader once on a miss
+
+        :param key: The cache key
+        :param loader: A coroutine function returning the value to cache
+        :param refresh: Whether to ignore the cached value and load it again
+        """
+        if not refresh:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+
+        async def load():
+            value = await loader()
+            self.set(key, value)
+            return value
+
+        return await _shared(self._loading_async, key, load)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"<TTLCache ttl={self.ttl} entries={len(self._entries)}>"
+
+    def __str__(self):
+        return f"<TTLCache ttl={self.ttl} entries={len(self._entries)}>"
+
+
+class DiskCache:
+    """
+    Content-addressed cache of binary blobs on disk, evicted by total size
+
+    Every entry is a data file plus a small json metadata file named after its
+    key. The least recently used entries are removed once the data files grow
+    beyond max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1024**3):
+        """
+        :param directory: The directory the entries are stored in
+        :param max_bytes: The maximum total size of the stored data, in bytes
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        entries = []
+        for name in listdir(self.directory):
+            if not name.endswith(".bin"):
+                continue
+            stat_result = stat(join(self.directory, name))
+            entries.append((stat_result.st_mtime, name[:-4], stat_result.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self.size += size
+
+    def _path(self, key: str, suffix: str) -> str:
+        return join(self.directory, f"{key}{suffix}")
+
+    @staticmethod
+    def key(*parts) -> str:
+        """
+        Hash json serializable parts into a cache key
+        """
+        return sha256(dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """
+        Return the data and metadata of a key, or None if it is not cached
+        """
+        with self._lock:
+            if key not in self._entries:
+                return None
+            try:
+                with open(self._path(key, ".bin"), "rb") as file:
+                    data = file.read()
+                with open(self._path(key, ".json"), "r", encoding="utf-8") as file:
+                    meta = load(file)
+            except (OSError, ValueError):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            utime(self._path(key, ".bin"))
+            return data, meta
+
+    def set(self, key: str, data: bytes, meta: dict = None):
+        """
+        Store the data and metadata of a key, evicting old entries if needed
+        """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            for suffix, content in (
+                (".json", dumps(meta or {}).encode("utf-8")),
+                (".bin", data),
+            ):
+                temporary = self._path(key, f"{suffix}.tmp")
+                with open(temporary, "wb") as file:
+                    file.write(content)
+                replace(temporary, self._path(key, suffix))
+            self._entries[key] = len(data)
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        self.size -= self._entries.pop(key, 0)
+        for suffix in (".bin", ".json"):
+            try:
+                remove(self._path(key, suffix))
+            except OSError:
+                pass
+
+    def __contains__(self, key: str):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} entries={len(self._entries)} size={self.size}>"
+
+    def __str__(self):
+        return f"<{type(self).__name__} entries={len(self._entries)} size={self.size}>"
+
+
+class ImageCache(DiskCache):
+    """
+    On-disk cache of generated images keyed by their full generation payload
+
+    Only generations with an explicit seed are cached, as only those are
+    deterministic.
+    """
+
+    @staticmethod
+    def payload_key(path: str, payload: dict) -> str:
+        """
+        Return the cache key of a generation request
+
+        The base64 flag only changes how the image is returned, so it is not part
+        of the key.
+        """
+        return DiskCache.key(
+            path, {name: value for name, value in payload.items() if name != "base64"}
+        )
+
+    def load(self, key: str):
+        """
+        Return the cached ImageResponse of a key, or None
+        """
+        entry = self.get(key)
+        if entry is None:
+            return None
+        data, meta = entry
+        response = ImageResponse(
+            None, meta.get("generation_time"), meta.get("warning"), meta.get("info")
+        )
+        return response._preset(data, meta.get("mime", "image/png"))
+
+    def store(self, key: str, response: ImageResponse, data: bytes, mime: str):
+        """
+        Store the decoded image of a response
+        """
+        self.set(
+            key,
+            data,
+            {
+                "generation_time": response.generation_time,
+                "warning": response.warning,
+                "info": response.info,
+                "mime": mime,
+            },
+        )
+
+
+class MemoryCache:
+    """
+    In-memory least recently used cache bounded by the total size of its values
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024**2):
+        """
+        :param max_bytes: The maximum total size of the cached values, in bytes
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: str, default=None):
+        """
+        Return the value of a key, or default if it is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value, size: int):
+        """
+        Store a value of the given size, evicting old entries if needed
+        """
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.size -= self._entries.popitem(last=False)[1][1]
+
+    def __contains__(self, key: str):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"<MemoryCache entries={len(self._entries)} size={self.size}>"
+
+    def __str__(self):
+        return f"<MemoryCache entries={len(self._entries)} size={self.size}>"
+
+
+class AudioCache:
+    """
+    Cache of text to speech audio keyed by the prompt, model, voice, gender and language
+
+    The hottest phrases are kept in a size-bounded in-memory LRU, backed by an
+    optional on-disk cache of the decoded audio that survives restarts.
+    """
+
+    def __init__(
+        self,
+        directory: str = None,
+        max_memory_bytes: int = 32 * 1024**2,
+        max_disk_bytes: int = 1024**3,
+    ):
+        """
+        :param directory: The directory the audio is persisted to, if any
+        :param max_memory_bytes: The maximum size of the in-memory LRU, in bytes
+        :param max_disk_bytes: The maximum size of the on-disk cache, in bytes
+        """
+        self.memory = MemoryCache(max_memory_bytes)
+        self.disk = DiskCache(directory, max_disk_bytes) if directory else None
+
+    @staticmethod
+    def payload_key(payload: dict) -> str:
+        """
+        Return the cache key of a text to speech request
+        """
+        return DiskCache.key("/v1/tts/completions", payload)
+
+    def load(self, key: str):
+        """
+        Return the cached TTSResponse of a key, or None
+        """
+        entry = self.memory.get(key)
+        if entry is None and self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self.memory.set(key, entry, len(entry[0]))
+        if entry is None:
+            return None
+        data, meta = entry
+        response = TTSResponse(
+            None, meta.get("generation_time"), meta.get("warning"), meta.get("info")
+        )
+        return response._preset(data, meta.get("mime", "audio/mp3"))
+
+    def store(self, key: str, response: TTSResponse, data: bytes, mime: str):
+        """
+        Store the decoded audio of a response
+        """
+        meta = {
+            "generation_time": response.generation_time,
+            "warning": response.warning,
+            "info": {
+                "model": response.model,
+                "language": response.language,
+                "gender": response.gender,
+                "voice_used": response.voice,
+            },
+            "mime": mime,
+        }
+        self.memory.set(key, (data, meta), len(data))
+        if self.disk is not None:
+            self.disk.set(key, data, meta)
+
+    def __repr__(self):
+        return f"<AudioCache memory={self.memory} disk={self.disk}>"
+
+    def __str__(self):
+        return f"<AudioCache memory={self.memory} disk={self.disk}>"
+
+
+class BloomFilter:
+    """
+    Compact probabilistic set answering "definitely absent" or "maybe present"
+    """
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.01):
+        """
+        :param capacity: The number of keys the filter is sized for
+        :param error_rate: The false positive rate at capacity
+        """
+        self.bits = max(8, int(-capacity * log(error_rate) / log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * log(2)))
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.bits for i in range(self.hashes))
+
+    def add(self, key: str):
+        """
+        Add a key to the filter
+        """
+        for position in self._positions(key):
+            self._array[position >> 3] |= 1 << (position & 7)
+
+    def clear(self):
+        """
+        Remove every key from the filter
+        """
+        self._array = bytearray(len(self._array))
+
+    def __contains__(self, key: str):
+        return all(
+            self._array[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+    def __repr__(self):
+        return f"<BloomFilter bits={self.bits} hashes={self.hashes}>"
+
+    def __str__(self):
+        return f"<BloomFilter bits={self.bits} hashes={self.hashes}>"
+
+
+class ModerationCache:
+    """
+    Cache of moderation verdicts keyed by the normalized prompt and the attribute
+
+    Entries expire after ttl seconds and at most max_entries are kept. A bloom
+    filter in front of the store answers most misses without touching it.
+    """
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 100000):
+        """
+        :param ttl: How long a verdict stays fresh, in seconds
+        :param max_entries: The maximum number of cached verdicts
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.bloom = BloomFilter(max_entries)
+        self._entries = OrderedDict()
+        self._stale = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def normalize(prompt: str) -> str:
+        """
+        Normalize a prompt so trivially different messages share a verdict
+        """
+        return " ".join(normalize("NFKC", prompt).split()).casefold()
+
+    @classmethod
+    def prompt_key(cls, prompt: str, attribute: str) -> str:
+        """
+        Return the cache key of a prompt and attribute
+        """
+        data = f"{attribute}\0{cls.normalize(prompt)}".encode("utf-8")
+        return blake2b(data, digest_size=16).hexdigest()
+
+    def load(self, key: str, prompt: str = None):
+        """
+        Return the cached ModerationResponse of a key, or None
+
+        :param key: The cache key
+        :param prompt: The prompt of the caller, reported on the cached response
+        """
+        if key not in self.bloom:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            json_response = entry[1]
+        data = dict(json_response["data"])
+        if prompt is not None:
+            data["prompt"] = prompt
+        return ModerationResponse(
+            json_response["score"], json_response["languages"], data, cached=True
+        )
+
+    def store(self, key: str, json_response: dict):
+        """
+        Store the json response of a moderation request
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (monotonic() + self.ttl, json_response)
+            self.bloom.add(key)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key: str):
+        del self._entries[key]
+        self._stale += 1
+        if self._stale >= self.max_entries:
+            self.bloom.clear()
+            for remaining in self._entries:
+                self.bloom.add(remaining)
+            self._stale = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"<ModerationCache entries={len(self._entries)}>"
+
+    def __str__(self):
+        return f"<ModerationCache entries={len(self._entries)}>"
+
+
+class Coalescer:
+    """
+    Collapses identical concurrent coroutine calls into a single one
+
+    While a call for a key is in flight, later calls with the same key wait for
+    it and receive its result (or exception) instead of starting their own.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+
+    async def run(self, key, factory):
+        """
+        Await factory() unless a call with the same key is already in flight
+
+        :param key: The key identifying identical calls
+        :param factory: A function returning the coroutine to await
+        """
+        return await _shared(self._in_flight, key, factory)
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    def __repr__(self):
+        return f"<Coalescer in_flight={len(self._in_flight)}>"
+
+    def __str__(self):
+        return f"<Coalescer in_flight={len(self._in_flight)}>"
@@ -1,24 +1,29 @@
-from aiohttp import ClientSession
-from requests import get
-
+from .batch import gather_bounded, iter_bounded, map_bounded
 from .exceptions import *
-from .objects import ChatResponse
+from .objects import ChatResponse, ChatStream, ChatStreamAsync
+from .transport import Transport
 
 
 class ChatAsync:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, transport: Transport = None):
         self.api_key = api_key
+        self.transport = transport or Transport()
 
     async def completions(
-        self, model: str, messages: list = None, prompt: str = None
+        self,
+        model: str,
+        messages: list = None,
+        prompt: str = None,
+        stream: bool = False,
     ) -> ChatResponse:
         """
         Chat function
 
         :param prompt: The prompt to use for the chat
         :param model: The model to use for the chat
+        :param stream: Whether to stream the answer as ChatMessage deltas
 
-        :return: The response of the chat
+        :return: The response of the chat, or a stream of deltas if stream is set
         """
         if self.api_key is None:
             raise NoAPIKeyError("API key is required for this function")
@@ -31,52 +36,101 @@ class ChatAsync:
             if messages is None
             else {"messages": messages, "model": model}
         )
-        async with ClientSession() as session:
-            async with session.post(
-                "https://shard-ai.xyz/v1/chat/completions",
-                json=payload,
-                headers=headers,
-            ) as response:
-                json_response = await response.json()
-                if response.status != 200:
-                    raise APIError(f"Error: {response.status}")
-                return ChatResponse(
-                    json_response["id"],
-                    json_response["object"],
-                    json_response["created"],
-                    json_response["model"],
-                    json_response["usage"],
-                    json_response["choices"],
+        if stream:
+            payload["stream"] = True
+            return ChatStreamAsync(
+                self.transport.stream_async(
+                    "POST", "/v1/chat/completions", payload, headers
                 )
+            )
+        json_response = await self.transport.request_async(
+            "POST", "/v1/chat/completions", payload, headers, coalesce=True
+        )
+        return ChatResponse(
+            json_response["id"],
+            json_response["object"],
+            json_response["created"],
+            json_response["model"],
+            json_response["usage"],
+            json_response["choices"],
+        )
+
+    async def completions_many(
+        self,
+        requests,
+        concurrency: int = 8,
+        return_exceptions: bool = False,
+        **kwargs,
+    ) -> list:
+        """
+        Run many chat requests concurrently over the shared session
+
+        :param requests: An iterable of kwargs dicts, args tuples or prompts
+        :param concurrency: The maximum number of requests in flight
+        :param return_exceptions: Whether to return exceptions instead of raising
+        :param kwargs: Keyword arguments shared by every request
+
+        :return: The responses in the order of the requests
+        """
+        return await gather_bounded(
+            self.completions, requests, concurrency, return_exceptions, **kwargs
+        )
+
+    def completions_iter(
+        self,
+        requests,
+        window: int = 8,
+        return_exceptions: bool = False,
+        **kwargs,
+    ):
+        """
+        Run many chat requests, yielding each response as soon as it finishes
+
+        :param requests: An iterable of kwargs dicts, args tuples or prompts
+        :param window: The maximum number of requests in flight
+        :param return_exceptions: Whether to yield exceptions instead of raising
+        :param kwargs: Keyword arguments shared by every request
 
-    async def models(self) -> list:
+        :return: An async generator of (index, response) tuples
+        """
+        return iter_bounded(
+            self.completions, requests, window, return_exceptions, **kwargs
+        )
+
+    async def models(self, refresh: bool = False) -> list:
         """
         Get available models
 
+        :param refresh: Whether to bypass the cache and fetch them again
+
         :return: The available models
         """
-        async with ClientSession() as session:
-            async with session.get("https://shard-ai.xyz/v1/chat/models") as response:
-                json_response = await response.json()
-                if response.status != 200:
-                    raise APIError(f"Error: {response.status}")
-                return json_response["models"]
+        json_response = await self.transport.request_async(
+            "GET", "/v1/chat/models", idempotent=True, cached=True, refresh=refresh
+        )
+        return json_response["models"]
 
 
 class Chat:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, transport: Transport = None):
         self.api_key = api_key
+        self.transport = transport or Transport()
 
     def completions(
-        self, model: str, messages: list = None, prompt: str = None
+        self,
+        model: str,
+        messages: list = None,
+        prompt: str = None,
+        stream: bool = False,
     ) -> ChatResponse:
         """
         Chat function
 
         :param prompt: The prompt to use for the chat
         :param model: The model to use for the chat
+        :param stream: Whether to stream the answer as ChatMessage deltas
 
-        :return: The response of the chat
+        :return: The response of the chat, or a stream of deltas if stream is set
         """
         if self.api_key is None:
             raise NoAPIKeyError("API key is required for this function")
@@ -88,12 +142,14 @@ class Chat:
             if messages is None
             else {"messages": messages, "model": model}
         )
-        response = get(
-            "https://shard-ai.xyz/v1/chat/completions", json=payload, headers=headers
+        if stream:
+            payload["stream"] = True
+            return ChatStream(
+                self.transport.stream("GET", "/v1/chat/completions", payload, headers)
+            )
+        response_json = self.transport.request(
+            "GET", "/v1/chat/completions", payload, headers
         )
-        if response.status_code != 200:
-            raise APIError(f"Error: {response.status_code}")
-        response_json = response.json()
         return ChatResponse(
             response_json["id"],
             response_json["object"],
@@ -103,14 +159,44 @@ class Chat:
             response_json["choices"],
         )
 
-    def models(self) -> list:
+    def completions_map(
+        self,
+        requests,
+        max_workers: int = None,
+        timeout: float = None,
+        return_exceptions: bool = False,
+        **kwargs,
+    ) -> list:
+        """
+        Run many chat requests on the shared thread pool
+
+        :param requests: An iterable of kwargs dicts, args tuples or prompts
+        :param max_workers: The maximum requests in flight (the pool size by default)
+        :param timeout: The maximum number of seconds a single request may take
+        :param return_exceptions: Whether to return exceptions instead of raising
+        :param kwargs: Keyword arguments shared by every request
+
+        :return: The responses in the order of the requests
+        """
+        return map_bounded(
+            self.transport.executor,
+            self.completions,
+            requests,
+            max_workers or self.transport.pool_size,
+            timeout,
+            return_exceptions,
+            **kwargs,
+        )
+
+    def models(self, refresh: bool = False) -> list:
         """
         Get available models
 
+        :param refresh: Whether to bypass the cache and fetch them again
+
         :return: The available models
         """
-        response = get("https://shard-ai.xyz/v1/chat/models")
-        if response.status_code != 200:
-            raise APIError(f"Error: {response.status_code}")
-        response_json = response.json()
+        response_json = self.transport.request(
+            "GET", "/v1/chat/models", idempotent=True, cached=True, refresh=refresh
+        )
         return response_json["models"]
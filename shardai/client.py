@@ -1,20 +1,244 @@
-from .chat import Chat, ChatAsync
-from .image import Image, ImageAsync
-from .moderation import Moderation, ModerationAsync
-from .tts import TTS, TTSAsync
+from contextvars import copy_context
+from importlib import import_module
+
+from .breaker import CircuitBreaker
+from .cache import AudioCache, ImageCache, ModerationCache, TTLCache
+from .concurrency import ConcurrencyLimiter
+from .exceptions import APIError
+from .hedge import HedgePolicy
+from .keypool import APIKeyPool
+from .ratelimit import RateLimiter
+from .retry import RetryPolicy
+from .scheduler import Scheduler
+from .transport import BASE_URL, Transport, request_options
+
+
+class _SubClient:
+    """
+    Sub-client attribute built (and its module imported) on first access
+    """
+
+    def __init__(self, module: str, name: str, cache: str = None):
+        """
+        :param module: The module defining the sub-client, relative to the package
+        :param name: The class of the sub-client
+        :param cache: The ShardClient attribute holding the sub-client's cache, if any
+        """
+        self.module = module
+        self.name = name
+        self.cache = cache
+
+    def __set_name__(self, owner, attribute: str):
+        self.attribute = attribute
+
+    def __get__(self, client, owner=None):
+        if client is None:
+            return self
+        cls = getattr(import_module(self.module, __package__), self.name)
+        args = (client.api_key, client.transport)
+        if self.cache is not None:
+            args += (getattr(client, self.cache),)
+        # Stored on the instance, which shadows this descriptor from now on
+        sub_client = client.__dict__[self.attribute] = cls(*args)
+        return sub_client
 
 
 class ShardClient:
-    def __init__(self, api_key: str):
+    chat = _SubClient(".chat", "Chat")
+    chat_async = _SubClient(".chat", "ChatAsync")
+    image = _SubClient(".image", "Image", "image_cache")
+    image_async = _SubClient(".image", "ImageAsync", "image_cache")
+    tts = _SubClient(".tts", "TTS", "audio_cache")
+    tts_async = _SubClient(".tts", "TTSAsync", "audio_cache")
+    moderation = _SubClient(".moderation", "Moderation", "moderation_cache")
+    moderation_async = _SubClient(".moderation", "ModerationAsync", "moderation_cache")
+
+    def __init__(
+        self,
+        api_key,
+        base_url: str = BASE_URL,
+        pool_size: int = 10,
+        limit_per_host: int = 0,
+        keepalive_timeout: float = 30,
+        dns_cache_ttl: int = 300,
+        rate_limiter: RateLimiter = None,
+        retry_policy: RetryPolicy = None,
+        connect_timeout: float = 10,
+        read_timeout: float = 300,
+        hedge_policy: HedgePolicy = None,
+        discovery_ttl: float = 300,
+        discovery_cache_path: str = None,
+        image_cache: ImageCache = None,
+        audio_cache: AudioCache = None,
+        moderation_cache: ModerationCache = None,
+        coalesce: bool = False,
+        json_decoder=None,
+        lazy_json: bool = False,
+        circuit_breaker: CircuitBreaker = None,
+        concurrency_limiter: ConcurrencyLimiter = None,
+        scheduler: Scheduler = None,
+    ):
+        """
+        :param api_key: The API key to use, or an APIKeyPool (or a list of keys)
+        :param base_url: The base url of the API
+        :param pool_size: The maximum number of pooled connections
+        :param limit_per_host: The maximum connections per host (0 for no limit)
+        :param keepalive_timeout: How long idle async connections are kept alive
+        :param dns_cache_ttl: How long resolved hosts are cached by the async session
+        :param rate_limiter: A RateLimiter shared by the sync and async sub-clients
+        :param retry_policy: The retry policy for transient failures
+        :param connect_timeout: The connect timeout of every attempt, in seconds
+        :param read_timeout: The read timeout of every attempt, in seconds
+        :param hedge_policy: The hedge policy for idempotent requests, if any
+        :param discovery_ttl: How long discovery responses are cached (0 disables it)
+        :param discovery_cache_path: A json file the discovery cache is persisted to
+        :param image_cache: An ImageCache for image generations with an explicit seed
+        :param audio_cache: An AudioCache for text to speech phrases
+        :param moderation_cache: A ModerationCache for moderation verdicts
+        :param coalesce: Whether identical concurrent async requests share one response
+        :param json_decoder: The function decoding json bodies (json.loads by default)
+        :param lazy_json: Whether responses are decoded lazily through a JSONView
+        :param circuit_breaker: A CircuitBreaker failing fast on degraded endpoints
+        :param concurrency_limiter: A ConcurrencyLimiter adapting in-flight requests
+        :param scheduler: A Scheduler sharing one concurrency budget by priority
+        """
+        if not isinstance(api_key, (str, APIKeyPool)) and api_key is not None:
+            api_key = APIKeyPool(api_key)
         self.api_key = api_key
-        self.chat = Chat(api_key)
-        self.chat_async = ChatAsync(api_key)
-        self.image = Image(api_key)
-        self.image_async = ImageAsync(api_key)
-        self.tts = TTS(api_key)
-        self.tts_async = TTSAsync(api_key)
-        self.moderation = Moderation(api_key)
-        self.moderation_async = ModerationAsync(api_key)
+        self.transport = Transport(
+            base_url,
+            pool_size,
+            limit_per_host,
+            keepalive_timeout,
+            dns_cache_ttl,
+            rate_limiter,
+            retry_policy,
+            connect_timeout,
+            read_timeout,
+            hedge_policy,
+            TTLCache(discovery_ttl, discovery_cache_path) if discovery_ttl else None,
+            coalesce,
+            json_decoder,
+            lazy_json,
+            circuit_breaker,
+            concurrency_limiter,
+            scheduler,
+        )
+        self.image_cache = image_cache
+        self.audio_cache = audio_cache
+        self.moderation_cache = moderation_cache
+
+    def options(self, **options):
+        """
+        Set per-call options for the requests sent inside a with block
+
+        :param deadline: The time budget of a call across all its attempts, in seconds
+        :param hedge: Whether idempotent requests may be hedged (True by default)
+        :param lazy_json: Whether responses are decoded lazily through a JSONView
+        :param priority: The Scheduler priority class of the requests
+        """
+        return request_options(**options)
+
+    def refresh_discovery(self):
+        """
+        Drop the cached models, options, voices and attributes
+        """
+        if self.transport.discovery_cache is not None:
+            self.transport.discovery_cache.invalidate()
+
+    def _loaders(self, suffix: str = "") -> list:
+        """
+        Return the discovery methods of the sync (or async) sub-clients
+        """
+        image = getattr(self, "image" + suffix)
+        return [
+            getattr(self, "chat" + suffix).models,
+            image.options,
+            image.sdxl_options,
+            getattr(self, "tts" + suffix).voices,
+            getattr(self, "moderation" + suffix).attributes,
+        ]
+
+    def warmup(self, connections: int = None, prefetch: bool = False) -> int:
+        """
+        Open pooled connections ahead of traffic, so the first requests skip the
+        DNS lookup and TLS handshake
+
+        :param connections: The number of idle connections to open (the pool size
+            by default)
+        :param prefetch: Whether to also load the models, options, voices and
+            attributes into the discovery cache (failures are ignored)
+
+        :return: The number of connections opened
+        """
+        opened = self.transport.warmup(connections or self.transport.pool_size)
+        if prefetch:
+            executor = self.transport.executor
+            calls = [
+                executor.submit(copy_context().run, loader)
+                for loader in self._loaders()
+            ]
+            for call in calls:
+                try:
+                    call.result()
+                except APIError:
+                    pass
+        return opened
+
+    async def warmup_async(
+        self, connections: int = None, prefetch: bool = False
+    ) -> int:
+        """
+        Open pooled async connections ahead of traffic, so the first requests skip
+        the DNS lookup and TLS handshake
+
+        Idle async connections are closed after keepalive_timeout seconds.
+
+        :param connections: The number of idle connections to open (the pool size
+            by default)
+        :param prefetch: Whether to also load the models, options, voices and
+            attributes into the discovery cache (failures are ignored)
+
+        :return: The number of connections opened
+        """
+        from asyncio import gather
+
+        opened = await self.transport.warmup_async(
+            connections or self.transport.pool_size
+        )
+        if prefetch:
+            results = await gather(
+                *[loader() for loader in self._loaders("_async")],
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, Exception) and not isinstance(result, APIError):
+                    raise result
+        return opened
+
+    def close(self):
+        """
+        Close the pooled connections shared by the sub-clients
+        """
+        self.transport.close()
+
+    async def close_async(self):
+        """
+        Close the pooled connections shared by the sub-clients asynchronously
+        """
+        await self.transport.close_async()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close_async()
 
     def __repr__(self):
         return f"<ShardClient api_key={self.api_key}>"
@@ -0,0 +1,191 @@
+from threading import Condition, Lock
+from time import monotonic
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdaptiveLimit:
+    """
+    Adaptive concurrency limit of one endpoint (additive increase, multiplicative
+    decrease)
+
+    The limit grows by about one slot per round of calls while the endpoint is
+    kept busy and latency stays within tolerance times its baseline. It is cut
+    by decrease when latency inflates or a call fails (connection errors,
+    timeouts, 429 and 5xx), at most once per round: calls sent before the last
+    cut do not cut it again. Threads and event loops share the same slots.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        initial: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        decrease: float = 0.5,
+        tolerance: float = 2.0,
+        smoothing: float = 0.05,
+    ):
+        """
+        :param endpoint: The endpoint the limit applies to
+        :param initial: The limit before any feedback
+        :param min_limit: The lowest the limit can be cut to
+        :param max_limit: The highest the limit can grow to
+        :param decrease: The factor the limit is multiplied by on congestion
+        :param tolerance: The latency, relative to the baseline, seen as congestion
+        :param smoothing: How fast the baseline follows latencies above it (0 to 1)
+        """
+        self.endpoint = endpoint
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self.baseline = None
+        self._last_cut = 0.0
+        self._waiters = []
+        self._lock = Lock()
+        self._condition = Condition(self._lock)
+
+    def _available(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def acquire(self, timeout: float = None) -> bool:
+        """
+        Take a slot, blocking the thread until one is free
+
+        :param timeout: The longest to wait, in seconds (None to wait forever)
+
+        :return: Whether a slot was taken before the timeout
+        """
+        with self._condition:
+            if not self._condition.wait_for(self._available, timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    async def acquire_async(self, timeout: float = None) -> bool:
+        """
+        Take a slot, waiting without blocking the event loop
+
+        :param timeout: The longest to wait, in seconds (None to wait forever)
+
+        :return: Whether a slot was taken before the timeout
+        """
+        from asyncio import TimeoutError, get_running_loop, wait_for
+
+        end = None if timeout is None else monotonic() + timeout
+        while True:
+            with self._lock:
+                if self._available():
+                    self.in_flight += 1
+                    return True
+                future = get_running_loop().create_future()
+                self._waiters.append(future)
+            try:
+                await wait_for(future, None if end is None else end - monotonic())
+            except TimeoutError:
+                return False
+
+    def _adapt(self, latency: float, failed: bool, started: float):
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            self.baseline += (latency - self.baseline) * self.smoothing
+        if failed or latency > self.baseline * self.tolerance:
+            if started is None or started >= self._last_cut:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self._last_cut = monotonic()
+        elif self.in_flight >= self.limit / 2:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def release(self, latency: float = None, failed: bool = False, started=None):
+        """
+        Give a slot back, with the outcome of its call if it completed
+
+        :param latency: The duration of the call, or None if it was abandoned
+        :param failed: Whether the call failed in a way that signals congestion
+        :param started: When the call was sent (monotonic time)
+        """
+        with self._condition:
+            if latency is not None:
+                self._adapt(latency, failed, started)
+            self.in_flight -= 1
+            self._condition.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for future in waiters:
+            future.get_loop().call_soon_threadsafe(_wake, future)
+
+    def __repr__(self):
+        return f"<AdaptiveLimit endpoint={self.endpoint} limit={int(self.limit)}>"
+
+    def __str__(self):
+        return f"<AdaptiveLimit endpoint={self.endpoint} limit={int(self.limit)}>"
+
+
+class ConcurrencyLimiter:
+    """
+    Per endpoint adaptive concurrency limits shared by every sub-client
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        decrease: float = 0.5,
+        tolerance: float = 2.0,
+        limits: dict = None,
+    ):
+        """
+        :param initial: The default limit before any feedback
+        :param min_limit: The lowest a limit can be cut to
+        :param max_limit: The highest a limit can grow to
+        :param decrease: The factor a limit is multiplied by on congestion
+        :param tolerance: The latency, relative to the baseline, seen as congestion
+        :param limits: Per endpoint overrides, mapping an endpoint name (chat, sd1x,
+            sdxl, sdxl-turbo, tts, moderation) to a dict of the arguments above
+        """
+        self.settings = {
+            "initial": initial,
+            "min_limit": min_limit,
+            "max_limit": max_limit,
+            "decrease": decrease,
+            "tolerance": tolerance,
+        }
+        self.limits = limits or {}
+        self._limits = {}
+        self._lock = Lock()
+
+    def limit(self, endpoint: str) -> AdaptiveLimit:
+        """
+        Return the limit of an endpoint, creating it on first use
+        """
+        limit = self._limits.get(endpoint)
+        if limit is None:
+            with self._lock:
+                limit = self._limits.get(endpoint)
+                if limit is None:
+                    settings = {**self.settings, **self.limits.get(endpoint, {})}
+                    limit = self._limits[endpoint] = AdaptiveLimit(endpoint, **settings)
+        return limit
+
+    def current(self) -> dict:
+        """
+        Return the current limit and in-flight calls of every endpoint used so far
+        """
+        return {
+            endpoint: {"limit": int(limit.limit), "in_flight": limit.in_flight}
+            for endpoint, limit in self._limits.items()
+        }
+
+    def __repr__(self):
+        return f"<ConcurrencyLimiter limits={self.current()}>"
+
+    def __str__(self):
+        return f"<ConcurrencyLimiter limits={self.current()}>"
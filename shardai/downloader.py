@@ -0,0 +1,266 @@
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from json import dumps, loads
+from os import fdopen, makedirs, remove, replace
+from os.path import dirname, exists, join, splitext
+from tempfile import mkstemp
+from threading import Lock
+from urllib.parse import urlsplit
+
+from .batch import gather_bounded, map_bounded
+from .objects import TTSResponse
+
+_EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+    "audio/mp3": ".mp3",
+    "audio/mpeg": ".mp3",
+    "audio/wav": ".wav",
+    "audio/ogg": ".ogg",
+}
+
+
+def _extension(response) -> str:
+    """
+    Guess the file extension of a response from its data URI or url
+    """
+    head = response.raw[:2048]
+    if not isinstance(head, str):
+        head = bytes(head).decode("utf-8", "replace")
+    default = ".mp3" if isinstance(response, TTSResponse) else ".png"
+    if head.startswith("data:"):
+        mime = head[5:].split(",", 1)[0].split(";", 1)[0]
+        return _EXTENSIONS.get(mime, default)
+    return splitext(urlsplit(head).path)[1] or default
+
+
+def _write(path: str, data: bytes):
+    """
+    Write a file through a temporary file of its own, so concurrent writers of
+    the same content never share a partial file
+    """
+    descriptor, temporary = mkstemp(".part", dir=dirname(path))
+    try:
+        with fdopen(descriptor, "wb") as file:
+            file.write(data)
+        replace(temporary, path)
+    except BaseException:
+        remove(temporary)
+        raise
+
+
+def _key(response):
+    """
+    Identify the transfers of a batch: the url, or a hash of an inline payload
+    """
+    url = response.url
+    if url is not None:
+        return url
+    raw = response.raw
+    return sha256(raw.encode() if isinstance(raw, str) else raw).hexdigest()
+
+
+class Downloader:
+    """
+    Save many ImageResponse and TTSResponse objects to a directory concurrently
+
+    Files are named after the sha256 of their content, so identical results are
+    stored once and a url seen twice is downloaded once. A manifest in the
+    directory records the urls already saved, and interrupted transfers are
+    kept as .part files and resumed with Range requests, so running a batch
+    again after a crash only fetches what is missing.
+    """
+
+    manifest = ".shardai-downloads.jsonl"
+
+    def __init__(
+        self,
+        directory: str,
+        concurrency: int = 8,
+        chunk_size: int = 65536,
+        progress=None,
+    ):
+        """
+        :param directory: The directory the files are saved to
+        :param concurrency: The maximum number of transfers in flight
+        :param chunk_size: The number of bytes downloaded at a time
+        :param progress: A function called with (done, total, path) after each file
+        """
+        makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self._lock = Lock()
+        self._saved = self._load()
+
+    def _load(self) -> dict:
+        """
+        Read the manifest, ignoring entries whose file is gone
+        """
+        saved = {}
+        path = join(self.directory, self.manifest)
+        if not exists(path):
+            return saved
+        with open(path) as file:
+            for line in file:
+                try:
+                    entry = loads(line)
+                except ValueError:
+                    continue
+                if exists(join(self.directory, entry["file"])):
+                    saved[entry["source"]] = entry["file"]
+        return saved
+
+    def _record(self, source: str, name: str):
+        with self._lock:
+            self._saved[source] = name
+            with open(join(self.directory, self.manifest), "a") as file:
+                file.write(dumps({"source": source, "file": name}) + "\n")
+
+    def _finish(self, source: str, temporary: str, digest: str, extension: str):
+        """
+        Move a finished transfer to its content name, dropping it if a copy exists
+        """
+        name = f"{digest}{extension}"
+        path = join(self.directory, name)
+        if exists(path):
+            remove(temporary)
+        else:
+            replace(temporary, path)
+        self._record(source, name)
+        return path
+
+    def _save_data(self, response) -> str:
+        data = response.as_bytes()
+        path = join(self.directory, sha256(data).hexdigest() + _extension(response))
+        if not exists(path):
+            _write(path, data)
+        return path
+
+    def _plan(self, responses) -> tuple:
+        """
+        Return the distinct transfers of a batch and, per response, its transfer
+        """
+        jobs, positions, indexes = [], {}, []
+        for response in responses:
+            key = _key(response)
+            if key not in positions:
+                positions[key] = len(jobs)
+                jobs.append(response)
+            indexes.append(positions[key])
+        return jobs, indexes
+
+    def _tracker(self, total: int):
+        done = [0]
+        lock = Lock()
+
+        def advance(path):
+            with lock:
+                done[0] += 1
+                count = done[0]
+            if self.progress is not None:
+                self.progress(count, total, path)
+
+        return advance
+
+    def _save(self, response, advance) -> str:
+        url = response.url
+        if url is None:
+            path = self._save_data(response)
+        else:
+            source = sha256(url.encode()).hexdigest()
+            name = self._saved.get(source)
+            if name is None:
+                temporary = join(self.directory, f"{source}.download")
+                digest = response.download(
+                    temporary, self.chunk_size, "sha256", resume=True
+                )
+                path = self._finish(source, temporary, digest, _extension(response))
+            else:
+                path = join(self.directory, name)
+        advance(path)
+        return path
+
+    async def _save_async(self, response, advance) -> str:
+        from asyncio import get_running_loop
+
+        loop = get_running_loop()
+        url = response.url
+        if url is None:
+            path = await loop.run_in_executor(None, self._save_data, response)
+        else:
+            source = sha256(url.encode()).hexdigest()
+            name = self._saved.get(source)
+            if name is None:
+                temporary = join(self.directory, f"{source}.download")
+                digest = await response.download_async(
+                    temporary, self.chunk_size, "sha256", resume=True
+                )
+                path = await loop.run_in_executor(
+                    None,
+                    self._finish,
+                    source,
+                    temporary,
+                    digest,
+                    _extension(response),
+                )
+            else:
+                path = join(self.directory, name)
+        advance(path)
+        return path
+
+    def download(self, responses, return_exceptions: bool = False) -> list:
+        """
+        Save responses on a thread pool, at most concurrency at a time
+
+        :param responses: An iterable of ImageResponse or TTSResponse objects
+        :param return_exceptions: Whether to return exceptions instead of raising
+
+        :return: The path of every response, in order
+        """
+        jobs, indexes = self._plan(responses)
+        with ThreadPoolExecutor(
+            self.concurrency, thread_name_prefix="shardai-download"
+        ) as executor:
+            paths = map_bounded(
+                executor,
+                self._save,
+                [(job,) for job in jobs],
+                self.concurrency,
+                None,
+                return_exceptions,
+                advance=self._tracker(len(jobs)),
+            )
+        return [paths[index] for index in indexes]
+
+    async def download_async(
+        self, responses, return_exceptions: bool = False
+    ) -> list:
+        """
+        Save responses over the shared async session, at most concurrency at a time
+
+        :param responses: An iterable of ImageResponse or TTSResponse objects
+        :param return_exceptions: Whether to return exceptions instead of raising
+
+        :return: The path of every response, in order
+        """
+        jobs, indexes = self._plan(responses)
+        paths = await gather_bounded(
+            self._save_async,
+            [(job,) for job in jobs],
+            self.concurrency,
+            return_exceptions,
+            advance=self._tracker(len(jobs)),
+        )
+        return [paths[index] for index in indexes]
+
+    def __len__(self):
+        return len(self._saved)
+
+    def __repr__(self):
+        return f"<Downloader directory={self.directory} saved={len(self._saved)}>"
+
+    def __str__(self):
+        return f"<Downloader directory={self.directory} saved={len(self._saved)}>"
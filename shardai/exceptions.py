@@ -1,16 +1,36 @@
-class InvalidAPIKeyError(Exception):
-    def __init__(self, error):
-        self.error = error
-
-
 class NoAPIKeyError(Exception):
     def __init__(self, error):
         self.error = error
 
 
 class APIError(Exception):
-    def __init__(self, error):
+    def __init__(self, error, status: int = None, attempts: int = None):
+        """
+        :param error: The error message
+        :param status: The HTTP status of the last attempt (None without a response)
+        :param attempts: The number of attempts made before giving up
+        """
         self.error = error
+        self.status = status
+        self.attempts = attempts
+
+
+class InvalidAPIKeyError(APIError):
+    """
+    The API rejected the key (401 or 403), or every key of a pool was rejected
+    """
+
+
+class CircuitOpenError(APIError):
+    def __init__(self, error, endpoint: str = None, retry_in: float = None):
+        """
+        :param error: The error message
+        :param endpoint: The endpoint whose circuit is open
+        :param retry_in: The number of seconds before a trial call is let through
+        """
+        super().__init__(error, attempts=0)
+        self.endpoint = endpoint
+        self.retry_in = retry_in
 
 
 class NoInputError(Exception):
@@ -0,0 +1,83 @@
+from collections import deque
+from threading import Lock
+
+
+class LatencyHistogram:
+    """
+    Sliding window of the most recent latencies of one endpoint
+    """
+
+    def __init__(self, size: int = 512):
+        """
+        :param size: The number of latencies kept
+        """
+        self.samples = deque(maxlen=size)
+        self._lock = Lock()
+
+    def record(self, latency: float):
+        """
+        Record the latency of a successful request, in seconds
+        """
+        with self._lock:
+            self.samples.append(latency)
+
+    def percentile(self, percentile: float):
+        """
+        Return a latency percentile (0 to 1), or None without samples
+        """
+        with self._lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(percentile * len(samples)))
+        return samples[index]
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __repr__(self):
+        return f"<LatencyHistogram samples={len(self.samples)}>"
+
+    def __str__(self):
+        return f"<LatencyHistogram samples={len(self.samples)}>"
+
+
+class HedgePolicy:
+    """
+    When to send a second copy of an idempotent request
+
+    If no answer arrived after the configured latency percentile of the
+    endpoint, an identical request is sent and the first one to succeed wins.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        initial_delay: float = 1.0,
+        min_delay: float = 0.01,
+        min_samples: int = 20,
+    ):
+        """
+        :param percentile: The latency percentile after which a hedge is sent (0 to 1)
+        :param initial_delay: The hedge delay used until enough samples are recorded
+        :param min_delay: The lowest hedge delay, in seconds
+        :param min_samples: The number of samples needed before using the percentile
+        """
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+
+    def delay(self, histogram: LatencyHistogram) -> float:
+        """
+        Return how long to wait for the first request before hedging it
+        """
+        if histogram is None or len(histogram) < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, histogram.percentile(self.percentile))
+
+    def __repr__(self):
+        return f"<HedgePolicy percentile={self.percentile}>"
+
+    def __str__(self):
+        return f"<HedgePolicy percentile={self.percentile}>"
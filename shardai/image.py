@@ -1,15 +1,57 @@
 from random import randint
 
-from aiohttp import ClientSession
-from requests import get
-
+from .batch import gather_bounded, iter_bounded, map_bounded
+from .cache import ImageCache
 from .exceptions import *
-from .objects import ImageOptions, ImageResponse
+from .jsonview import raw_field
+from .objects import ImageOptions, ImageResponse, _mime_of
+from .transport import Transport
+
+
+def _cache_response(cache: ImageCache, key: str, response: ImageResponse):
+    """
+    Store the decoded image of a response in the cache
+
+    The bytes are kept on the response, so reading them again does not download
+    or decode the image a second time.
+    """
+    try:
+        cache.store(key, response, response.as_bytes(), _mime_of(response, "image/png"))
+    except (APIError, OSError, ValueError):
+        pass
 
 
 class ImageAsync:
-    def __init__(self, api_key: str):
+    def __init__(
+        self, api_key: str, transport: Transport = None, cache: ImageCache = None
+    ):
         self.api_key = api_key
+        self.transport = transport or Transport()
+        self.cache = cache
+
+    async def _load(self, key: str):
+        """
+        Return the cached image of a key, reading the disk on a worker thread
+        """
+        from asyncio import get_running_loop
+
+        return await get_running_loop().run_in_executor(None, self.cache.load, key)
+
+    async def _store(self, key: str, response: ImageResponse):
+        """
+        Store the decoded image of a response in the cache, writing the disk on a
+        worker thread
+        """
+        from asyncio import get_running_loop
+
+        if response.url is not None:
+            try:
+                await response.as_bytes_async()
+            except APIError:
+                return
+        await get_running_loop().run_in_executor(
+            None, _cache_response, self.cache, key, response
+        )
 
     async def completions(
         self,
@@ -21,7 +63,7 @@ class ImageAsync:
         steps: int = 15,
         style: str = "enhance",
         negative_prompt: str = None,
-        seed: int = randint(0, 10000000000),
+        seed: int = None,
         base64: bool = False,
     ) -> ImageResponse:
         """
@@ -35,7 +77,7 @@ class ImageAsync:
         :param steps: The steps to use for the image
         :param style: The style to use for the image
         :param negative_prompt: The negative prompt to use for the image
-        :param seed: The seed to use for the image
+        :param seed: The seed to use for the image (random if not set)
         :param base64: Whether to return the image as base64
 
         :return: The image response
@@ -45,6 +87,9 @@ class ImageAsync:
         if prompt is None:
             raise NoInputError("Prompt is required for this function")
         headers = {"api-key": self.api_key, "Content-Type": "application/json"}
+        seeded = seed is not None
+        if not seeded:
+            seed = randint(0, 10000000000)
         payload = {
             "prompt": prompt,
             "sampler": sampler,
@@ -57,39 +102,94 @@ class ImageAsync:
             "style": style,
             "base64": base64,
         }
-        async with ClientSession() as session:
-            async with session.post(
-                "https://shard-ai.xyz/v1/sd1x/completions",
-                json=payload,
-                headers=headers,
-            ) as response:
-                json_response = await response.json()
-                if response.status != 200:
-                    raise APIError(f"Error: {response.status}")
-                return ImageResponse(
-                    json_response["image"],
-                    json_response["generation-time"],
-                    json_response["warning!"],
-                    json_response["info"]["model"],
-                )
-
-    async def options(self) -> ImageOptions:
+        key = None
+        if seeded and self.cache is not None:
+            key = self.cache.payload_key("/v1/sd1x/completions", payload)
+            cached = await self._load(key)
+            if cached is not None:
+                return cached
+        json_response = await self.transport.request_async(
+            "POST", "/v1/sd1x/completions", payload, headers, idempotent=seeded
+        )
+        response = ImageResponse(
+            raw_field(json_response, "image"),
+            json_response["generation-time"],
+            json_response["warning!"],
+            json_response["info"]["model"],
+            transport=self.transport,
+        )
+        if key is not None:
+            await self._store(key, response)
+        return response
+
+    async def completions_many(
+        self,
+        requests,
+        concurrency: int = 8,
+        return_exceptions: bool = False,
+        method: str = "completions",
+        **kwargs,
+    ) -> list:
+        """
+        Run many image generation requests concurrently over the shared session
+
+        :param requests: An iterable of kwargs dicts, args tuples or prompts
+        :param concurrency: The maximum number of requests in flight
+        :param method: completions, sdxl_completions or turbo_completions
+        :param return_exceptions: Whether to return exceptions instead of raising
+        :param kwargs: Keyword arguments shared by every request
+
+        :return: The responses in the order of the requests
+        """
+        if method not in ("completions", "sdxl_completions", "turbo_completions"):
+            raise ValueError(f"Unknown image method: {method}")
+        completions = getattr(self, method)
+        return await gather_bounded(
+            completions, requests, concurrency, return_exceptions, **kwargs
+        )
+
+    def completions_iter(
+        self,
+        requests,
+        window: int = 8,
+        return_exceptions: bool = False,
+        method: str = "completions",
+        **kwargs,
+    ):
+        """
+        Run many image requests, yielding each response as soon as it finishes
+
+        :param requests: An iterable of kwargs dicts, args tuples or prompts
+        :param window: The maximum number of requests in flight
+        :param method: completions, sdxl_completions or turbo_completions
+        :param return_exceptions: Whether to yield exceptions instead of raising
+        :param kwargs: Keyword arguments shared by every request
+
+        :return: An async generator of (index, response) tuples
+        """
+        if method not in ("completions", "sdxl_completions", "turbo_completions"):
+            raise ValueError(f"Unknown image method: {method}")
+        return iter_bounded(
+            getattr(self, method), requests, window, return_exceptions, **kwargs
+        )
+
+    async def options(self, refresh: bool = False) -> ImageOptions:
         """
         Get available options
 
+        :param refresh: Whether to bypass the cache and fetch them again
+
         :return: The image options
         """
-        async with ClientSession() as session:
-            async with session.get("https://shard-ai.xyz/v1/sd1x/models") as response:
-                json_response = await response.json()
-                if response.status != 200:
-                    raise APIError(f"Error: {response.status}")
-                return ImageOptions(
-                    json_response["models"],
-                    json_response["ratios"],
-                    json_response["samplers"],
-                    json_response["upscale"],
-                )
+        json_response = await self.transport.request_async(
+            "GET", "/v1/sd1x/models", idempotent=True, cached=True, refresh=refresh
+        )
+        return ImageOptions(
+            json_response["models"],
+            json_response["ratios"],
+            json_response["samplers"],
+            json_response["upscale"],
+        )
 
     async def sdxl_completions(
         self,
@@ -101,7 +201,7 @@ class ImageAsync:
         steps: int = 15,
         style: str = "enhance",
         negative_prompt: str = None,
-        seed: int = randint(0, 10000000000),
+        seed: int = None,
         upscale: bool = False,
         base64: bool = False,
     ) -> ImageResponse:
@@ -116,7 +216,7 @@ class ImageAsync:
         :param steps: The steps to use for the image
         :param style: The style to use for the image
         :param negative_prompt: The negative prompt to use for the image
-        :param seed: The seed to use for the image
+        :param seed: The seed to use for the image (random if not set)
         :param upscale: Whether to upscale the image
         :param base64: Whether to return the image as base64
 
@@ -127,6 +227,9 @@ class ImageAsync:
         if prompt is None:
             raise NoInputError("Prompt is required for this function")
         headers = {"api-key": self.api_key, "Content-Type": "application/json"}
+        seeded = seed is not None
+        if not seeded:
+            seed = randint(0, 10000000000)
         payload = {
             "prompt": prompt,
             "sampler": sampler,
@@ -140,40 +243,44 @@ class ImageAsync:
             "upscale": upscale,
             "base64": base64,
         }
-        async with ClientSession() as session:
-            async with session.post(
-                "https://shard-ai.xyz/v1/sdxl/completions",
-                json=payload,
-                headers=headers,
-            ) as response:
-                json_response = await response.json()
-                if response.status != 200:
-                    raise APIError(f"Error: {response.status}")
-                return ImageResponse(
-                    json_response["image"],
-                    json_response["generation-time"],
-                    json_response["warning!"],
-                    json_response["info"]["model"],
-                )
-
-    async def sdxl_options(self) -> ImageOptions:
+        key = None
+        if seeded and self.cache is not None:
+            key = self.cache.payload_key("/v1/sdxl/completions", payload)
+            cached = await self._load(key)
+            if cached is not None:
+                return cached
+        json_response = await self.transport.request_async(
+            "POST", "/v1/sdxl/completions", payload, headers, idempotent=seeded
+        )
+        response = ImageResponse(
+            raw_field(json_response, "image"),
+            json_response["generation-time"],
+            json_response["warning!"],
+            json_response["info"]["model"],
+            transport=self.transport,
+        )
+        if key is not None:
+            await self._store(key, response)
+        return response
+
+    async def sdxl_options(self, refresh: bool = False) -> ImageOptions:
         """
         Get available options for SDXL
 
+        :param refresh: Whether to bypass the cache and fetch them again
+
         :return: The image options
         """
-        async with ClientSession() as session:
-            async with session.get("https://shard-ai.xyz/v1/sdxl/models") as response:
-                json_response = await response.json()
-                if response.status != 200:
-                    raise APIError(f"Error: {response.status}")
-                return ImageOptions(
-                    json_response["models"],
-                    json_response["ratios"],
-                    json_response["samplers"],
-                    None,
-                    json_response["styles"],
-                )
+        json_response = await self.transport.request_async(
+            "GET", "/v1/sdxl/models", idempotent=True, cached=True, refresh=refresh
+        )
+        return ImageOptions(
+            json_response["models"],
+            json_response["ratios"],
+            json_response["samplers"],
+            None,
+            json_response["styles"],
+        )
 
     async def turbo_completions(
         self,
@@ -203,26 +310,31 @@ class ImageAsync:
             "style": style,
             "base64": base64,
         }
-        async with ClientSession() as session:
-            async with session.post(
-                "https://shard-ai.xyz/v1/sdxl-turbo/completions",
-                json=payload,
-                headers=headers,
-            ) as response:
-                json_response = await response.json()
-                if response.status != 200:
-                    raise APIError(f"Error: {response.status}")
-                return ImageResponse(
-                    json_response["image"],
-                    json_response["generation-time"],
-                    json_response["warning!"],
-                    json_response["info"]["model"],
-                )
+        json_response = await self.transport.request_async(
+            "POST", "/v1/sdxl-turbo/completions", payload, headers
+        )
+        return ImageResponse(
+            raw_field(json_response, "image"),
+            json_response["generation-time"],
+            json_response["warning!"],
+            json_response["info"]["model"],
+            transport=self.transport,
+        )
 
 
 class Image:
-    def __init__(self, api_key: str):
+    def __init__(
+        self, api_key: str, transport: Transport = None, cache: ImageCache = None
+    ):
         self.api_key = api_key
+        self.transport = transport or Transport()
+        self.cache = cache
+
+    def _store(self, key: str, response: ImageResponse):
+        """
+        Store the decoded image of a response in the cache
+        """
+        _cache_response(self.cache, key, response)
 
     def completions(
         self,
@@ -233,7 +345,7 @@ class Image:
         cfg: int = 4,
         steps: int = 15,
         negative_prompt: str = None,
-        seed: int = randint(0, 10000000000),
+        seed: int = None,
     ) -> ImageResponse:
         """
         Image generation function
@@ -245,7 +357,7 @@ class Image:
         :param cfg: The cfg to use for the image
         :param steps: The steps to use for the image
         :param negative_prompt: The negative prompt to use for the image
-        :param seed: The seed to use for the image
+        :param seed: The seed to use for the image (random if not set)
 
         :return: The image response
         """
@@ -254,6 +366,9 @@ class Image:
         if prompt is None:
             raise NoInputError("Prompt is required for this function")
         headers = {"api-key": self.api_key, "Content-Type": "application/json"}
+        seeded = seed is not None
+        if not seeded:
+            seed = randint(0, 10000000000)
         payload = {
             "prompt": prompt,
             "sampler": sampler,
@@ -264,16 +379,56 @@ class Image:
             "negative_prompt": negative_prompt,
             "seed": seed,
         }
-        response = get(
-            "https://shard-ai.xyz/v1/sd1x/completions", json=payload, headers=headers
+        key = None
+        if seeded and self.cache is not None:
+            key = self.cache.payload_key("/v1/sd1x/completions", payload)
+            cached = self.cache.load(key)
+            if cached is not None:
+                return cached
+        response_json = self.transport.request(
+            "GET", "/v1/sd1x/completions", payload, headers, idempotent=seeded
         )
-        if response.status_code != 200:
-            raise APIError(f"Error: {response.status_code}")
-        response_json = response.json()
-        return ImageResponse(
-            response_json["image"],
+        response = ImageResponse(
+            raw_field(response_json, "image"),
             response_json["generation-time"],
             response_json["Warning!"],
+            transport=self.transport,
+        )
+        if key is not None:
+            self._store(key, response)
+        return response
+
+    def completions_map(
+        self,
+        requests,
+        max_workers: int = None,
+        timeout: float = None,
+        return_exceptions: bool = False,
+        method: str = "completions",
+        **kwargs,
+    ) -> list:
+        """
+        Run many image generation requests on the shared thread pool
+
+        :param requests: An iterable of kwargs dicts, args tuples or prompts
+        :param max_workers: The maximum requests in flight (the pool size by default)
+        :param timeout: The maximum number of seconds a single request may take
+        :param method: completions, sdxl_completions or turbo_completions
+        :param return_exceptions: Whether to return exceptions instead of raising
+        :param kwargs: Keyword arguments shared by every request
+
+        :return: The responses in the order of the requests
+        """
+        if method not in ("completions", "sdxl_completions", "turbo_completions"):
+            raise ValueError(f"Unknown image method: {method}")
+        return map_bounded(
+            self.transport.executor,
+            getattr(self, method),
+            requests,
+            max_workers or self.transport.pool_size,
+            timeout,
+            return_exceptions,
+            **kwargs,
         )
 
     def sdxl_completions(
@@ -285,7 +440,7 @@ class Image:
         cfg: int = 4,
         steps: int = 15,
         negative_prompt: str = None,
-        seed: int = randint(0, 10000000000),
+        seed: int = None,
     ) -> ImageResponse:
         """
         SDXL Image generation function
@@ -297,7 +452,7 @@ class Image:
         :param cfg: The cfg to use for the image
         :param steps: The steps to use for the image
         :param negative_prompt: The negative prompt to use for the image
-        :param seed: The seed to use for the image
+        :param seed: The seed to use for the image (random if not set)
 
         :return: The image response
         """
@@ -306,6 +461,9 @@ class Image:
         if prompt is None:
             raise NoInputError("Prompt is required for this function")
         headers = {"api-key": self.api_key, "Content-Type": "application/json"}
+        seeded = seed is not None
+        if not seeded:
+            seed = randint(0, 10000000000)
         payload = {
             "prompt": prompt,
             "sampler": sampler,
@@ -316,29 +474,37 @@ class Image:
             "negative_prompt": negative_prompt,
             "seed": seed,
         }
-        response = get(
-            "https://shard-ai.xyz/v1/sdxl/completions", json=payload, headers=headers
+        key = None
+        if seeded and self.cache is not None:
+            key = self.cache.payload_key("/v1/sdxl/completions", payload)
+            cached = self.cache.load(key)
+            if cached is not None:
+                return cached
+        response_json = self.transport.request(
+            "GET", "/v1/sdxl/completions", payload, headers, idempotent=seeded
         )
-        if response.status_code != 200:
-            raise APIError(f"Error: {response.status_code}")
-        response_json = response.json()
-        return ImageResponse(
-            response_json["image"],
+        response = ImageResponse(
+            raw_field(response_json, "image"),
             response_json["generation-time"],
             response_json["warning!"],
             response_json["info"]["model"],
+            transport=self.transport,
         )
+        if key is not None:
+            self._store(key, response)
+        return response
 
-    def sdxl_options(self) -> ImageOptions:
+    def sdxl_options(self, refresh: bool = False) -> ImageOptions:
         """
         Get available options for SDXL
 
+        :param refresh: Whether to bypass the cache and fetch them again
+
         :return: The image options
         """
-        response = get("https://shard-ai.xyz/v1/sdxl/models")
-        if response.status_code != 200:
-            raise APIError(f"Error: {response.status_code}")
-        response_json = response.json()
+        response_json = self.transport.request(
+            "GET", "/v1/sdxl/models", idempotent=True, cached=True, refresh=refresh
+        )
         return ImageOptions(
             response_json["models"],
             response_json["ratios"],
@@ -369,31 +535,28 @@ class Image:
             "prompt": prompt,
             "negative_prompt": negative_prompt,
         }
-        response = get(
-            "https://shard-ai.xyz/v1/sdxl-turbo/completions",
-            json=payload,
-            headers=headers,
+        response_json = self.transport.request(
+            "GET", "/v1/sdxl-turbo/completions", payload, headers
         )
-        if response.status_code != 200:
-            raise APIError(f"Error: {response.status_code}")
-        response_json = response.json()
         return ImageResponse(
-            response_json["image"],
+            raw_field(response_json, "image"),
             response_json["generation-time"],
             response_json["warning!"],
             response_json["info"]["model"],
+            transport=self.transport,
         )
 
-    def options(self) -> ImageOptions:
+    def options(self, refresh: bool = False) -> ImageOptions:
         """
         Get available options
 
+        :param refresh: Whether to bypass the cache and fetch them again
+
         :return: The image options
         """
-        response = get("https://shard-ai.xyz/v1/sd1x/models")
-        if response.status_code != 200:
-            raise APIError(f"Error: {response.status_code}")
-        response_json = response.json()
+        response_json = self.transport.request(
+            "GET", "/v1/sd1x/models", idempotent=True, cached=True, refresh=refresh
+        )
         return ImageOptions(
             response_json["models"],
             response_json["ratios"],
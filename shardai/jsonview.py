@@ -0,0 +1,257 @@
+from collections.abc import Mapping, Sequence
+from json import loads
+from re import compile
+
+_WHITESPACE = b" \t\r\n"
+_LEADING_WHITESPACE = compile(rb"\s*")
+_STRUCTURE = compile(rb'["{}\[\]]')
+_SCALAR_END = compile(rb"[,}\]\s]")
+
+
+def _skip_whitespace(body: bytes, position: int) -> int:
+    while body[position] in _WHITESPACE:
+        position += 1
+    return position
+
+
+def _string_end(body: bytes, position: int) -> int:
+    """
+    Return the position after the closing quote of the string opened at position
+    """
+    end = position
+    while True:
+        end = body.index(b'"', end + 1)
+        backslashes = 0
+        while body[end - 1 - backslashes] == 0x5C:
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return end + 1
+
+
+def _value_end(body: bytes, position: int) -> int:
+    """
+    Return the position after the json value starting at position, without decoding it
+    """
+    first = body[position]
+    if first == 0x22:
+        return _string_end(body, position)
+    if first not in b"{[":
+        match = _SCALAR_END.search(body, position)
+        return match.start() if match else len(body)
+    depth = 0
+    while True:
+        match = _STRUCTURE.search(body, position)
+        if match is None:
+            raise ValueError("Unterminated json value")
+        position = match.start()
+        char = body[position]
+        if char == 0x22:
+            position = _string_end(body, position)
+            continue
+        depth += 1 if char in b"{[" else -1
+        position += 1
+        if depth == 0:
+            return position
+
+
+class _View:
+    __slots__ = ("_body", "_start", "_end", "_decoder", "_spans", "_values")
+
+    def __init__(self, body: bytes, start: int, end: int, decoder):
+        self._body = body
+        self._start = start
+        self._end = end
+        self._decoder = decoder
+        self._spans = None
+        self._values = {}
+
+    def _value(self, key, span: tuple):
+        if key in self._values:
+            return self._values[key]
+        start, end = span
+        first = self._body[start]
+        if first == 0x7B:
+            value = JSONView(self._body, start, end, self._decoder)
+        elif first == 0x5B:
+            value = JSONListView(self._body, start, end, self._decoder)
+        else:
+            value = self._decoder(self._body[start:end])
+        self._values[key] = value
+        return value
+
+    def _raw(self, span: tuple):
+        start, end = span
+        if self._body[start] != 0x22:
+            raise TypeError("Only string values have a raw form")
+        if self._body.find(b"\\", start, end) != -1:
+            return self._decoder(self._body[start:end]).encode()
+        return memoryview(self._body)[start + 1 : end - 1]
+
+    def decode(self):
+        """
+        Decode the whole value with the configured decoder
+        """
+        return self._decoder(self._body[self._start : self._end])
+
+    def __bytes__(self):
+        return self._body[self._start : self._end]
+
+
+class JSONView(_View, Mapping):
+    """
+    Read-only mapping over a json object kept as raw bytes
+
+    Keys are indexed on first access by scanning the object without decoding
+    its values. A value is decoded when it is read, and nested objects and
+    arrays are returned as views over the same buffer, so fields that are
+    never read are never decoded.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, body: bytes, start: int = 0, end: int = None, decoder=None):
+        """
+        :param body: The raw json body
+        :param start: The position of the opening brace in body
+        :param end: The position after the closing brace in body
+        :param decoder: The function decoding a json document (json.loads by default)
+        """
+        start = _skip_whitespace(body, start)
+        if body[start] != 0x7B:
+            raise ValueError("A JSONView needs a json object")
+        super().__init__(
+            body,
+            start,
+            _value_end(body, start) if end is None else end,
+            decoder or loads,
+        )
+
+    def _index(self) -> dict:
+        if self._spans is not None:
+            return self._spans
+        body = self._body
+        spans = {}
+        position = _skip_whitespace(body, self._start + 1)
+        while body[position] != 0x7D:
+            key_end = _string_end(body, position)
+            key = self._decoder(body[position:key_end])
+            position = _skip_whitespace(body, key_end)
+            if body[position] != 0x3A:
+                raise ValueError(f"Expected ':' at position {position}")
+            position = _skip_whitespace(body, position + 1)
+            end = _value_end(body, position)
+            spans[key] = (position, end)
+            position = _skip_whitespace(body, end)
+            if body[position] == 0x2C:
+                position = _skip_whitespace(body, position + 1)
+        self._spans = spans
+        return spans
+
+    def raw(self, key: str):
+        """
+        Return a string value as raw utf-8 bytes without building a str
+
+        The result is a memoryview over the response body unless the string
+        contains escape sequences, in which case it is decoded and re-encoded.
+        """
+        return self._raw(self._index()[key])
+
+    def __getitem__(self, key: str):
+        return self._value(key, self._index()[key])
+
+    def __contains__(self, key):
+        return key in self._index()
+
+    def __iter__(self):
+        return iter(self._index())
+
+    def __len__(self):
+        return len(self._index())
+
+    def __repr__(self):
+        return f"<JSONView keys={list(self._index())}>"
+
+    def __str__(self):
+        return f"<JSONView keys={list(self._index())}>"
+
+
+class JSONListView(_View, Sequence):
+    """
+    Read-only sequence over a json array kept as raw bytes
+    """
+
+    __slots__ = ()
+
+    def _index(self) -> list:
+        if self._spans is not None:
+            return self._spans
+        body = self._body
+        spans = []
+        position = _skip_whitespace(body, self._start + 1)
+        while body[position] != 0x5D:
+            end = _value_end(body, position)
+            spans.append((position, end))
+            position = _skip_whitespace(body, end)
+            if body[position] == 0x2C:
+                position = _skip_whitespace(body, position + 1)
+        self._spans = spans
+        return spans
+
+    def raw(self, index: int):
+        """
+        Return a string item as raw utf-8 bytes without building a str
+        """
+        return self._raw(self._index()[index])
+
+    def __getitem__(self, index):
+        spans = self._index()
+        if isinstance(index, slice):
+            return [self[position] for position in range(len(spans))[index]]
+        if index < 0:
+            index += len(spans)
+            if index < 0:
+                raise IndexError("JSONListView index out of range")
+        return self._value(index, spans[index])
+
+    def __len__(self):
+        return len(self._index())
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, tuple, JSONListView)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f"<JSONListView items={len(self._index())}>"
+
+    def __str__(self):
+        return f"<JSONListView items={len(self._index())}>"
+
+
+def parse(body: bytes, decoder=None):
+    """
+    Wrap a json body in a lazy view, or decode it if it is not an object or array
+
+    :param body: The raw json body
+    :param decoder: The function decoding a json document (json.loads by default)
+    """
+    decoder = decoder or loads
+    start = _LEADING_WHITESPACE.match(body).end()
+    first = body[start : start + 1]
+    if first == b"{":
+        return JSONView(body, start, None, decoder)
+    if first == b"[":
+        return JSONListView(body, start, _value_end(body, start), decoder)
+    return decoder(body)
+
+
+def raw_field(json_response, key: str):
+    """
+    Return a string field as raw bytes when the response is a lazy view
+
+    Large base64 payloads can then be decoded straight from the response body.
+    Eagerly decoded responses return the str value unchanged.
+    """
+    if isinstance(json_response, JSONView):
+        return json_response.raw(key)
+    return json_response[key]
@@ -0,0 +1,205 @@
+from threading import Lock
+from time import monotonic
+
+from .exceptions import InvalidAPIKeyError
+from .ratelimit import parse_retry_after
+
+
+class APIKey:
+    """
+    Usage and health of one key of an APIKeyPool
+    """
+
+    __slots__ = (
+        "key",
+        "weight",
+        "quota",
+        "in_flight",
+        "used",
+        "window_start",
+        "cooldown_until",
+        "failures",
+        "disabled",
+        "current",
+    )
+
+    def __init__(self, key: str, weight: float = 1.0, quota: int = None):
+        """
+        :param key: The API key
+        :param weight: The share of the traffic the key gets relative to the others
+        :param quota: The number of requests the key may send per quota period
+        """
+        self.key = key
+        self.weight = weight
+        self.quota = quota
+        self.in_flight = 0
+        self.used = 0
+        self.window_start = None
+        self.cooldown_until = 0.0
+        self.failures = 0
+        self.disabled = False
+        self.current = 0.0
+
+    def ready_at(self, now: float, period: float) -> float:
+        """
+        Return when the key may be used again (now or earlier if it is ready)
+        """
+        ready = self.cooldown_until
+        if self.quota is not None and self.window_start is not None:
+            if now >= self.window_start + period:
+                self.window_start, self.used = None, 0
+            elif self.used >= self.quota:
+                ready = max(ready, self.window_start + period)
+        return ready
+
+    def __repr__(self):
+        return f"<APIKey key={self.key[:8]} in_flight={self.in_flight}>"
+
+    def __str__(self):
+        return f"<APIKey key={self.key[:8]} in_flight={self.in_flight}>"
+
+
+class APIKeyPool:
+    """
+    Pool of API keys requests are spread over
+
+    Every attempt takes a key, either the least loaded one (fewest requests in
+    flight relative to its weight) or the next one of a smooth weighted round
+    robin. A key is paused after a 429 (for the Retry-After delay) or after
+    max_failures consecutive errors, skipped once its quota for the period
+    is used up, and taken out of rotation for good when the API rejects it.
+    """
+
+    strategies = ("least_loaded", "round_robin")
+
+    def __init__(
+        self,
+        keys,
+        strategy: str = "least_loaded",
+        quotas=None,
+        quota_period: float = 86400,
+        cooldown: float = 30,
+        max_failures: int = 3,
+    ):
+        """
+        :param keys: A list of API keys, or a dict mapping each key to its weight
+        :param strategy: How keys are picked (least_loaded or round_robin)
+        :param quotas: A request quota shared by every key, or a dict of per-key quotas
+        :param quota_period: The period the quotas apply to, in seconds
+        :param cooldown: How long a failing key is paused without Retry-After
+        :param max_failures: The consecutive errors after which a key is paused
+        """
+        if strategy not in self.strategies:
+            raise ValueError(f"strategy must be one of {', '.join(self.strategies)}")
+        weights = keys if isinstance(keys, dict) else dict.fromkeys(keys, 1.0)
+        if not weights:
+            raise ValueError("An APIKeyPool needs at least one key")
+        if not isinstance(quotas, dict):
+            quotas = dict.fromkeys(weights, quotas)
+        self.keys = {
+            key: APIKey(key, weight, quotas.get(key)) for key, weight in weights.items()
+        }
+        self.strategy = strategy
+        self.quota_period = quota_period
+        self.cooldown = cooldown
+        self.max_failures = max_failures
+        self._lock = Lock()
+
+    def _pick(self, ready: list) -> APIKey:
+        if self.strategy == "least_loaded":
+            return min(ready, key=lambda state: state.in_flight / state.weight)
+        total = 0.0
+        for state in ready:
+            state.current += state.weight
+            total += state.weight
+        chosen = max(ready, key=lambda state: state.current)
+        chosen.current -= total
+        return chosen
+
+    def acquire(self) -> tuple:
+        """
+        Take a key for one request
+
+        When every key is paused or out of quota, no key is taken and the time
+        until the first one is available is returned instead, so the caller can
+        wait (or give up) and try again.
+
+        :return: The key (None if none is ready) and the number of seconds to wait
+            before trying again
+        """
+        with self._lock:
+            now = monotonic()
+            active = [state for state in self.keys.values() if not state.disabled]
+            if not active:
+                raise InvalidAPIKeyError(
+                    "Error: every API key of the pool was rejected", status=401
+                )
+            ready_at = {
+                state.key: state.ready_at(now, self.quota_period) for state in active
+            }
+            ready = [state for state in active if ready_at[state.key] <= now]
+            if not ready:
+                return None, min(ready_at.values()) - now
+            state = self._pick(ready)
+            if state.window_start is None:
+                state.window_start = now
+            state.used += 1
+            state.in_flight += 1
+            return state.key, 0.0
+
+    def release(
+        self, key: str, status: int = None, retry_after: str = None, sent=True
+    ):
+        """
+        Give a key back with the outcome of its request
+
+        :param key: The key returned by acquire
+        :param status: The HTTP status of the response (None for connection errors)
+        :param retry_after: The Retry-After header of the response, if any
+        :param sent: Whether the request was sent. An unsent one does not count
+            toward the quota or the failures of the key
+        """
+        with self._lock:
+            state = self.keys[key]
+            state.in_flight -= 1
+            if not sent:
+                state.used = max(0, state.used - 1)
+            elif status in (401, 403):
+                state.disabled = True
+            elif status == 429:
+                delay = parse_retry_after(retry_after)
+                pause = self.cooldown if delay is None else delay
+                state.cooldown_until = max(state.cooldown_until, monotonic() + pause)
+            elif status is None or status >= 500:
+                state.failures += 1
+                if state.failures >= self.max_failures:
+                    state.cooldown_until = monotonic() + self.cooldown
+                    state.failures = 0
+            else:
+                state.failures = 0
+
+    def enable(self, key: str):
+        """
+        Put a key back into rotation and clear its cooldown
+        """
+        with self._lock:
+            state = self.keys[key]
+            state.disabled = False
+            state.cooldown_until = 0.0
+            state.failures = 0
+
+    @property
+    def active(self) -> list:
+        """
+        The keys still in rotation (including paused ones)
+        """
+        return [key for key, state in self.keys.items() if not state.disabled]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __repr__(self):
+        return f"<APIKeyPool keys={len(self.keys)} active={len(self.active)}>"
+
+    def __str__(self):
+        return f"<APIKeyPool keys={len(self.keys)} active={len(self.active)}>"
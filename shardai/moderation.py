@@ -1,13 +1,21 @@
-from aiohttp import ClientSession
-from requests import get
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from time import monotonic
 
+from .batch import gather_bounded, map_bounded
+from .cache import ModerationCache
 from .exceptions import *
-from .objects import ModerationResponse
+from .objects import ModerationMultiResponse, ModerationResponse
+from .transport import Transport
 
 
 class ModerationAsync:
-    def __init__(self, api_key: str):
+    def __init__(
+        self, api_key: str, transport: Transport = None, cache: ModerationCache = None
+    ):
         self.api_key = api_key
+        self.transport = transport or Transport()
+        self.cache = cache
 
     async def completions(self, prompt: str, attribute: str = "TOXICITY") -> dict:
         """
@@ -25,41 +33,102 @@ class ModerationAsync:
 
         headers = {"api-key": self.api_key, "Content-Type": "application/json"}
         payload = {"prompt": prompt, "attribute": attribute}
-        async with ClientSession() as session:
-            async with session.post(
-                "https://shard-ai.xyz/v1/moderation/completions",
-                json=payload,
-                headers=headers,
-            ) as response:
-                print(await response.text())
-                json_response = await response.json()
-                if response.status != 200:
-                    raise APIError(f"Error: {response.status}")
-                return ModerationResponse(
-                    json_response["score"],
-                    json_response["languages"],
-                    json_response["data"],
-                )
-
-    async def attributes(self) -> list:
+        key = None
+        if self.cache is not None:
+            key = self.cache.prompt_key(prompt, attribute)
+            cached = self.cache.load(key, prompt)
+            if cached is not None:
+                return cached
+        json_response = await self.transport.request_async(
+            "POST",
+            "/v1/moderation/completions",
+            payload,
+            headers,
+            idempotent=True,
+            coalesce=True,
+        )
+        if key is not None:
+            self.cache.store(key, json_response)
+        return ModerationResponse(
+            json_response["score"],
+            json_response["languages"],
+            json_response["data"],
+        )
+
+    async def completions_multi(
+        self, prompt: str, attributes: list = None
+    ) -> ModerationMultiResponse:
+        """
+        Score a prompt for several attributes concurrently
+
+        :param prompt: The prompt to use for the moderation
+        :param attributes: The attributes to score (all available ones by default)
+
+        :return: The scores of every attribute and the latency of the slowest one
+        """
+        from asyncio import gather
+
+        if attributes is None:
+            attributes = await self.attributes()
+
+        async def timed(attribute):
+            started = monotonic()
+            response = await self.completions(prompt, attribute)
+            return response, monotonic() - started
+
+        results = await gather(*(timed(attribute) for attribute in attributes))
+        return ModerationMultiResponse(
+            prompt,
+            {attribute: result[0] for attribute, result in zip(attributes, results)},
+            {attribute: result[1] for attribute, result in zip(attributes, results)},
+        )
+
+    async def completions_many(
+        self,
+        requests,
+        concurrency: int = 8,
+        return_exceptions: bool = False,
+        **kwargs,
+    ) -> list:
+        """
+        Run many moderation requests concurrently over the shared session
+
+        :param requests: An iterable of kwargs dicts, args tuples or prompts
+        :param concurrency: The maximum number of requests in flight
+        :param return_exceptions: Whether to return exceptions instead of raising
+        :param kwargs: Keyword arguments shared by every request
+
+        :return: The responses in the order of the requests
+        """
+        return await gather_bounded(
+            self.completions, requests, concurrency, return_exceptions, **kwargs
+        )
+
+    async def attributes(self, refresh: bool = False) -> list:
         """
         Get available attributes
 
+        :param refresh: Whether to bypass the cache and fetch them again
+
         :return: The available attributes
         """
-        async with ClientSession() as session:
-            async with session.get(
-                "https://shard-ai.xyz/v1/moderation/attributes"
-            ) as response:
-                json_response = await response.json()
-                if response.status != 200:
-                    raise APIError(f"Error: {response.status}")
-                return json_response["attribute"]
+        json_response = await self.transport.request_async(
+            "GET",
+            "/v1/moderation/attributes",
+            idempotent=True,
+            cached=True,
+            refresh=refresh,
+        )
+        return json_response["attribute"]
 
 
 class Moderation:
-    def __init__(self, api_key: str):
+    def __init__(
+        self, api_key: str, transport: Transport = None, cache: ModerationCache = None
+    ):
         self.api_key = api_key
+        self.transport = transport or Transport()
+        self.cache = cache
 
     def completions(self, prompt: str, attribute: str = "TOXICITY") -> ModerationResponse:
         """
@@ -77,28 +146,99 @@ class Moderation:
 
         headers = {"api-key": self.api_key, "Content-Type": "application/json"}
         payload = {"prompt": prompt, "attribute": attribute}
-        response = get(
-            "https://shard-ai.xyz/v1/moderation/completions",
-            json=payload,
-            headers=headers,
+        key = None
+        if self.cache is not None:
+            key = self.cache.prompt_key(prompt, attribute)
+            cached = self.cache.load(key, prompt)
+            if cached is not None:
+                return cached
+        json_response = self.transport.request(
+            "GET", "/v1/moderation/completions", payload, headers, idempotent=True
         )
-        json_response = response.json()
-        if response.status_code != 200:
-            raise APIError(f"Error: {response.status_code}")
+        if key is not None:
+            self.cache.store(key, json_response)
         return ModerationResponse(
             json_response["score"],
             json_response["languages"],
             json_response["data"],
         )
 
-    def attributes(self) -> list:
+    def completions_multi(
+        self, prompt: str, attributes: list = None
+    ) -> ModerationMultiResponse:
+        """
+        Score a prompt for several attributes concurrently
+
+        The attributes are scored on short-lived threads sharing the pooled
+        session, so the call is safe from inside completions_map workers.
+
+        :param prompt: The prompt to use for the moderation
+        :param attributes: The attributes to score (all available ones by default)
+
+        :return: The scores of every attribute and the latency of the slowest one
+        """
+        if attributes is None:
+            attributes = self.attributes()
+
+        def timed(attribute):
+            started = monotonic()
+            response = self.completions(prompt, attribute)
+            return response, monotonic() - started
+
+        with ThreadPoolExecutor(max_workers=max(1, len(attributes))) as executor:
+            calls = [
+                executor.submit(copy_context().run, timed, attribute)
+                for attribute in attributes
+            ]
+            results = [call.result() for call in calls]
+        return ModerationMultiResponse(
+            prompt,
+            {attribute: result[0] for attribute, result in zip(attributes, results)},
+            {attribute: result[1] for attribute, result in zip(attributes, results)},
+        )
+
+    def completions_map(
+        self,
+        requests,
+        max_workers: int = None,
+        timeout: float = None,
+        return_exceptions: bool = False,
+        **kwargs,
+    ) -> list:
+        """
+        Run many moderation requests on the shared thread pool
+
+        :param requests: An iterable of kwargs dicts, args tuples or prompts
+        :param max_workers: The maximum requests in flight (the pool size by default)
+        :param timeout: The maximum number of seconds a single request may take
+        :param return_exceptions: Whether to return exceptions instead of raising
+        :param kwargs: Keyword arguments shared by every request
+
+        :return: The responses in the order of the requests
+        """
+        return map_bounded(
+            self.transport.executor,
+            self.completions,
+            requests,
+            max_workers or self.transport.pool_size,
+            timeout,
+            return_exceptions,
+            **kwargs,
+        )
+
+    def attributes(self, refresh: bool = False) -> list:
         """
         Get available attributes
 
+        :param refresh: Whether to bypass the cache and fetch them again
+
         :return: The available attributes
         """
-        response = get("https://shard-ai.xyz/v1/moderation/attributes")
-        json_response = response.json()
-        if response.status_code != 200:
-            raise APIError(f"Error: {response.status_code}")
+        json_response = self.transport.request(
+            "GET",
+            "/v1/moderation/attributes",
+            idempotent=True,
+            cached=True,
+            refresh=refresh,
+        )
         return json_response["attribute"]
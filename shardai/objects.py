@@ -1,67 +1,246 @@
-from base64 import b64encode
+from base64 import b64decode, b64encode
+from binascii import a2b_base64
+from hashlib import new as new_hash
 
-from aiohttp import ClientSession
-from requests import get
 
+def is_data_uri(uri) -> bool:
+    """
+    Whether a str or raw bytes value is a data URI
+    """
+    if isinstance(uri, str):
+        return uri.startswith("data:")
+    return bytes(uri[:5]) == b"data:"
 
-class TTSResponse:
 
-    def __init__(self, audio: str, generation_time: float, warning: str, info: dict):
-        self.audio = audio
-        self.generation_time = generation_time
-        self.warning = warning
-        self.model = info.get("model")
-        self.language = info.get("language")
-        self.gender = info.get("gender")
-        self.voice = info.get("voice_used")
+def decode_data_uri(uri) -> tuple:
+    """
+    Decode a base64 data URI, given as a str or as raw bytes
+
+    Raw bytes (such as a memoryview from a JSONView) are decoded in place,
+    without building a str of the payload first.
+
+    :return: The mime type and the decoded bytes
+    """
+    if isinstance(uri, str):
+        header, _, data = uri.partition(",")
+        return header[5:].split(";", 1)[0], b64decode(data)
+    uri = memoryview(uri)
+    header = bytes(uri[:256])
+    comma = header.index(b",")
+    return header[5:comma].split(b";", 1)[0].decode(), a2b_base64(uri[comma + 1 :])
+
+
+def _mime_of(response, default: str) -> str:
+    """
+    Return the mime type of the payload of a response, from its data URI header
+    or its url, without decoding or downloading it
+    """
+    if response.url is None:
+        head = response.raw[:256]
+        if not isinstance(head, str):
+            head = bytes(head).decode("utf-8", "replace")
+        return head[5:].split(",", 1)[0].split(";", 1)[0] or default
+    from mimetypes import guess_type
+    from urllib.parse import urlsplit
+
+    return guess_type(urlsplit(response.url).path)[0] or default
+
+
+_default = None
+
+
+def _default_transport():
+    """
+    Return the transport shared by responses created without one
+    """
+    global _default
+    if _default is None:
+        from .transport import Transport
+
+        _default = Transport()
+    return _default
 
-    def download(self, path: str):
+
+class _BinaryResponse:
+    """
+    Base of the responses carrying an image or audio payload
+
+    A base64 payload is decoded once and a remote one downloaded once. The
+    bytes are kept, so every later access is a cache hit.
+    """
+
+    __slots__ = ("_source", "_data", "_mime", "transport")
+
+    def __init__(self, source, transport=None):
         """
-        Download the audio to a file
+        :param source: The url or data URI, as a str or as raw utf-8 bytes
+        :param transport: The transport used to download a remote payload
         """
-        if "https://" not in self.audio:
-            self.audio = b64encode(self.audio.replace("data:audio/mp3;base64,", ""))
-            with open(path, "wb") as file:
-                file.write(self.audio)
-        else:
-            response = get(self.audio)
-            with open(path, "wb") as file:
-                file.write(response.content)
+        self._source = source
+        self._data = None
+        self._mime = None
+        self.transport = transport
 
-    async def download_async(self, path: str):
+    def _preset(self, data: bytes, mime: str):
         """
-        Download the audio to a file asynchronously
+        Set the decoded payload, such as one read from a cache
+
+        The data URI is only encoded if the payload is read as a str.
+        """
+        self._source = None
+        self._data = data
+        self._mime = mime
+        return self
+
+    def _text(self) -> str:
+        if self._source is None:
+            data = b64encode(self._data).decode()
+            self._source = f"data:{self._mime};base64,{data}"
+        elif not isinstance(self._source, str):
+            self._source = str(self._source, "utf-8")
+        return self._source
+
+    def _set(self, value):
+        self._source = value
+        self._data = None
+
+    def _transport(self):
+        return self.transport if self.transport is not None else _default_transport()
+
+    @property
+    def raw(self):
         """
-        if "https://" not in self.audio:
-            self.audio = b64encode(self.audio.replace("data:audio/mp3;base64,", ""))
-            with open(path, "wb") as file:
-                file.write(self.audio)
-        else:
-            async with ClientSession() as session:
-                async with session.get(self.audio) as response:
-                    with open(path, "wb") as file:
-                        file.write(await response.read())
+        The payload as returned by the API: a str, or raw bytes with lazy_json
+        """
+        return self._text() if self._source is None else self._source
 
-    def as_bytes(self):
+    @property
+    def url(self) -> str:
         """
-        Return the audio as bytes
+        The url of a remote payload, or None for a data URI
         """
-        if "https://" not in self.audio:
-            return b64encode(self.audio.replace("data:audio/mp3;base64,", ""))
-        else:
-            response = get(self.audio)
-            return response.content
+        if self._source is None or is_data_uri(self._source):
+            return None
+        return self._text()
 
-    async def as_bytes_async(self):
+    def as_bytes(self) -> bytes:
+        """
+        Return the payload as bytes, decoding or downloading it on first use
         """
-        Return the audio as bytes asynchronously
+        if self._data is None:
+            if is_data_uri(self._source):
+                self._data = decode_data_uri(self._source)[1]
+            else:
+                self._data = self._transport().fetch(self._text())[0]
+        return self._data
+
+    async def as_bytes_async(self) -> bytes:
         """
-        if "https://" not in self.audio:
-            return b64encode(self.audio.replace("data:audio/mp3;base64,", ""))
-        else:
-            async with ClientSession() as session:
-                async with session.get(self.audio) as response:
-                    return await response.read()
+        Return the payload as bytes, decoding or downloading it on first use
+        """
+        if self._data is None and not is_data_uri(self._source):
+            self._data = (await self._transport().fetch_async(self._text()))[0]
+        return self.as_bytes()
+
+    def as_memoryview(self) -> memoryview:
+        """
+        Return the payload as a read-only memoryview, without copying it
+        """
+        return memoryview(self.as_bytes())
+
+    def download(
+        self,
+        path: str,
+        chunk_size: int = 65536,
+        checksum: str = None,
+        resume: bool = False,
+    ):
+        """
+        Write the payload to a file
+
+        A remote payload that was not fetched yet is streamed to the file in
+        chunks instead of being held in memory.
+
+        :param path: The file to write
+        :param chunk_size: The number of bytes downloaded at a time
+        :param checksum: A hashlib algorithm to hash the payload with (sha256...)
+        :param resume: Whether to continue an interrupted download of path
+
+        :return: The hex digest of the payload, or None without checksum
+        """
+        if self._data is None and not is_data_uri(self._source):
+            return self._transport().download(
+                self._text(), path, chunk_size, checksum, resume
+            )
+        data = self.as_bytes()
+        with open(path, "wb") as file:
+            file.write(data)
+        return new_hash(checksum, data).hexdigest() if checksum else None
+
+    async def download_async(
+        self,
+        path: str,
+        chunk_size: int = 65536,
+        checksum: str = None,
+        resume: bool = False,
+    ):
+        """
+        Write the payload to a file without blocking the event loop
+
+        A remote payload is streamed in chunks over the shared async session.
+        Decoding, hashing and every file operation run on worker threads.
+
+        :param path: The file to write
+        :param chunk_size: The number of bytes downloaded at a time
+        :param checksum: A hashlib algorithm to hash the payload with (sha256...)
+        :param resume: Whether to continue an interrupted download of path
+
+        :return: The hex digest of the payload, or None without checksum
+        """
+        if self._data is None and not is_data_uri(self._source):
+            return await self._transport().download_async(
+                self._text(), path, chunk_size, checksum, resume
+            )
+        from asyncio import get_running_loop
+
+        return await get_running_loop().run_in_executor(
+            None, self.download, path, chunk_size, checksum
+        )
+
+
+class TTSResponse(_BinaryResponse):
+    __slots__ = ("generation_time", "warning", "model", "language", "gender", "voice")
+
+    def __init__(
+        self,
+        audio: str,
+        generation_time: float,
+        warning: str,
+        info: dict,
+        transport=None,
+    ):
+        """
+        :param audio: The audio url or data URI, as a str or as raw utf-8 bytes
+        :param transport: The transport used to download a remote audio file
+        """
+        super().__init__(audio, transport)
+        self.generation_time = generation_time
+        self.warning = warning
+        self.model = info.get("model")
+        self.language = info.get("language")
+        self.gender = info.get("gender")
+        self.voice = info.get("voice_used")
+
+    @property
+    def audio(self) -> str:
+        """
+        The audio url or data URI
+        """
+        return self._text()
+
+    @audio.setter
+    def audio(self, value):
+        self._set(value)
 
     def __repr__(self):
         return f"<TTSResponse audio={self.audio[:10]}>"
@@ -71,6 +250,8 @@ class TTSResponse:
 
 
 class ElevenLabsVoice:
+    __slots__ = ("name", "accent", "age", "gender", "use_case")
+
     def __init__(self, name: str, accent: str, age: str, gender: str, use_case: str):
         self.name = name
         self.accent = accent
@@ -86,6 +267,8 @@ class ElevenLabsVoice:
 
 
 class TikTokVoice:
+    __slots__ = ("name",)
+
     def __init__(self, name: str):
         self.name = name
 
@@ -97,6 +280,8 @@ class TikTokVoice:
 
 
 class EdgeVoice:
+    __slots__ = ("message", "gender", "language")
+
     def __init__(self, message: str, parameters: dict):
         self.message = message
         self.gender = parameters.get("gender")
@@ -110,6 +295,8 @@ class EdgeVoice:
 
 
 class GoogleVoice:
+    __slots__ = ("message",)
+
     def __init__(self, message: str):
         self.message = message
 
@@ -121,33 +308,66 @@ class GoogleVoice:
 
 
 class ChatResponse:
+    __slots__ = ("id", "object", "created", "model", "usage", "_choices")
+
     def __init__(
-        self, id: str, object: str, created: int, model: str, usage: str, choices: dict
+        self, id: str, object: str, created: int, model: str, usage: str, choices: list
     ):
         self.id = id
         self.object = object
         self.created = created
         self.model = model
         self.usage = usage
-        self.choices = [
-            ChoiceChat(
-                choices[0]["message"], choices[0]["finish_reason"], choices[0]["index"]
-            )
-        ]
+        self._choices = choices
+
+    @property
+    def choices(self) -> list:
+        """
+        Every returned choice, built from the raw json on first access
+        """
+        choices = self._choices
+        if choices and not isinstance(choices[0], ChoiceChat):
+            choices = self._choices = [
+                ChoiceChat(
+                    choice["message"],
+                    choice.get("finish_reason"),
+                    choice.get("index", index),
+                )
+                for index, choice in enumerate(choices)
+            ]
+        return choices or []
+
+    def _preview(self) -> str:
+        choices = self.choices
+        return (choices[0].message.content or "")[:10] if choices else ""
 
     def __repr__(self):
-        return f"<ChatResponse id={self.choices[0].message.content[:10]}>"
+        return f"<ChatResponse id={self._preview()}>"
 
     def __str__(self):
-        return f"<ChatResponse id={self.choices[0].message.content[:10]}>"
+        return f"<ChatResponse id={self._preview()}>"
 
 
 class ChoiceChat:
+    __slots__ = ("_message", "finish_reason", "index")
+
     def __init__(self, message: dict, finish_reason: str, index: int):
-        self.message = ChatMessage(message["role"], message["content"])
+        self._message = message
         self.finish_reason = finish_reason
         self.index = index
 
+    @property
+    def message(self) -> "ChatMessage":
+        """
+        The message of the choice, built from the raw json on first access
+        """
+        message = self._message
+        if not isinstance(message, ChatMessage):
+            message = self._message = ChatMessage(
+                message.get("role"), message.get("content")
+            )
+        return message
+
     def __repr__(self):
         return f"<ChoiceChat message={self.message.content[:10]}>"
 
@@ -156,6 +376,8 @@ class ChoiceChat:
 
 
 class ChatMessage:
+    __slots__ = ("role", "content")
+
     def __init__(self, role: str, content: str):
         self.role = role
         self.content = content
@@ -167,63 +389,150 @@ class ChatMessage:
         return f"<ChatMessage content={self.content[:10]}>"
 
 
-class ImageResponse:
+class ChatStream:
+    """
+    Iterator over the ChatMessage deltas of a streamed chat completion
+
+    Once the stream is exhausted the aggregated ChatResponse is available as
+    the response attribute.
+    """
+
+    def __init__(self, events):
+        self._events = events
+        self.id = None
+        self.object = None
+        self.created = None
+        self.model = None
+        self.usage = None
+        self._choices = {}
+        self.response = None
+
+    def _feed(self, event: dict) -> list:
+        self.id = event.get("id", self.id)
+        self.object = event.get("object", self.object)
+        self.created = event.get("created", self.created)
+        self.model = event.get("model", self.model)
+        if event.get("usage") is not None:
+            self.usage = event["usage"]
+        deltas = []
+        for choice in event.get("choices") or []:
+            index = choice.get("index", 0)
+            state = self._choices.setdefault(
+                index,
+                {"role": "assistant", "content": [], "finish_reason": None},
+            )
+            delta = choice.get("delta") or choice.get("message") or {}
+            if delta.get("role"):
+                state["role"] = delta["role"]
+            if choice.get("finish_reason") is not None:
+                state["finish_reason"] = choice["finish_reason"]
+            if delta.get("content"):
+                state["content"].append(delta["content"])
+                deltas.append(ChatMessage(state["role"], delta["content"]))
+        return deltas
+
+    def _finish(self):
+        choices = [
+            {
+                "message": {
+                    "role": state["role"],
+                    "content": "".join(state["content"]),
+                },
+                "finish_reason": state["finish_reason"],
+                "index": index,
+            }
+            for index, state in sorted(self._choices.items())
+        ]
+        if not choices:
+            choices = [
+                {
+                    "message": {"role": "assistant", "content": ""},
+                    "finish_reason": None,
+                    "index": 0,
+                }
+            ]
+        self.response = ChatResponse(
+            self.id, self.object, self.created, self.model, self.usage, choices
+        )
 
-    def __init__(
-        self, image: str, generation_time: float, warning: str, info: str = None
-    ):
-        self.image = image
-        self.generation_time = generation_time
-        self.warning = warning
-        self.info = info
+    def __iter__(self):
+        for event in self._events:
+            yield from self._feed(event)
+        self._finish()
 
-    def download(self, path: str):
+    def close(self):
         """
-        Download the image to a file
+        Stop the stream and release its connection
         """
-        if "https://" not in self.image:
-            self.image = b64encode(self.image.replace("data:image/png;base64,", ""))
-            with open(path, "wb") as file:
-                file.write(self.image)
-        else:
-            response = get(self.image)
-            with open(path, "wb") as file:
-                file.write(response.content)
+        self._events.close()
+
+    def __repr__(self):
+        return f"<ChatStream id={self.id}>"
+
+    def __str__(self):
+        return f"<ChatStream id={self.id}>"
+
+
+class ChatStreamAsync(ChatStream):
+    """
+    Async iterator over the ChatMessage deltas of a streamed chat completion
+
+    Once the stream is exhausted the aggregated ChatResponse is available as
+    the response attribute.
+    """
+
+    def __iter__(self):
+        raise TypeError("ChatStreamAsync must be iterated with async for")
+
+    async def __aiter__(self):
+        async for event in self._events:
+            for delta in self._feed(event):
+                yield delta
+        self._finish()
 
-    async def download_async(self, path: str):
+    async def close(self):
         """
-        Download the image to a file asynchronously
+        Stop the stream and release its connection
         """
-        if "https://" not in self.image:
-            self.image = b64encode(self.image.replace("data:image/png;base64,", ""))
-            with open(path, "wb") as file:
-                file.write(self.image)
-        else:
-            async with ClientSession() as session:
-                async with session.get(self.image) as response:
-                    with open(path, "wb") as file:
-                        file.write(await response.read())
+        await self._events.aclose()
 
-    def as_bytes(self):
+    def __repr__(self):
+        return f"<ChatStreamAsync id={self.id}>"
+
+    def __str__(self):
+        return f"<ChatStreamAsync id={self.id}>"
+
+
+class ImageResponse(_BinaryResponse):
+    __slots__ = ("generation_time", "warning", "info")
+
+    def __init__(
+        self,
+        image: str,
+        generation_time: float,
+        warning: str,
+        info: str = None,
+        transport=None,
+    ):
         """
-        Return the image as bytes
+        :param image: The image url or data URI, as a str or as raw utf-8 bytes
+        :param transport: The transport used to download a remote image
         """
-        if "https://" not in self.image:
-            return b64encode(self.image.replace("data:image/png;base64,", ""))
-        else:
-            response = get(self.image)
-            return response.content
+        super().__init__(image, transport)
+        self.generation_time = generation_time
+        self.warning = warning
+        self.info = info
 
-    async def as_bytes_async(self):
+    @property
+    def image(self) -> str:
         """
-        Return the image as bytes asynchronously
+        The image url or data URI
         """
-        if "https://" not in self.image:
-            return b64encode(self.image.replace("data:image/png;base64,", ""))
-        else:
-            async with ClientSession() as session:
-                async with session.get(self.image) as response:
-                    return await response.read()
+        return self._text()
+
+    @image.setter
+    def image(self, value):
+        self._set(value)
 
     def __repr__(self):
         return f"<ImageResponse image={self.image[:10]}>"
@@ -233,6 +542,7 @@ class ImageResponse:
 
 
 class ImageOptions:
+    __slots__ = ("models", "ratios", "samplers", "upscale", "styles")
 
     def __init__(
         self,
@@ -260,17 +570,62 @@ class ImageOptions:
 
 
 class ModerationResponse:
-
-    def __init__(self, score: str, languages: dict, data: dict):
+    __slots__ = (
+        "score",
+        "language",
+        "detected_language",
+        "prompt",
+        "attribute",
+        "time",
+        "cached",
+    )
+
+    def __init__(self, score: str, languages: dict, data: dict, cached: bool = False):
         self.score = score
         self.language = languages.get("language")
         self.detected_language = languages.get("detected_language")
         self.prompt = data.get("prompt")
         self.attribute = data.get("attribute")
         self.time = data.get("time")
+        self.cached = cached
 
     def __repr__(self):
         return f"<ModerationResponse result={self.score}>"
 
     def __str__(self):
         return f"<ModerationResponse result={self.score}>"
+
+
+class ModerationMultiResponse:
+    __slots__ = (
+        "prompt",
+        "responses",
+        "scores",
+        "latencies",
+        "latency",
+        "language",
+        "detected_language",
+    )
+
+    def __init__(self, prompt: str, responses: dict, latencies: dict):
+        self.prompt = prompt
+        self.responses = responses
+        self.scores = {
+            attribute: response.score for attribute, response in responses.items()
+        }
+        self.latencies = latencies
+        self.latency = max(latencies.values(), default=0.0)
+        first = next(iter(responses.values()), None)
+        self.language = first.language if first is not None else None
+        self.detected_language = (
+            first.detected_language if first is not None else None
+        )
+
+    def __getitem__(self, attribute: str):
+        return self.scores[attribute]
+
+    def __repr__(self):
+        return f"<ModerationMultiResponse scores={self.scores}>"
+
+    def __str__(self):
+        return f"<ModerationMultiResponse scores={self.scores}>"
@@ -0,0 +1,166 @@
+from threading import Lock
+from time import monotonic, time
+
+
+def parse_retry_after(value: str):
+    """
+    Parse a Retry-After header (delta seconds or HTTP date) into seconds
+
+    :return: The number of seconds to wait, or None if the header is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate tokens per second up to burst tokens
+
+    Callers reserve a token and are told how long to wait for it, so the same
+    bucket can be shared by threads and event loops without blocking either.
+    A 429 halves the refill rate and pauses the bucket for the Retry-After
+    delay; every successful response recovers part of the configured rate.
+    """
+
+    def __init__(self, rate: float, burst: float = None, min_rate: float = None):
+        """
+        :param rate: The number of requests allowed per second
+        :param burst: The maximum number of requests sent back to back
+        :param min_rate: The lowest rate the bucket backs off to after a 429
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.min_rate = min_rate if min_rate is not None else rate / 16
+        self.tokens = self.burst
+        self.blocked_until = 0.0
+        self._updated = monotonic()
+        self._lock = Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, max_wait: float = None) -> float:
+        """
+        Take a token
+
+        :param max_wait: The longest acceptable wait, in seconds. The token is not
+            taken when the wait would be longer
+
+        :return: The number of seconds to wait before sending the request
+        """
+        with self._lock:
+            now = monotonic()
+            self._refill(now)
+            tokens = self.tokens - 1
+            delay = -tokens / self.rate if tokens < 0 else 0.0
+            delay = max(delay, self.blocked_until - now)
+            if max_wait is None or delay < max_wait:
+                self.tokens = tokens
+            return delay
+
+    def on_success(self):
+        """
+        Recover part of the configured rate after a successful response
+        """
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill(monotonic())
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 16)
+
+    def on_throttled(self, retry_after: float = None):
+        """
+        Back off after a 429 response
+
+        :param retry_after: The Retry-After delay sent by the server, in seconds
+        """
+        with self._lock:
+            now = monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+            pause = retry_after if retry_after is not None else 1 / self.rate
+            self.blocked_until = max(self.blocked_until, now + pause)
+
+    def __repr__(self):
+        return f"<TokenBucket rate={self.rate:.2f} burst={self.burst}>"
+
+    def __str__(self):
+        return f"<TokenBucket rate={self.rate:.2f} burst={self.burst}>"
+
+
+class RateLimiter:
+    """
+    Per API key and per endpoint token buckets shared by every sub-client
+    """
+
+    def __init__(self, rate: float = 5.0, burst: float = None, limits: dict = None):
+        """
+        :param rate: The default number of requests per second for every endpoint
+        :param burst: The default burst size for every endpoint
+        :param limits: Per endpoint overrides, mapping an endpoint name (chat, sd1x,
+            sdxl, sdxl-turbo, tts, moderation) to a rate or a (rate, burst) tuple
+        """
+        self.rate = rate
+        self.burst = burst
+        self.limits = limits or {}
+        self._buckets = {}
+        self._lock = Lock()
+
+    def bucket(self, api_key: str, endpoint: str) -> TokenBucket:
+        """
+        Return the bucket of an API key and endpoint, creating it on first use
+        """
+        key = (api_key, endpoint)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    limit = self.limits.get(endpoint, (self.rate, self.burst))
+                    if not isinstance(limit, (tuple, list)):
+                        limit = (limit, None)
+                    bucket = self._buckets[key] = TokenBucket(*limit)
+        return bucket
+
+    def reserve(self, api_key: str, endpoint: str, max_wait: float = None) -> float:
+        """
+        Take a token for a request
+
+        :param max_wait: The longest acceptable wait, in seconds. The token is not
+            taken when the wait would be longer
+
+        :return: The number of seconds to wait before sending the request
+        """
+        return self.bucket(api_key, endpoint).reserve(max_wait)
+
+    def observe(
+        self, api_key: str, endpoint: str, status: int, retry_after: str = None
+    ):
+        """
+        Feed a response status (and Retry-After header) back into the buckets
+        """
+        bucket = self.bucket(api_key, endpoint)
+        if status == 429:
+            bucket.on_throttled(parse_retry_after(retry_after))
+        elif status < 400:
+            bucket.on_success()
+
+    def __repr__(self):
+        return f"<RateLimiter buckets={len(self._buckets)}>"
+
+    def __str__(self):
+        return f"<RateLimiter buckets={len(self._buckets)}>"
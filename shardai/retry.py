@@ -0,0 +1,69 @@
+from random import uniform
+
+from .ratelimit import parse_retry_after
+
+
+class RetryPolicy:
+    """
+    Retry policy for transient failures (connection errors, timeouts, 429 and 5xx)
+
+    Attempts are spaced with capped exponential backoff. With jitter the delay
+    is drawn uniformly between zero and the backoff ("full jitter") so retrying
+    clients spread out instead of hitting the server in lockstep. A Retry-After
+    header sent by the server is always honoured.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 30,
+        jitter: bool = True,
+        retry_statuses: tuple = (429, 500, 502, 503, 504),
+        deadline: float = None,
+    ):
+        """
+        :param max_attempts: The maximum attempts per call (1 disables retries)
+        :param backoff: The base delay before the first retry, in seconds
+        :param max_backoff: The maximum delay between two attempts, in seconds
+        :param jitter: Whether to randomize the delays
+        :param retry_statuses: The HTTP statuses that are retried
+        :param deadline: The default time budget of a call across all attempts
+        """
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_statuses = tuple(retry_statuses)
+        self.deadline = deadline
+
+    def is_retryable(self, status: int) -> bool:
+        """
+        Whether a failed attempt may be retried
+
+        :param status: The HTTP status of the attempt (None for connection errors)
+        """
+        return status is None or status in self.retry_statuses
+
+    def delay(self, attempt: int, retry_after: str = None) -> float:
+        """
+        Return the number of seconds to wait after a failed attempt
+
+        :param attempt: The number of the attempt that failed, starting at 1
+        :param retry_after: The Retry-After header of the failed attempt, if any
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        if self.jitter:
+            delay = uniform(0, delay)
+        server_delay = parse_retry_after(retry_after)
+        if server_delay is not None:
+            delay = max(delay, server_delay)
+        return delay
+
+    def __repr__(self):
+        return f"<RetryPolicy max_attempts={self.max_attempts} backoff={self.backoff}>"
+
+    def __str__(self):
+        return f"<RetryPolicy max_attempts={self.max_attempts} backoff={self.backoff}>"
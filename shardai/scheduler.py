@@ -0,0 +1,220 @@
+from collections import deque
+from threading import Event, Lock
+from time import monotonic
+
+from .concurrency import _wake
+
+
+class _Turn:
+    """
+    A call waiting in a priority queue of the Scheduler
+    """
+
+    __slots__ = ("priority", "queued_at", "event", "future", "granted", "cancelled")
+
+    def __init__(self, priority: str, event=None, future=None):
+        self.priority = priority
+        self.queued_at = monotonic()
+        self.event = event
+        self.future = future
+        self.granted = False
+        self.cancelled = False
+
+
+class Scheduler:
+    """
+    Priority classes sharing one concurrency budget through weighted fair queuing
+
+    Calls run at once while the budget has room. Beyond that they queue per
+    priority class, and every freed slot goes to the class with the lowest
+    virtual time, which advances by 1 / weight for each call it starts. Under
+    contention each busy class gets a share of the slots proportional to its
+    weight, so interactive calls overtake queued bulk work without starving it.
+    An idle class does not bank credit. Threads and event loops share the
+    same budget.
+    """
+
+    endpoints = {
+        "chat": "interactive",
+        "moderation": "interactive",
+        "tts": "normal",
+        "sd1x": "bulk",
+        "sdxl": "bulk",
+        "sdxl-turbo": "bulk",
+    }
+
+    def __init__(
+        self, concurrency: int = 16, weights: dict = None, endpoints: dict = None
+    ):
+        """
+        :param concurrency: The maximum number of requests in flight across classes
+        :param weights: The weight of every priority class
+            (interactive 8, normal 4 and bulk 1 by default)
+        :param endpoints: Overrides of the default class of an endpoint (chat,
+            sd1x, sdxl, sdxl-turbo, tts, moderation)
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.concurrency = concurrency
+        self.weights = weights or {"interactive": 8, "normal": 4, "bulk": 1}
+        self.endpoints = {**self.endpoints, **(endpoints or {})}
+        self.in_flight = 0
+        self._queues = {priority: deque() for priority in self.weights}
+        self._virtual = dict.fromkeys(self.weights, 0.0)
+        self._clock = 0.0
+        self._stats = {
+            priority: {"in_flight": 0, "started": 0, "total_wait": 0.0, "max_wait": 0.0}
+            for priority in self.weights
+        }
+        self._lock = Lock()
+
+    def priority_of(self, endpoint: str, priority: str = None) -> str:
+        """
+        Return the priority class of a call, the endpoint's default if none is given
+        """
+        priority = priority or self.endpoints.get(endpoint, "normal")
+        if priority not in self.weights:
+            raise ValueError(f"Unknown priority class: {priority}")
+        return priority
+
+    def _start(self, priority: str, waited: float):
+        start = max(self._virtual[priority], self._clock)
+        self._clock = start
+        self._virtual[priority] = start + 1 / self.weights[priority]
+        self.in_flight += 1
+        stats = self._stats[priority]
+        stats["in_flight"] += 1
+        stats["started"] += 1
+        stats["total_wait"] += waited
+        stats["max_wait"] = max(stats["max_wait"], waited)
+
+    def _next(self):
+        """
+        Pop the next turn to run, skipping cancelled ones, or None if none waits
+        """
+        while True:
+            waiting = [priority for priority, queue in self._queues.items() if queue]
+            if not waiting:
+                return None
+            priority = min(
+                waiting,
+                key=lambda priority: (
+                    max(self._virtual[priority], self._clock),
+                    -self.weights[priority],
+                ),
+            )
+            turn = self._queues[priority].popleft()
+            if not turn.cancelled:
+                return turn
+
+    def _dispatch(self) -> list:
+        granted = []
+        while self.in_flight < self.concurrency:
+            turn = self._next()
+            if turn is None:
+                break
+            self._start(turn.priority, monotonic() - turn.queued_at)
+            turn.granted = True
+            granted.append(turn)
+        return granted
+
+    def _grant(self, turns: list):
+        for turn in turns:
+            if turn.event is not None:
+                turn.event.set()
+            else:
+                turn.future.get_loop().call_soon_threadsafe(_wake, turn.future)
+
+    def _enter(self, turn: _Turn):
+        """
+        Queue a turn, starting it at once if the budget has room
+        """
+        with self._lock:
+            self._queues[turn.priority].append(turn)
+            granted = self._dispatch()
+        self._grant(granted)
+
+    def _leave(self, turn: _Turn) -> bool:
+        """
+        Take a turn out of its queue, unless it was granted in the meantime
+
+        :return: Whether the turn had been granted
+        """
+        with self._lock:
+            turn.cancelled = not turn.granted
+            return turn.granted
+
+    def acquire(self, priority: str, timeout: float = None) -> bool:
+        """
+        Wait for the turn of a call, blocking the thread
+
+        :param priority: The priority class of the call
+        :param timeout: The longest to wait, in seconds (None to wait forever)
+
+        :return: Whether the turn came before the timeout
+        """
+        turn = _Turn(priority, event=Event())
+        self._enter(turn)
+        return turn.event.wait(timeout) or self._leave(turn)
+
+    async def acquire_async(self, priority: str, timeout: float = None) -> bool:
+        """
+        Wait for the turn of a call without blocking the event loop
+
+        :param priority: The priority class of the call
+        :param timeout: The longest to wait, in seconds (None to wait forever)
+
+        :return: Whether the turn came before the timeout
+        """
+        from asyncio import CancelledError, TimeoutError, get_running_loop, wait_for
+
+        turn = _Turn(priority, future=get_running_loop().create_future())
+        self._enter(turn)
+        try:
+            await wait_for(turn.future, timeout)
+        except TimeoutError:
+            return self._leave(turn)
+        except CancelledError:
+            if self._leave(turn):
+                self.release(priority)
+            raise
+        return True
+
+    def release(self, priority: str):
+        """
+        End a call and hand its slot to the next queued one
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self._stats[priority]["in_flight"] -= 1
+            granted = self._dispatch()
+        self._grant(granted)
+
+    def stats(self) -> dict:
+        """
+        Return the queue depth, calls in flight and wait times of every class
+
+        :return: A dict mapping each priority class to its queued, in_flight,
+            started, mean_wait and max_wait values (waits in seconds)
+        """
+        with self._lock:
+            queued = {
+                priority: sum(not turn.cancelled for turn in queue)
+                for priority, queue in self._queues.items()
+            }
+            return {
+                priority: {
+                    "queued": queued[priority],
+                    "in_flight": stats["in_flight"],
+                    "started": stats["started"],
+                    "mean_wait": stats["total_wait"] / max(1, stats["started"]),
+                    "max_wait": stats["max_wait"],
+                }
+                for priority, stats in self._stats.items()
+            }
+
+    def __repr__(self):
+        return f"<Scheduler concurrency={self.concurrency} in_flight={self.in_flight}>"
+
+    def __str__(self):
+        return f"<Scheduler concurrency={self.concurrency} in_flight={self.in_flight}>"
@@ -0,0 +1,1337 @@
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from copy import deepcopy
+from hashlib import new as new_hash
+from contextvars import ContextVar, copy_context
+from json import dumps, loads
+from os import remove, replace
+from os.path import exists, getsize
+from threading import Barrier, BrokenBarrierError
+from time import monotonic, sleep
+
+from .breaker import CircuitBreaker
+from .cache import Coalescer, TTLCache
+from .concurrency import ConcurrencyLimiter
+from .exceptions import *
+from .hedge import HedgePolicy, LatencyHistogram
+from .jsonview import parse
+from .keypool import APIKeyPool
+from .ratelimit import RateLimiter
+from .retry import RetryPolicy
+from .scheduler import Scheduler
+
+BASE_URL = "https://shard-ai.xyz"
+
+
+def endpoint_of(path: str) -> str:
+    """
+    Return the endpoint family of an API path (chat, sd1x, sdxl, sdxl-turbo, tts...)
+    """
+    parts = path.split("?", 1)[0].split("/")
+    if "://" in path:
+        parts = parts[3:]
+    parts = [part for part in parts if part]
+    if parts and parts[0] == "v1":
+        parts = parts[1:]
+    return parts[0] if parts else ""
+
+
+_options = ContextVar("shardai_options", default={})
+
+
+@contextmanager
+def request_options(**options):
+    """
+    Set per-call options for every request sent inside the block
+
+    :param deadline: The time budget of a call across all its attempts, in seconds
+    :param hedge: Whether idempotent requests may be hedged (True by default)
+    :param lazy_json: Whether responses are decoded lazily through a JSONView
+    :param priority: The Scheduler priority class of the requests
+    """
+    token = _options.set({**_options.get(), **options})
+    try:
+        yield
+    finally:
+        _options.reset(token)
+
+
+def current_options() -> dict:
+    """
+    Return the per-call options set through request_options
+    """
+    return _options.get()
+
+
+def _describe(error: Exception) -> str:
+    return str(error) or type(error).__name__
+
+
+def _api_key(headers: dict):
+    return headers.get("api-key") if headers else None
+
+
+def _key_pool(headers: dict):
+    key = _api_key(headers)
+    return key if isinstance(key, APIKeyPool) else None
+
+
+def _remaining(deadline: float):
+    """
+    Return the seconds left before a deadline, or None without deadline
+    """
+    return None if deadline is None else max(0.0, deadline - monotonic())
+
+
+def _error(status: int):
+    """
+    Return the exception raised for a failed status
+    """
+    return InvalidAPIKeyError if status in (401, 403) else APIError
+
+
+def _partial_size(partial: str) -> int:
+    return getsize(partial) if exists(partial) else 0
+
+
+def _open_partial(partial: str, digest, append: bool):
+    """
+    Open a partial download, hashing the bytes already written when appending
+    """
+    if append and digest is not None:
+        with open(partial, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+    return open(partial, "ab" if append else "wb")
+
+
+def _write_chunk(file, digest, chunk: bytes):
+    file.write(chunk)
+    if digest is not None:
+        digest.update(chunk)
+
+
+def _close_file(file, partial: str, path: str = None, keep: bool = False):
+    """
+    Close a partial download, then move it to path, or delete it unless kept
+    """
+    file.close()
+    if path is not None:
+        replace(partial, path)
+    elif not keep:
+        remove(partial)
+
+
+def _event_data(line: str):
+    """
+    Return the data field of a server-sent event line, or None for other lines
+    """
+    if not line.startswith("data:"):
+        return None
+    return line[5:].strip()
+
+
+class Transport:
+    """
+    Pooled HTTP transport shared by every sub-client of a ShardClient
+
+    The synchronous side is a single requests Session with a sized connection
+    pool, the asynchronous side a single aiohttp ClientSession created lazily
+    on first use inside the running event loop. Both libraries are only
+    imported when their side is first used, so importing shardai stays cheap.
+    """
+
+    def __init__(
+        self,
+        base_url: str = BASE_URL,
+        pool_size: int = 10,
+        limit_per_host: int = 0,
+        keepalive_timeout: float = 30,
+        dns_cache_ttl: int = 300,
+        rate_limiter: RateLimiter = None,
+        retry_policy: RetryPolicy = None,
+        connect_timeout: float = 10,
+        read_timeout: float = 300,
+        hedge_policy: HedgePolicy = None,
+        discovery_cache: TTLCache = None,
+        coalesce: bool = False,
+        json_decoder=None,
+        lazy_json: bool = False,
+        circuit_breaker: CircuitBreaker = None,
+        concurrency_limiter: ConcurrencyLimiter = None,
+        scheduler: Scheduler = None,
+    ):
+        """
+        :param base_url: The base url of the API
+        :param pool_size: The maximum number of pooled connections
+        :param limit_per_host: The maximum connections per host (0 for no limit)
+        :param keepalive_timeout: How long idle async connections are kept alive
+        :param dns_cache_ttl: How long resolved hosts are cached by the async session
+        :param rate_limiter: The rate limiter requests wait on, if any
+        :param retry_policy: The retry policy for transient failures
+        :param connect_timeout: The connect timeout of every attempt, in seconds
+        :param read_timeout: The read timeout of every attempt, in seconds
+        :param hedge_policy: The hedge policy for idempotent requests, if any
+        :param discovery_cache: The cache of the discovery endpoints, if any
+        :param coalesce: Whether identical concurrent async requests share one response
+        :param json_decoder: The function decoding json bodies (json.loads by default)
+        :param lazy_json: Whether responses are decoded lazily through a JSONView
+        :param circuit_breaker: The circuit breaker failing fast on degraded endpoints
+        :param concurrency_limiter: The adaptive per endpoint concurrency limits, if any
+        :param scheduler: The priority scheduler sharing one concurrency budget, if any
+        """
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.hedge_policy = hedge_policy
+        self.discovery_cache = discovery_cache
+        self.coalescer = Coalescer() if coalesce else None
+        self.json_decoder = json_decoder or loads
+        self.lazy_json = lazy_json
+        self.circuit_breaker = circuit_breaker
+        self.concurrency_limiter = concurrency_limiter
+        self.scheduler = scheduler
+        self.latencies = {}
+
+        self._session = None
+        self._async_session = None
+        self._async_loop = None
+        self._executor = None
+        self._hedge_executor = None
+
+    @property
+    def session(self):
+        """
+        The pooled requests session, created on first use
+        """
+        if self._session is None:
+            from requests import Session
+            from requests.adapters import HTTPAdapter
+
+            session = Session()
+            adapter = HTTPAdapter(
+                pool_connections=self.pool_size,
+                pool_maxsize=max(self.pool_size, self.limit_per_host),
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._session = session
+        return self._session
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """
+        The thread pool used by the synchronous batch methods, sized to the pool
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.pool_size, thread_name_prefix="shardai"
+            )
+        return self._executor
+
+    def url(self, path: str) -> str:
+        """
+        Build the absolute url of an API path
+        """
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}{path}"
+
+    def _key_delay(self, delay: float, deadline: float, attempts: int) -> float:
+        """
+        Check that a key of the pool will be ready before the deadline
+
+        :raises APIError: With status 429 if no key will be ready in time
+        """
+        if deadline is not None and monotonic() + delay >= deadline:
+            raise APIError(
+                "Error: no API key of the pool is ready before the deadline",
+                status=429,
+                attempts=attempts,
+            )
+        return delay
+
+    def _take_key(self, headers: dict, deadline: float, attempts: int) -> tuple:
+        """
+        Replace an APIKeyPool in the headers by the key used for one attempt,
+        waiting for one to be ready if they are all paused or out of quota
+
+        :return: The headers to send and the pool (or None)
+        """
+        pool = _key_pool(headers)
+        if pool is None:
+            return headers, None
+        key, delay = pool.acquire()
+        while key is None:
+            sleep(self._key_delay(delay, deadline, attempts))
+            key, delay = pool.acquire()
+        return {**headers, "api-key": key}, pool
+
+    async def _take_key_async(
+        self, headers: dict, deadline: float, attempts: int
+    ) -> tuple:
+        """
+        Replace an APIKeyPool in the headers by the key used for one attempt,
+        waiting without blocking the event loop if they are all paused
+
+        :return: The headers to send and the pool (or None)
+        """
+        from asyncio import sleep as sleep_async
+
+        pool = _key_pool(headers)
+        if pool is None:
+            return headers, None
+        key, delay = pool.acquire()
+        while key is None:
+            await sleep_async(self._key_delay(delay, deadline, attempts))
+            key, delay = pool.acquire()
+        return {**headers, "api-key": key}, pool
+
+    def _give_key(
+        self, pool, headers: dict, status: int, response_headers, started=None
+    ):
+        if pool is None:
+            return
+        retry_after = None
+        if response_headers is not None:
+            retry_after = response_headers.get("Retry-After")
+        pool.release(headers["api-key"], status, retry_after, started is not None)
+
+    def _enter_circuit(self, path: str):
+        """
+        Return the circuit of an API path, raising CircuitOpenError if it is open
+        """
+        if self.circuit_breaker is None:
+            return None
+        circuit = self.circuit_breaker.circuit(endpoint_of(path))
+        circuit.acquire()
+        return circuit
+
+    def _leave_circuit(
+        self, circuit, status: int, started: float, failed: bool, finished=None
+    ):
+        """
+        Record the outcome of an attempt, or release it if it was never sent
+        """
+        if circuit is None:
+            return
+        if started is None or (status is None and not failed):
+            circuit.release()
+        else:
+            latency = (finished or monotonic()) - started
+            circuit.record(status is None or status >= 500, latency)
+
+    def _acquire_slot(self, path: str, deadline: float, attempts: int):
+        """
+        Wait for a concurrency slot of the endpoint of an API path
+
+        :return: The AdaptiveLimit the slot was taken from, or None without limiter
+
+        :raises APIError: If no slot is free before the deadline
+        """
+        if self.concurrency_limiter is None:
+            return None
+        limit = self.concurrency_limiter.limit(endpoint_of(path))
+        if not limit.acquire(_remaining(deadline)):
+            raise APIError("Error: deadline exceeded", attempts=attempts)
+        return limit
+
+    async def _acquire_slot_async(self, path: str, deadline: float, attempts: int):
+        if self.concurrency_limiter is None:
+            return None
+        limit = self.concurrency_limiter.limit(endpoint_of(path))
+        if not await limit.acquire_async(_remaining(deadline)):
+            raise APIError("Error: deadline exceeded", attempts=attempts)
+        return limit
+
+    def _priority(self, path: str):
+        """
+        Return the priority class of a call to an API path, or None without
+        scheduler
+
+        :raises ValueError: If the priority class of the options is unknown
+        """
+        if self.scheduler is None:
+            return None
+        return self.scheduler.priority_of(
+            endpoint_of(path), current_options().get("priority")
+        )
+
+    def _acquire_turn(self, priority: str, deadline: float, attempts: int):
+        """
+        Wait for the scheduler to let an attempt run
+
+        :return: The priority class the turn was taken in, or None without scheduler
+
+        :raises APIError: If the turn does not come before the deadline
+        """
+        if priority is None:
+            return None
+        if not self.scheduler.acquire(priority, _remaining(deadline)):
+            raise APIError("Error: deadline exceeded", attempts=attempts)
+        return priority
+
+    async def _acquire_turn_async(self, priority: str, deadline: float, attempts: int):
+        if priority is None:
+            return None
+        if not await self.scheduler.acquire_async(priority, _remaining(deadline)):
+            raise APIError("Error: deadline exceeded", attempts=attempts)
+        return priority
+
+    def _release_turn(self, priority: str):
+        if priority is not None:
+            self.scheduler.release(priority)
+
+    def _release_slot(self, slot, status: int, started: float, failed: bool):
+        """
+        Give back the concurrency slot of an attempt, feeding its outcome back
+        """
+        if slot is None:
+            return
+        if started is None or (status is None and not failed):
+            slot.release()
+        else:
+            congested = status is None or status == 429 or status >= 500
+            slot.release(monotonic() - started, congested, started)
+
+    def _throttle_delay(self, path: str, headers: dict, max_wait=None) -> float:
+        if self.rate_limiter is None or _api_key(headers) is None:
+            return 0.0
+        return self.rate_limiter.reserve(
+            _api_key(headers), endpoint_of(path), max_wait
+        )
+
+    def _observe(self, path: str, headers: dict, status: int, response_headers):
+        if self.rate_limiter is None or _api_key(headers) is None:
+            return
+        self.rate_limiter.observe(
+            _api_key(headers),
+            endpoint_of(path),
+            status,
+            response_headers.get("Retry-After"),
+        )
+
+    def _deadline(self):
+        deadline = current_options().get("deadline", self.retry_policy.deadline)
+        return None if deadline is None else monotonic() + deadline
+
+    def _timeouts(self, deadline: float, attempts: int) -> tuple:
+        """
+        Return the (connect, read) timeouts of an attempt, bounded by the deadline
+        """
+        connect, read = self.connect_timeout, self.read_timeout
+        if deadline is not None:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise APIError("Error: deadline exceeded", attempts=attempts)
+            connect = remaining if connect is None else min(connect, remaining)
+            read = remaining if read is None else min(read, remaining)
+        return connect, read
+
+    def _wait(self, path: str, headers: dict, deadline: float, attempts: int) -> float:
+        """
+        Return how long to wait for the rate limiter before an attempt
+
+        :param deadline: The deadline of the call (monotonic time), if any
+        :param attempts: The number of attempts already made
+
+        :raises APIError: If the wait would outlast the deadline, in which case no
+            rate limiter token is taken
+        """
+        remaining = None if deadline is None else deadline - monotonic()
+        delay = self._throttle_delay(path, headers, remaining)
+        if remaining is not None and delay >= remaining:
+            raise APIError("Error: deadline exceeded", attempts=attempts)
+        return delay
+
+    def _retry_delay(
+        self,
+        attempt: int,
+        status: int,
+        retry_after: str,
+        deadline: float,
+        pool: APIKeyPool = None,
+    ):
+        """
+        Return how long to wait before retrying a failed attempt, or None to give up
+
+        With a key pool a rejected key is retried at once with another key, and
+        Retry-After only pauses the key that received it.
+        """
+        policy = self.retry_policy
+        if attempt >= policy.max_attempts:
+            return None
+        if status in (401, 403):
+            return 0.0 if pool is not None and pool.active else None
+        if not policy.is_retryable(status):
+            return None
+        delay = policy.delay(attempt, None if pool is not None else retry_after)
+        if deadline is not None and monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    def _send(
+        self,
+        method: str,
+        path: str,
+        payload: dict,
+        headers: dict,
+        deadline: float,
+        attempts: int,
+    ) -> tuple:
+        """
+        Send a single attempt
+
+        Waits for the rate limiter or a key are refused if they would outlast the
+        deadline, and the timeouts are computed once they are over. Only the time
+        from sending a successful attempt to its response feeds the latency
+        histogram the hedge delay is based on.
+
+        :param deadline: The deadline of the call (monotonic time), if any
+        :param attempts: The number of attempts already made
+
+        :return: The status, headers and body of the response
+        """
+        priority = self._priority(path)
+        circuit = self._enter_circuit(path)
+        pool = slot = turn = status = response_headers = started = None
+        failed = False
+        try:
+            headers, pool = self._take_key(headers, deadline, attempts)
+            delay = self._wait(path, headers, deadline, attempts)
+            if delay > 0:
+                sleep(delay)
+            slot = self._acquire_slot(path, deadline, attempts)
+            turn = self._acquire_turn(priority, deadline, attempts)
+            timeouts = self._timeouts(deadline, attempts)
+            started = monotonic()
+            response = self.session.request(
+                method, self.url(path), json=payload, headers=headers, timeout=timeouts
+            )
+            status, response_headers = response.status_code, response.headers
+            if status == 200:
+                self.histogram(path).record(monotonic() - started)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._give_key(pool, headers, status, response_headers, started)
+            self._leave_circuit(circuit, status, started, failed)
+            self._release_turn(turn)
+            self._release_slot(slot, status, started, failed)
+        self._observe(path, headers, status, response_headers)
+        return status, response_headers, response.content
+
+    def _lazy(self, lazy_json: bool) -> bool:
+        if lazy_json is not None:
+            return lazy_json
+        return current_options().get("lazy_json", self.lazy_json)
+
+    def _decode(self, body: bytes, lazy_json: bool):
+        """
+        Decode a response body, into a lazy JSONView if requested
+        """
+        if lazy_json:
+            return parse(body, self.json_decoder)
+        return self.json_decoder(body)
+
+    def histogram(self, path: str) -> LatencyHistogram:
+        """
+        Return the latency histogram of an API path
+        """
+        histogram = self.latencies.get(path)
+        if histogram is None:
+            histogram = self.latencies.setdefault(path, LatencyHistogram())
+        return histogram
+
+    def _hedging(self) -> bool:
+        return self.hedge_policy is not None and current_options().get("hedge", True)
+
+    @property
+    def hedge_executor(self) -> ThreadPoolExecutor:
+        """
+        The thread pool running hedged synchronous requests
+
+        It is separate from the batch executor so a hedged call made from a batch
+        worker never waits on a slot held by the batch itself.
+        """
+        if self._hedge_executor is None:
+            self._hedge_executor = ThreadPoolExecutor(
+                max_workers=self.pool_size * 2, thread_name_prefix="shardai-hedge"
+            )
+        return self._hedge_executor
+
+    def _hedge(self, path: str, func, *args):
+        """
+        Call func, and call it a second time if it is slower than the hedge delay
+
+        :return: The result of the first call to succeed
+        """
+        delay = self.hedge_policy.delay(self.latencies.get(path))
+        calls = [self.hedge_executor.submit(copy_context().run, func, *args)]
+        done, _ = futures.wait(calls, timeout=delay)
+        if not done:
+            calls.append(self.hedge_executor.submit(copy_context().run, func, *args))
+        error = None
+        for call in futures.as_completed(calls):
+            if call.exception() is None:
+                for other in calls:
+                    other.cancel()
+                return call.result()
+            error = call.exception()
+        raise error
+
+    async def _hedge_async(self, path: str, func, *args):
+        """
+        Await func, and start it a second time if it is slower than the hedge delay
+
+        :return: The result of the first call to succeed, the other one is cancelled
+        """
+        from asyncio import FIRST_COMPLETED, ensure_future, wait
+
+        delay = self.hedge_policy.delay(self.latencies.get(path))
+        pending = {ensure_future(func(*args))}
+        done, pending = await wait(pending, timeout=delay)
+        if not done:
+            pending.add(ensure_future(func(*args)))
+        error = None
+        try:
+            while done or pending:
+                for call in done:
+                    if call.exception() is None:
+                        return call.result()
+                    error = call.exception()
+                if not pending:
+                    break
+                done, pending = await wait(pending, return_when=FIRST_COMPLETED)
+        finally:
+            for call in pending:
+                call.cancel()
+        raise error
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        payload: dict = None,
+        headers: dict = None,
+        idempotent: bool = False,
+        cached: bool = False,
+        refresh: bool = False,
+        lazy_json: bool = None,
+    ) -> dict:
+        """
+        Send a request over the pooled session and return the decoded json
+
+        Transient failures are retried according to the retry policy, within the
+        deadline set through request_options (or the policy's default deadline).
+        Idempotent requests are hedged when a hedge policy is set.
+
+        :param method: The HTTP method
+        :param path: The API path (or an absolute url)
+        :param payload: The json payload
+        :param headers: The request headers
+        :param idempotent: Whether the request may safely be sent twice
+        :param cached: Whether the response may be served from the discovery cache
+        :param refresh: Whether to bypass and refresh the discovery cache
+        :param lazy_json: Whether to return a JSONView (per-call option by default)
+
+        :return: The decoded json response
+        """
+        if cached and self.discovery_cache is not None:
+            return deepcopy(
+                self.discovery_cache.get_or_load(
+                    f"{method} {path}",
+                    lambda: self.request(
+                        method, path, payload, headers, idempotent, lazy_json=False
+                    ),
+                    refresh,
+                )
+            )
+        deadline = self._deadline()
+        lazy_json = self._lazy(lazy_json)
+        if idempotent and self._hedging():
+            return self._hedge(
+                path,
+                self._request,
+                method,
+                path,
+                payload,
+                headers,
+                deadline,
+                lazy_json,
+            )
+        return self._request(method, path, payload, headers, deadline, lazy_json)
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        payload: dict,
+        headers: dict,
+        deadline: float,
+        lazy_json: bool,
+    ) -> dict:
+        from requests import RequestException
+
+        attempt = 0
+        while True:
+            attempt += 1
+            cause = retry_after = status = None
+            try:
+                status, response_headers, body = self._send(
+                    method, path, payload, headers, deadline, attempt - 1
+                )
+            except RequestException as error:
+                cause = error
+            else:
+                if status == 200:
+                    return self._decode(body, lazy_json)
+                retry_after = response_headers.get("Retry-After")
+            delay = self._retry_delay(
+                attempt, status, retry_after, deadline, _key_pool(headers)
+            )
+            if delay is None:
+                raise _error(status)(
+                    f"Error: {status or _describe(cause)}",
+                    status=status,
+                    attempts=attempt,
+                ) from cause
+            sleep(delay)
+
+    def stream(
+        self, method: str, path: str, payload: dict = None, headers: dict = None
+    ):
+        """
+        Send a request and yield the decoded json of every server-sent event
+
+        Streams are not retried, the read timeout applies between two chunks.
+
+        :param method: The HTTP method
+        :param path: The API path (or an absolute url)
+        :param payload: The json payload
+        :param headers: The request headers
+
+        :return: A generator of decoded events
+        """
+        from requests import RequestException
+
+        deadline = self._deadline()
+        circuit = self._enter_circuit(path)
+        pool = status = response_headers = started = finished = None
+        failed = False
+        try:
+            headers, pool = self._take_key(headers, deadline, 0)
+            delay = self._wait(path, headers, deadline, 0)
+            if delay > 0:
+                sleep(delay)
+            timeouts = self._timeouts(deadline, 0)
+            started = monotonic()
+            response = self.session.request(
+                method,
+                self.url(path),
+                json=payload,
+                headers=headers,
+                stream=True,
+                timeout=timeouts,
+            )
+            with response:
+                status, response_headers = response.status_code, response.headers
+                finished = monotonic()
+                self._observe(path, headers, status, response_headers)
+                if status != 200:
+                    raise _error(status)(f"Error: {status}", status=status, attempts=1)
+                for line in response.iter_lines():
+                    data = _event_data(line.decode("utf-8"))
+                    if data is None:
+                        continue
+                    if data == "[DONE]":
+                        return
+                    yield self.json_decoder(data)
+        except RequestException as error:
+            failed = True
+            raise APIError(
+                f"Error: {_describe(error)}", status=status, attempts=1
+            ) from error
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._give_key(pool, headers, status, response_headers, started)
+            self._leave_circuit(circuit, status, started, failed, finished)
+
+    def fetch(self, url: str) -> tuple:
+        """
+        Download an asset over the pooled session
+
+        :param url: The url of the asset (or an API path)
+
+        :return: The body and the content type of the response
+        """
+        from requests import RequestException
+
+        try:
+            response = self.session.get(
+                self.url(url), timeout=(self.connect_timeout, self.read_timeout)
+            )
+        except RequestException as error:
+            raise APIError(f"Error: {_describe(error)}", attempts=1) from error
+        if response.status_code != 200:
+            raise APIError(
+                f"Error: {response.status_code}",
+                status=response.status_code,
+                attempts=1,
+            )
+        return response.content, response.headers.get("Content-Type")
+
+    def download(
+        self,
+        url: str,
+        path: str,
+        chunk_size: int = 65536,
+        checksum: str = None,
+        resume: bool = False,
+    ):
+        """
+        Stream an asset to a file in chunks over the pooled session
+
+        The body is written to path.part and moved into place once complete.
+        A failed download removes the partial file unless resume is set, in
+        which case it is kept and the next call continues it with a Range request.
+
+        :param url: The url of the asset (or an API path)
+        :param path: The file to write
+        :param chunk_size: The number of bytes read at a time
+        :param checksum: A hashlib algorithm to hash the body with while writing it
+        :param resume: Whether to continue a partial file, and keep it on failure
+
+        :return: The hex digest of the body, or None without checksum
+        """
+        from requests import RequestException
+
+        partial = f"{path}.part"
+        offset = _partial_size(partial) if resume else 0
+        digest = new_hash(checksum) if checksum else None
+        try:
+            with self.session.get(
+                self.url(url),
+                headers={"Range": f"bytes={offset}-"} if offset else None,
+                stream=True,
+                timeout=(self.connect_timeout, self.read_timeout),
+            ) as response:
+                status = response.status_code
+                if status == 416 and offset:
+                    remove(partial)
+                    return self.download(url, path, chunk_size, checksum, resume)
+                if status not in (200, 206):
+                    raise APIError(f"Error: {status}", status=status, attempts=1)
+                append = bool(offset) and status == 206
+                with _open_partial(partial, digest, append) as file:
+                    for chunk in response.iter_content(chunk_size):
+                        _write_chunk(file, digest, chunk)
+                replace(partial, path)
+        except RequestException as error:
+            raise APIError(f"Error: {_describe(error)}", attempts=1) from error
+        finally:
+            if not resume and exists(partial):
+                remove(partial)
+        return digest.hexdigest() if digest else None
+
+    async def session_async(self):
+        """
+        Return the shared aiohttp session, creating it in the running loop if needed
+        """
+        from asyncio import get_running_loop
+
+        loop = get_running_loop()
+        if (
+            self._async_session is None
+            or self._async_session.closed
+            or self._async_loop is not loop
+        ):
+            from aiohttp import ClientSession, TCPConnector
+
+            connector = TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl,
+                use_dns_cache=self.dns_cache_ttl > 0,
+            )
+            self._async_session = ClientSession(connector=connector)
+            self._async_loop = loop
+        return self._async_session
+
+    def _client_timeout(self, deadline: float, attempts: int):
+        from aiohttp import ClientTimeout
+
+        connect, read = self._timeouts(deadline, attempts)
+        total = None if deadline is None else deadline - monotonic()
+        return ClientTimeout(total=total, sock_connect=connect, sock_read=read)
+
+    async def _send_async(
+        self,
+        method: str,
+        path: str,
+        payload: dict,
+        headers: dict,
+        deadline: float,
+        attempts: int,
+    ) -> tuple:
+        """
+        Send a single attempt
+
+        Waits for the rate limiter or a key are refused if they would outlast the
+        deadline, and the timeouts are computed once they are over. Only the time
+        from sending a successful attempt to its response feeds the latency
+        histogram the hedge delay is based on.
+
+        :param deadline: The deadline of the call (monotonic time), if any
+        :param attempts: The number of attempts already made
+
+        :return: The status, headers and body of the response
+        """
+        from asyncio import sleep as sleep_async
+
+        priority = self._priority(path)
+        circuit = self._enter_circuit(path)
+        pool = slot = turn = status = response_headers = started = None
+        failed = False
+        try:
+            headers, pool = await self._take_key_async(headers, deadline, attempts)
+            delay = self._wait(path, headers, deadline, attempts)
+            if delay > 0:
+                await sleep_async(delay)
+            session = await self.session_async()
+            slot = await self._acquire_slot_async(path, deadline, attempts)
+            turn = await self._acquire_turn_async(priority, deadline, attempts)
+            timeout = self._client_timeout(deadline, attempts)
+            started = monotonic()
+            async with session.request(
+                method, self.url(path), json=payload, headers=headers, timeout=timeout
+            ) as response:
+                self._observe(path, headers, response.status, response.headers)
+                body = await response.read()
+                status, response_headers = response.status, response.headers
+            if status == 200:
+                self.histogram(path).record(monotonic() - started)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._give_key(pool, headers, status, response_headers, started)
+            self._leave_circuit(circuit, status, started, failed)
+            self._release_turn(turn)
+            self._release_slot(slot, status, started, failed)
+        return status, response_headers, body
+
+    async def request_async(
+        self,
+        method: str,
+        path: str,
+        payload: dict = None,
+        headers: dict = None,
+        idempotent: bool = False,
+        cached: bool = False,
+        refresh: bool = False,
+        coalesce: bool = False,
+        lazy_json: bool = None,
+    ) -> dict:
+        """
+        Send a request over the shared async session and return the decoded json
+
+        Transient failures are retried according to the retry policy, within the
+        deadline set through request_options (or the policy's default deadline).
+        Idempotent requests are hedged when a hedge policy is set, and identical
+        concurrent requests share one response when coalescing is enabled.
+
+        :param method: The HTTP method
+        :param path: The API path (or an absolute url)
+        :param payload: The json payload
+        :param headers: The request headers
+        :param idempotent: Whether the request may safely be sent twice
+        :param cached: Whether the response may be served from the discovery cache
+        :param refresh: Whether to bypass and refresh the discovery cache
+        :param coalesce: Whether identical concurrent requests may share a response
+        :param lazy_json: Whether to return a JSONView (per-call option by default)
+
+        :return: The decoded json response
+        """
+        lazy_json = self._lazy(lazy_json)
+        if coalesce and self.coalescer is not None:
+            key = (
+                method,
+                path,
+                _api_key(headers),
+                dumps(payload, sort_keys=True),
+                lazy_json,
+            )
+            return await self.coalescer.run(
+                key,
+                lambda: self.request_async(
+                    method, path, payload, headers, idempotent, lazy_json=lazy_json
+                ),
+            )
+        if cached and self.discovery_cache is not None:
+            return deepcopy(
+                await self.discovery_cache.get_or_load_async(
+                    f"{method} {path}",
+                    lambda: self.request_async(
+                        method, path, payload, headers, idempotent, lazy_json=False
+                    ),
+                    refresh,
+                )
+            )
+        deadline = self._deadline()
+        if idempotent and self._hedging():
+            return await self._hedge_async(
+                path,
+                self._request_async,
+                method,
+                path,
+                payload,
+                headers,
+                deadline,
+                lazy_json,
+            )
+        return await self._request_async(
+            method, path, payload, headers, deadline, lazy_json
+        )
+
+    async def _request_async(
+        self,
+        method: str,
+        path: str,
+        payload: dict,
+        headers: dict,
+        deadline: float,
+        lazy_json: bool,
+    ) -> dict:
+        from asyncio import TimeoutError as AsyncTimeoutError
+        from asyncio import sleep as sleep_async
+
+        from aiohttp import ClientError
+
+        attempt = 0
+        while True:
+            attempt += 1
+            cause = retry_after = status = None
+            try:
+                status, response_headers, body = await self._send_async(
+                    method, path, payload, headers, deadline, attempt - 1
+                )
+            except (ClientError, AsyncTimeoutError) as error:
+                cause = error
+            else:
+                if status == 200:
+                    return self._decode(body, lazy_json)
+                retry_after = response_headers.get("Retry-After")
+            delay = self._retry_delay(
+                attempt, status, retry_after, deadline, _key_pool(headers)
+            )
+            if delay is None:
+                raise _error(status)(
+                    f"Error: {status or _describe(cause)}",
+                    status=status,
+                    attempts=attempt,
+                ) from cause
+            await sleep_async(delay)
+
+    async def stream_async(
+        self, method: str, path: str, payload: dict = None, headers: dict = None
+    ):
+        """
+        Send a request and yield the decoded json of every server-sent event
+
+        Streams are not retried, the read timeout applies between two chunks.
+
+        :param method: The HTTP method
+        :param path: The API path (or an absolute url)
+        :param payload: The json payload
+        :param headers: The request headers
+
+        :return: An async generator of decoded events
+        """
+        from asyncio import TimeoutError as AsyncTimeoutError
+        from asyncio import sleep as sleep_async
+
+        from aiohttp import ClientError
+
+        deadline = self._deadline()
+        circuit = self._enter_circuit(path)
+        pool = status = response_headers = started = finished = None
+        failed = False
+        try:
+            headers, pool = await self._take_key_async(headers, deadline, 0)
+            delay = self._wait(path, headers, deadline, 0)
+            if delay > 0:
+                await sleep_async(delay)
+            session = await self.session_async()
+            timeout = self._client_timeout(deadline, 0)
+            started = monotonic()
+            async with session.request(
+                method, self.url(path), json=payload, headers=headers, timeout=timeout
+            ) as response:
+                status, response_headers = response.status, response.headers
+                finished = monotonic()
+                self._observe(path, headers, status, response_headers)
+                if status != 200:
+                    raise _error(status)(f"Error: {status}", status=status, attempts=1)
+                async for line in response.content:
+                    data = _event_data(line.decode("utf-8"))
+                    if data is None:
+                        continue
+                    if data == "[DONE]":
+                        return
+                    yield self.json_decoder(data)
+        except (ClientError, AsyncTimeoutError) as error:
+            failed = True
+            raise APIError(
+                f"Error: {_describe(error)}", status=status, attempts=1
+            ) from error
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._give_key(pool, headers, status, response_headers, started)
+            self._leave_circuit(circuit, status, started, failed, finished)
+
+    async def fetch_async(self, url: str) -> tuple:
+        """
+        Download an asset over the shared async session
+
+        :param url: The url of the asset (or an API path)
+
+        :return: The body and the content type of the response
+        """
+        from asyncio import TimeoutError as AsyncTimeoutError
+
+        from aiohttp import ClientError, ClientTimeout
+
+        session = await self.session_async()
+        timeout = ClientTimeout(
+            sock_connect=self.connect_timeout, sock_read=self.read_timeout
+        )
+        try:
+            async with session.get(self.url(url), timeout=timeout) as response:
+                if response.status != 200:
+                    raise APIError(
+                        f"Error: {response.status}",
+                        status=response.status,
+                        attempts=1,
+                    )
+                return await response.read(), response.headers.get("Content-Type")
+        except (ClientError, AsyncTimeoutError) as error:
+            raise APIError(f"Error: {_describe(error)}", attempts=1) from error
+
+    async def download_async(
+        self,
+        url: str,
+        path: str,
+        chunk_size: int = 65536,
+        checksum: str = None,
+        resume: bool = False,
+    ):
+        """
+        Stream an asset to a file in chunks over the shared async session
+
+        The event loop never touches the disk: the file is opened, written,
+        hashed and closed on worker threads, each chunk being written while
+        the next one is read. Partial files are handled as in download.
+
+        :param url: The url of the asset (or an API path)
+        :param path: The file to write
+        :param chunk_size: The number of bytes read at a time
+        :param checksum: A hashlib algorithm to hash the body with while writing it
+        :param resume: Whether to continue a partial file, and keep it on failure
+
+        :return: The hex digest of the body, or None without checksum
+        """
+        from asyncio import TimeoutError as AsyncTimeoutError
+        from asyncio import get_running_loop, wait
+
+        from aiohttp import ClientError, ClientTimeout
+
+        loop = get_running_loop()
+        session = await self.session_async()
+        timeout = ClientTimeout(
+            sock_connect=self.connect_timeout, sock_read=self.read_timeout
+        )
+        partial = f"{path}.part"
+        offset = 0
+        if resume:
+            offset = await loop.run_in_executor(None, _partial_size, partial)
+        digest = new_hash(checksum) if checksum else None
+        file = writing = None
+        try:
+            async with session.get(
+                self.url(url),
+                headers={"Range": f"bytes={offset}-"} if offset else None,
+                timeout=timeout,
+            ) as response:
+                status = response.status
+                if status == 416 and offset:
+                    await loop.run_in_executor(None, remove, partial)
+                    return await self.download_async(
+                        url, path, chunk_size, checksum, resume
+                    )
+                if status not in (200, 206):
+                    raise APIError(f"Error: {status}", status=status, attempts=1)
+                append = bool(offset) and status == 206
+                file = await loop.run_in_executor(
+                    None, _open_partial, partial, digest, append
+                )
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    if writing is not None:
+                        await writing
+                    writing = loop.run_in_executor(
+                        None, _write_chunk, file, digest, chunk
+                    )
+                if writing is not None:
+                    await writing
+            await loop.run_in_executor(None, _close_file, file, partial, path)
+            file = None
+        except (ClientError, AsyncTimeoutError) as error:
+            raise APIError(f"Error: {_describe(error)}", attempts=1) from error
+        finally:
+            if file is not None:
+                if writing is not None and not writing.done():
+                    await wait((writing,))
+                await loop.run_in_executor(
+                    None, _close_file, file, partial, None, resume
+                )
+        return digest.hexdigest() if digest else None
+
+    def _warm_count(self, connections: int) -> int:
+        """
+        Bound the number of connections to warm by the size of the pools
+        """
+        limit = min(self.pool_size, self.limit_per_host or self.pool_size)
+        return max(0, min(connections, limit))
+
+    def warmup(self, connections: int) -> int:
+        """
+        Open connections to the API ahead of traffic and leave them idle in the pool
+
+        All connections are held open together so each one pays its own DNS
+        lookup and TLS handshake, then they are released to the pool at once.
+
+        :param connections: The number of connections to open (at most the pool size)
+
+        :return: The number of connections opened
+        """
+        from requests import RequestException
+
+        connections = self._warm_count(connections)
+        if not connections:
+            return 0
+        barrier = Barrier(connections)
+        timeout = self.connect_timeout
+
+        def connect() -> bool:
+            response = None
+            try:
+                response = self.session.request(
+                    "HEAD", self.url("/"), stream=True, timeout=(timeout, timeout)
+                )
+            except RequestException:
+                pass
+            try:
+                barrier.wait(timeout)
+            except BrokenBarrierError:
+                pass
+            if response is None:
+                return False
+            # Reading the (empty) body hands the connection back to the pool,
+            # closing the response unread would drop the socket instead
+            response.content
+            return True
+
+        with ThreadPoolExecutor(
+            connections, thread_name_prefix="shardai-warmup"
+        ) as executor:
+            opened = list(executor.map(lambda _: connect(), range(connections)))
+        return sum(opened)
+
+    async def warmup_async(self, connections: int) -> int:
+        """
+        Open connections to the API ahead of traffic and leave them idle in the pool
+
+        Idle async connections are closed after keepalive_timeout seconds.
+
+        :param connections: The number of connections to open (at most the pool size)
+
+        :return: The number of connections opened
+        """
+        from asyncio import TimeoutError as AsyncTimeoutError
+        from asyncio import Event, gather, wait_for
+
+        from aiohttp import ClientError, ClientTimeout
+
+        connections = self._warm_count(connections)
+        if not connections:
+            return 0
+        session = await self.session_async()
+        timeout = ClientTimeout(
+            sock_connect=self.connect_timeout, sock_read=self.connect_timeout
+        )
+        connected = Event()
+        pending = [connections]
+
+        def arrived():
+            pending[0] -= 1
+            if not pending[0]:
+                connected.set()
+
+        async def connect() -> bool:
+            try:
+                async with session.request("HEAD", self.url("/"), timeout=timeout):
+                    arrived()
+                    try:
+                        await wait_for(connected.wait(), self.connect_timeout)
+                    except AsyncTimeoutError:
+                        pass
+                    return True
+            except (ClientError, AsyncTimeoutError):
+                arrived()
+                return False
+
+        return sum(await gather(*[connect() for _ in range(connections)]))
+
+    def close(self):
+        """
+        Close the pooled sessions
+        """
+        for executor in (self._executor, self._hedge_executor):
+            if executor is not None:
+                executor.shutdown(wait=False)
+        self._executor = self._hedge_executor = None
+        if self._session is not None:
+            self._session.close()
+        session, loop = self._async_session, self._async_loop
+        self._async_session = self._async_loop = None
+        if session is not None and not session.closed:
+            if not loop.is_closed() and not loop.is_running():
+                loop.run_until_complete(session.close())
+
+    async def close_async(self):
+        """
+        Close the pooled sessions asynchronously
+        """
+        for executor in (self._executor, self._hedge_executor):
+            if executor is not None:
+                executor.shutdown(wait=False)
+        self._executor = self._hedge_executor = None
+        if self._session is not None:
+            self._session.close()
+        session = self._async_session
+        self._async_session = self._async_loop = None
+        if session is not None and not session.closed:
+            await session.close()
@@ -1,14 +1,61 @@
-from aiohttp import ClientSession
-from requests import get
-
+from .batch import gather_bounded, map_bounded
+from .cache import AudioCache
 from .exceptions import *
+from .jsonview import raw_field
 from .objects import (EdgeVoice, ElevenLabsVoice, GoogleVoice, TikTokVoice,
-                      TTSResponse)
+                      TTSResponse, _mime_of)
+from .transport import Transport
+
+
+def _cache_response(cache: AudioCache, key: str, response: TTSResponse):
+    """
+    Store the decoded audio of a response in the cache
+
+    The bytes are kept on the response, so reading them again does not download
+    or decode the audio a second time.
+    """
+    try:
+        cache.store(key, response, response.as_bytes(), _mime_of(response, "audio/mp3"))
+    except (APIError, OSError, ValueError):
+        pass
 
 
 class TTSAsync:
-    def __init__(self, api_key: str):
+    def __init__(
+        self, api_key: str, transport: Transport = None, cache: AudioCache = None
+    ):
         self.api_key = api_key
+        self.transport = transport or Transport()
+        self.cache = cache
+
+    async def _load(self, key: str):
+        """
+        Return the cached audio of a key, reading the disk on a worker thread
+        """
+        from asyncio import get_running_loop
+
+        if self.cache.disk is None:
+            return self.cache.load(key)
+        return await get_running_loop().run_in_executor(None, self.cache.load, key)
+
+    async def _store(self, key: str, response: TTSResponse):
+        """
+        Store the decoded audio of a response in the cache, writing the disk on a
+        worker thread
+        """
+        from asyncio import get_running_loop
+
+        if response.url is not None:
+            try:
+                await response.as_bytes_async()
+            except APIError:
+                return
+        if self.cache.disk is None:
+            _cache_response(self.cache, key, response)
+        else:
+            await get_running_loop().run_in_executor(
+                None, _cache_response, self.cache, key, response
+            )
 
     async def completions(
         self,
@@ -50,56 +97,93 @@ class TTSAsync:
             }
         else:
             raise APIError("Invalid model")
-        async with ClientSession() as session:
-            async with session.post(
-                "https://shard-ai.xyz/v1/tts/completions", json=payload, headers=headers
-            ) as response:
-                json_response = await response.json()
-                if response.status != 200:
-                    raise APIError(f"Error: {response.status}")
-                return TTSResponse(
-                    json_response["audio"],
-                    json_response["generation-time"],
-                    json_response["warning!"],
-                    json_response["info"],
-                )
+        key = None
+        if self.cache is not None:
+            key = self.cache.payload_key(payload)
+            cached = await self._load(key)
+            if cached is not None:
+                return cached
+        json_response = await self.transport.request_async(
+            "POST", "/v1/tts/completions", payload, headers, coalesce=True
+        )
+        response = TTSResponse(
+            raw_field(json_response, "audio"),
+            json_response["generation-time"],
+            json_response["warning!"],
+            json_response["info"],
+            transport=self.transport,
+        )
+        if key is not None:
+            await self._store(key, response)
+        return response
+
+    async def completions_many(
+        self,
+        requests,
+        concurrency: int = 8,
+        return_exceptions: bool = False,
+        **kwargs,
+    ) -> list:
+        """
+        Run many text to speech requests concurrently over the shared session
+
+        :param requests: An iterable of kwargs dicts, args tuples or prompts
+        :param concurrency: The maximum number of requests in flight
+        :param return_exceptions: Whether to return exceptions instead of raising
+        :param kwargs: Keyword arguments shared by every request
 
-    async def voices(self):
+        :return: The responses in the order of the requests
+        """
+        return await gather_bounded(
+            self.completions, requests, concurrency, return_exceptions, **kwargs
+        )
+
+    async def voices(self, refresh: bool = False):
         """
         Get available voices
 
+        :param refresh: Whether to bypass the cache and fetch them again
+
         :return: A list of available voices
         """
-        async with ClientSession() as session:
-            async with session.get("https://shard-ai.xyz/v1/tts/voices") as response:
-                json_response = await response.json()
-                if response.status != 200:
-                    raise APIError(f"Error: {response.status}")
-                return {
-                    "elevenlabs": [
-                        ElevenLabsVoice(
-                            voice["name"],
-                            voice["accent"],
-                            voice["age"],
-                            voice["gender"],
-                            voice["use_case"],
-                        )
-                        for voice in json_response["eleven_labs"]
-                    ],
-                    "tiktok": [TikTokVoice(voice) for voice in json_response["tiktok"]],
-                    "edge": [
-                        EdgeVoice(
-                            json_response["bing"]["Message"],
-                            json_response["bing"]["parameters"],
-                        )
-                    ],
-                    "google": [GoogleVoice(json_response["google"]["Messages"])],
-                }
+        json_response = await self.transport.request_async(
+            "GET", "/v1/tts/voices", idempotent=True, cached=True, refresh=refresh
+        )
+        return {
+            "elevenlabs": [
+                ElevenLabsVoice(
+                    voice["name"],
+                    voice["accent"],
+                    voice["age"],
+                    voice["gender"],
+                    voice["use_case"],
+                )
+                for voice in json_response["eleven_labs"]
+            ],
+            "tiktok": [TikTokVoice(voice) for voice in json_response["tiktok"]],
+            "edge": [
+                EdgeVoice(
+                    json_response["bing"]["Message"],
+                    json_response["bing"]["parameters"],
+                )
+            ],
+            "google": [GoogleVoice(json_response["google"]["Messages"])],
+        }
 
 
 class TTS:
-    def __init__(self, api_key: str):
+    def __init__(
+        self, api_key: str, transport: Transport = None, cache: AudioCache = None
+    ):
         self.api_key = api_key
+        self.transport = transport or Transport()
+        self.cache = cache
+
+    def _store(self, key: str, response: TTSResponse):
+        """
+        Store the decoded audio of a response in the cache
+        """
+        _cache_response(self.cache, key, response)
 
     def completions(
         self,
@@ -124,7 +208,7 @@ class TTS:
             raise NoAPIKeyError("API key is required for this function")
         if prompt is None:
             raise NoInputError("Prompt is required for this function")
-        headers = {"api-key": f"{self.api_key}"}
+        headers = {"api-key": self.api_key}
         if model.lower() in ["google", "edge"]:
             payload = {
                 "prompt": prompt,
@@ -140,31 +224,68 @@ class TTS:
             }
         else:
             raise APIError("Invalid model")
-        response = get(
-            "https://shard-ai.xyz/v1/tts/completions", json=payload, headers=headers
+        key = None
+        if self.cache is not None:
+            key = self.cache.payload_key(payload)
+            cached = self.cache.load(key)
+            if cached is not None:
+                return cached
+        response_json = self.transport.request(
+            "GET", "/v1/tts/completions", payload, headers
         )
-        if response.status_code != 200:
-            raise APIError(f"Error: {response.status_code}")
-        response_json = response.json()
-        return TTSResponse(
-            response_json["audio"],
+        response = TTSResponse(
+            raw_field(response_json, "audio"),
             response_json["generation-time"],
             response_json["warning!"],
             response_json["info"],
+            transport=self.transport,
         )
+        if key is not None:
+            self._store(key, response)
+        return response
 
-    def voices(self):
+    def completions_map(
+        self,
+        requests,
+        max_workers: int = None,
+        timeout: float = None,
+        return_exceptions: bool = False,
+        **kwargs,
+    ) -> list:
+        """
+        Run many text to speech requests on the shared thread pool
+
+        :param requests: An iterable of kwargs dicts, args tuples or prompts
+        :param max_workers: The maximum requests in flight (the pool size by default)
+        :param timeout: The maximum number of seconds a single request may take
+        :param return_exceptions: Whether to return exceptions instead of raising
+        :param kwargs: Keyword arguments shared by every request
+
+        :return: The responses in the order of the requests
+        """
+        return map_bounded(
+            self.transport.executor,
+            self.completions,
+            requests,
+            max_workers or self.transport.pool_size,
+            timeout,
+            return_exceptions,
+            **kwargs,
+        )
+
+    def voices(self, refresh: bool = False):
         """
         Get available voices
 
+        :param refresh: Whether to bypass the cache and fetch them again
+
         :return: A list of available voices
 
         
         """
-        response = get("https://shard-ai.xyz/v1/tts/voices")
-        if response.status_code != 200:
-            raise APIError(f"Error: {response.status_code}")
-        response_json = response.json()
+        response_json = self.transport.request(
+            "GET", "/v1/tts/voices", idempotent=True, cached=True, refresh=refresh
+        )
         return {
             "elevenlabs": [
                 ElevenLabsVoice(
@@ -0,0 +1,52 @@
+"""
+Measure the cold start of shardai: importing the package and building a client
+
+Every run happens in a fresh interpreter. The script fails if the HTTP
+libraries (or asyncio) are loaded before a sub-client is actually used.
+
+    python tests/bench_import.py [runs]
+"""
+
+from statistics import median
+from subprocess import run
+from sys import argv, executable
+
+HEAVY_MODULES = ("aiohttp", "requests", "asyncio")
+
+SNIPPET = f"""
+from sys import modules
+from time import perf_counter
+
+started = perf_counter()
+import shardai
+imported = perf_counter()
+client = shardai.ShardClient("key")
+built = perf_counter()
+loaded = [name for name in {HEAVY_MODULES!r} if name in modules]
+print(imported - started, built - imported, ",".join(loaded))
+"""
+
+
+def measure(runs: int = 10):
+    """
+    Return the import and construction times of every run, in seconds
+
+    :param runs: The number of fresh interpreters to start
+    """
+    imports, builds = [], []
+    for _ in range(runs):
+        output = run(
+            [executable, "-c", SNIPPET], capture_output=True, text=True, check=True
+        )
+        import_time, build_time, loaded = (output.stdout.split() + [""])[:3]
+        if loaded:
+            raise AssertionError(f"Loaded at import time: {loaded}")
+        imports.append(float(import_time))
+        builds.append(float(build_time))
+    return imports, builds
+
+
+if __name__ == "__main__":
+    imports, builds = measure(int(argv[1]) if len(argv) > 1 else 10)
+    print(f"import shardai: {median(imports) * 1000:.1f} ms (median)")
+    print(f"ShardClient(): {median(builds) * 1000:.2f} ms (median)")
@@ -0,0 +1,60 @@
+"""
+Checks of map_bounded timeouts
+
+A timed out call must not keep its thread busy past its deadline, and the
+timer of a call starts when it starts running, not when it is queued.
+
+    python tests/test_batch.py
+"""
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from time import monotonic, sleep
+
+from shardai import APIError
+from shardai.batch import map_bounded
+from shardai.transport import current_options
+
+
+def request(prompt: float):
+    """
+    Stand in for a request taking prompt seconds, bounded by the call deadline
+    """
+    deadline = current_options().get("deadline")
+    if deadline is not None and deadline < prompt:
+        sleep(deadline)
+        raise APIError("Error: deadline exceeded", attempts=1)
+    sleep(prompt)
+    return prompt
+
+
+def check_threads_freed():
+    with ThreadPoolExecutor(2) as executor:
+        results = map_bounded(
+            executor, request, [5, 5], timeout=0.1, return_exceptions=True
+        )
+        errors = (TimeoutError, APIError)
+        assert all(isinstance(result, errors) for result in results), results
+        started = monotonic()
+        assert map_bounded(executor, request, [0.05, 0.05], timeout=1) == [0.05, 0.05]
+        assert monotonic() - started < 1
+
+
+def check_timer_starts_with_call():
+    with ThreadPoolExecutor(1) as executor:
+        results = map_bounded(executor, request, [0.05] * 3, timeout=0.08)
+    assert results == [0.05] * 3
+
+
+def test_threads_freed():
+    check_threads_freed()
+
+
+def test_timer_starts_with_call():
+    check_timer_starts_with_call()
+
+
+if __name__ == "__main__":
+    for name, check in list(globals().items()):
+        if name.startswith("test_"):
+            check()
+            print(f"{name}: ok")
@@ -0,0 +1,117 @@
+"""
+Deterministic checks of the circuit breaker state transitions
+
+    python tests/test_breaker.py
+"""
+
+from shardai import CircuitBreaker, CircuitOpenError, breaker
+
+
+class Clock:
+    """
+    Stands in for time.monotonic in the breaker module
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def __enter__(self):
+        self.monotonic, breaker.monotonic = breaker.monotonic, self
+        return self
+
+    def __exit__(self, *exc_info):
+        breaker.monotonic = self.monotonic
+
+
+def call(circuit, failed: bool = False, latency: float = 0.1):
+    circuit.acquire()
+    circuit.record(failed, latency)
+
+
+def rejected(circuit) -> bool:
+    try:
+        circuit.acquire()
+    except CircuitOpenError:
+        return True
+    circuit.release()
+    return False
+
+
+def check_opens_on_failure_rate():
+    transitions = []
+    circuits = CircuitBreaker(
+        min_calls=4,
+        window=4,
+        on_state_change=lambda *transition: transitions.append(transition),
+    )
+    circuit = circuits.circuit("chat")
+    for failed in (True, False, True):
+        call(circuit, failed)
+    assert circuit.state == "closed"
+    call(circuit, False)
+    assert circuit.state == "open"
+    assert transitions == [("chat", "closed", "open")]
+    assert circuits.circuit("tts").state == "closed"
+
+
+def check_opens_on_slow_calls():
+    circuit = CircuitBreaker(min_calls=2, slow_call_duration=1).circuit("sdxl")
+    call(circuit, latency=0.5)
+    call(circuit, latency=1.0)
+    assert circuit.state == "open"
+
+
+def check_half_open():
+    with Clock() as clock:
+        circuit = CircuitBreaker(min_calls=1, open_timeout=30).circuit("chat")
+        call(circuit, failed=True)
+        try:
+            circuit.acquire()
+        except CircuitOpenError as error:
+            assert error.endpoint == "chat" and error.retry_in == 30
+        else:
+            raise AssertionError("an open circuit let a call through")
+        clock.now += 30
+        circuit.acquire()
+        assert circuit.state == "half_open" and rejected(circuit)
+        circuit.record(True, 0.1)
+        assert circuit.state == "open" and rejected(circuit)
+        clock.now += 30
+        call(circuit)
+        assert circuit.state == "closed" and not rejected(circuit)
+
+
+def check_abandoned_trial():
+    with Clock() as clock:
+        circuit = CircuitBreaker(min_calls=1, open_timeout=1).circuit("chat")
+        call(circuit, failed=True)
+        clock.now += 1
+        circuit.acquire()
+        circuit.release()
+        assert circuit.state == "half_open" and not rejected(circuit)
+
+
+def test_opens_on_failure_rate():
+    check_opens_on_failure_rate()
+
+
+def test_opens_on_slow_calls():
+    check_opens_on_slow_calls()
+
+
+def test_half_open():
+    check_half_open()
+
+
+def test_abandoned_trial():
+    check_abandoned_trial()
+
+
+if __name__ == "__main__":
+    for name, check in list(globals().items()):
+        if name.startswith("test_"):
+            check()
+            print(f"{name}: ok")
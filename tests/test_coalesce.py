@@ -0,0 +1,98 @@
+"""
+Regression checks for shared in-flight calls (Coalescer and TTLCache)
+
+Cancelling or timing out one caller must not cancel the other callers
+waiting on the same call.
+
+    python tests/test_coalesce.py
+"""
+
+from asyncio import (CancelledError, TimeoutError, ensure_future, gather, run,
+                     sleep, wait_for)
+
+from shardai import Coalescer, TTLCache
+
+
+async def slow(calls: list, value="done", delay: float = 0.05):
+    calls.append(value)
+    await sleep(delay)
+    return value
+
+
+async def check_coalescer_cancel():
+    coalescer, calls = Coalescer(), []
+    leader = ensure_future(coalescer.run("key", lambda: slow(calls)))
+    await sleep(0)
+    follower = ensure_future(coalescer.run("key", lambda: slow(calls)))
+    await sleep(0.01)
+    leader.cancel()
+    assert await follower == "done"
+    assert len(calls) == 1
+    try:
+        await leader
+    except CancelledError:
+        pass
+    else:
+        raise AssertionError("the leader was not cancelled")
+    assert not len(coalescer)
+
+
+async def check_coalescer_timeout():
+    coalescer, calls = Coalescer(), []
+    leader = wait_for(coalescer.run("key", lambda: slow(calls)), 0.01)
+    follower = coalescer.run("key", lambda: slow(calls))
+    results = await _gather(leader, follower)
+    assert isinstance(results[0], TimeoutError)
+    assert results[1] == "done"
+    assert len(calls) == 1
+
+
+async def check_coalescer_all_cancelled():
+    coalescer, calls = Coalescer(), []
+    first = ensure_future(coalescer.run("key", lambda: slow(calls, delay=1)))
+    second = ensure_future(coalescer.run("key", lambda: slow(calls, delay=1)))
+    await sleep(0.01)
+    first.cancel()
+    second.cancel()
+    await _gather(first, second)
+    await sleep(0)
+    assert not len(coalescer)
+
+
+async def check_cache_cancel():
+    cache, calls = TTLCache(60), []
+    leader = ensure_future(cache.get_or_load_async("models", lambda: slow(calls)))
+    await sleep(0)
+    follower = ensure_future(cache.get_or_load_async("models", lambda: slow(calls)))
+    await sleep(0.01)
+    leader.cancel()
+    assert await follower == "done"
+    assert cache.get("models") == "done"
+    assert len(calls) == 1
+
+
+async def _gather(*calls):
+    return await gather(*calls, return_exceptions=True)
+
+
+def test_coalescer_cancel():
+    run(check_coalescer_cancel())
+
+
+def test_coalescer_timeout():
+    run(check_coalescer_timeout())
+
+
+def test_coalescer_all_cancelled():
+    run(check_coalescer_all_cancelled())
+
+
+def test_cache_cancel():
+    run(check_cache_cancel())
+
+
+if __name__ == "__main__":
+    for name, check in list(globals().items()):
+        if name.startswith("test_"):
+            check()
+            print(f"{name}: ok")
@@ -0,0 +1,146 @@
+"""
+Deterministic checks of the adaptive (AIMD) concurrency limits
+
+    python tests/test_concurrency.py
+"""
+
+from asyncio import ensure_future, run, sleep
+
+from shardai import ConcurrencyLimiter, concurrency
+from shardai.concurrency import AdaptiveLimit
+
+
+class Clock:
+    """
+    Stands in for time.monotonic in the concurrency module
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def __enter__(self):
+        self.monotonic, concurrency.monotonic = concurrency.monotonic, self
+        return self
+
+    def __exit__(self, *exc_info):
+        concurrency.monotonic = self.monotonic
+
+
+def busy_round(limit: AdaptiveLimit, latency: float = 0.1, started=None):
+    """
+    Fill every slot of the limit, then complete all the calls
+    """
+    slots = int(limit.limit)
+    for _ in range(slots):
+        assert limit.acquire(timeout=0)
+    assert not limit.acquire(timeout=0)
+    for _ in range(slots):
+        limit.release(latency, False, started)
+
+
+def check_additive_increase():
+    limit = AdaptiveLimit("chat", initial=4, max_limit=6)
+    busy_round(limit)
+    assert 4 < limit.limit < 6, limit.limit
+    for _ in range(20):
+        busy_round(limit)
+    assert limit.limit == 6
+    idle = AdaptiveLimit("chat", initial=4)
+    for _ in range(10):
+        idle.acquire()
+        idle.release(0.1)
+    assert idle.limit == 4
+
+
+def check_multiplicative_decrease():
+    with Clock() as clock:
+        limit = AdaptiveLimit("chat", initial=8, min_limit=2)
+        started = clock.now
+        for _ in range(3):
+            limit.acquire()
+        clock.now += 1
+        limit.release(0.1, True, started)
+        assert limit.limit == 4
+        limit.release(0.1, True, started)
+        limit.release(5.0, False, started)
+        assert limit.limit == 4, "calls sent before a cut cut the limit again"
+        clock.now += 1
+        limit.acquire()
+        limit.release(0.1, True, clock.now)
+        assert limit.limit == 2
+        clock.now += 1
+        limit.acquire()
+        limit.release(0.1, True, clock.now)
+        assert limit.limit == 2 and limit.in_flight == 0
+
+
+def check_latency_inflation():
+    with Clock() as clock:
+        limit = AdaptiveLimit("chat", initial=8, tolerance=2.0)
+        limit.acquire()
+        limit.release(0.1, False, clock.now)
+        limit.acquire()
+        limit.release(0.19, False, clock.now)
+        assert limit.limit == 8
+        limit.acquire()
+        limit.release(0.5, False, clock.now)
+        assert limit.limit == 4
+
+
+def check_abandoned_call():
+    limit = AdaptiveLimit("chat", initial=1)
+    limit.acquire()
+    limit.release()
+    assert limit.limit == 1 and limit.baseline is None and limit.in_flight == 0
+
+
+async def check_async_waiters():
+    limit = AdaptiveLimit("chat", initial=1)
+    assert await limit.acquire_async(timeout=0)
+    assert not await limit.acquire_async(timeout=0.01)
+    waiter = ensure_future(limit.acquire_async())
+    await sleep(0)
+    assert not waiter.done()
+    limit.release()
+    assert await waiter and limit.in_flight == 1
+
+
+def check_limiter_overrides():
+    limiter = ConcurrencyLimiter(initial=4, limits={"sdxl": {"initial": 1}})
+    assert limiter.limit("chat") is limiter.limit("chat")
+    assert limiter.current() == {"chat": {"limit": 4, "in_flight": 0}}
+    assert int(limiter.limit("sdxl").limit) == 1
+
+
+def test_additive_increase():
+    check_additive_increase()
+
+
+def test_multiplicative_decrease():
+    check_multiplicative_decrease()
+
+
+def test_latency_inflation():
+    check_latency_inflation()
+
+
+def test_abandoned_call():
+    check_abandoned_call()
+
+
+def test_async_waiters():
+    run(check_async_waiters())
+
+
+def test_limiter_overrides():
+    check_limiter_overrides()
+
+
+if __name__ == "__main__":
+    for name, check in list(globals().items()):
+        if name.startswith("test_"):
+            check()
+            print(f"{name}: ok")
@@ -0,0 +1,136 @@
+"""
+Differential checks of JSONView and JSONListView against json.loads
+
+    python tests/test_jsonview.py
+"""
+
+from json import dumps, loads
+from random import Random
+
+from shardai.jsonview import JSONListView, JSONView, parse
+
+DOCUMENTS = [
+    b"{}",
+    b"[]",
+    b'{"a": 1}',
+    b' \r\n\t{ "a" : 1 , "b" :\t[ 1 , 2 ] ,\n"c" : { } }  ',
+    b'{"quote": "say \\"hi\\"", "slash": "a\\\\", "tail": "\\\\\\""}',
+    b'{"unicode": "h\\u00e9 \\ud83d\\ude00", "raw": "h\xc3\xa9"}',
+    b'{"escapes": "\\b\\f\\n\\r\\t\\/", "braces": "{[}]", "comma": ","}',
+    b'{"numbers": [0, -1, 1.5, -0.25, 1e3, 1E-3, -2.5e+10, 12345678901234567890]}',
+    b'{"literals": [true, false, null], "empty": ["", {}, []]}',
+    b'{"nested": {"a": [{"b": [[], [{}], {"c": "]}"}]}], "d": {"e": {"f": 1}}}}',
+    b'[1, "two", {"three": [3]}, [[4]], null]',
+    b'{"dup": 1, "dup": 2}',
+]
+
+
+def plain(value):
+    """
+    Turn views into the dicts and lists json.loads returns
+    """
+    if isinstance(value, JSONView):
+        return {key: plain(value[key]) for key in value}
+    if isinstance(value, JSONListView):
+        return [plain(item) for item in value]
+    return value
+
+
+def random_value(random: Random, depth: int = 0):
+    """
+    Return a random json value, with containers nested at most 4 levels deep
+    """
+    kind = random.randrange(8 if depth < 4 else 5)
+    if kind == 0:
+        return random.choice([True, False, None])
+    if kind == 1:
+        return random.randint(-(10**12), 10**12)
+    if kind == 2:
+        return random.uniform(-1e6, 1e6) * 10 ** random.randint(-20, 20)
+    if kind in (3, 4):
+        alphabet = 'ab "\\/\b\f\n\r\t{}[],:é 😀\x00\x1f'
+        return "".join(random.choice(alphabet) for _ in range(random.randrange(12)))
+    if kind in (5, 6):
+        return {
+            random_value(random, 4): random_value(random, depth + 1)
+            for _ in range(random.randrange(5))
+        }
+    return [random_value(random, depth + 1) for _ in range(random.randrange(5))]
+
+
+def random_document(random: Random) -> bytes:
+    value = {
+        str(index): random_value(random) for index in range(random.randrange(1, 6))
+    }
+    indent = random.choice([None, 0, 2, "\t"])
+    separators = random.choice([(",", ":"), (", ", ": "), (" , ", " : ")])
+    text = dumps(
+        value,
+        indent=indent,
+        separators=separators,
+        ensure_ascii=random.random() < 0.5,
+    )
+    return text.encode("utf-8")
+
+
+def check_documents():
+    for document in DOCUMENTS:
+        assert plain(parse(document)) == loads(document), document
+
+
+def check_random_documents():
+    random = Random(17)
+    for _ in range(500):
+        document = random_document(random)
+        assert plain(parse(document)) == loads(document), document
+
+
+def check_raw():
+    document = b'{"plain": "aGVsbG8=", "escaped": "a\\"b\\u00e9", "number": 1}'
+    view = parse(document)
+    plain_raw = view.raw("plain")
+    assert isinstance(plain_raw, memoryview) and bytes(plain_raw) == b"aGVsbG8="
+    assert view.raw("escaped") == 'a"bé'.encode()
+    try:
+        view.raw("number")
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("raw() accepted a number")
+    items = parse(b'["x\\\\y", "xy"]')
+    assert items.raw(0) == b"x\\y" and bytes(items.raw(1)) == b"xy"
+
+
+def check_lazy_decoding():
+    calls = []
+
+    def decoder(data):
+        calls.append(bytes(data))
+        return loads(data)
+
+    view = parse(b'{"small": 1, "large": {"deep": [1, 2, 3]}}', decoder)
+    assert view["small"] == 1
+    assert all(b"deep" not in call for call in calls), calls
+
+
+def test_documents():
+    check_documents()
+
+
+def test_random_documents():
+    check_random_documents()
+
+
+def test_raw():
+    check_raw()
+
+
+def test_lazy_decoding():
+    check_lazy_decoding()
+
+
+if __name__ == "__main__":
+    for name, check in list(globals().items()):
+        if name.startswith("test_"):
+            check()
+            print(f"{name}: ok")
@@ -0,0 +1,181 @@
+"""
+Checks of APIKeyPool key selection, cooldown, disable and quota transitions,
+and of its rotation through the sub-clients
+
+    python tests/test_keypool.py
+"""
+
+from json import dumps
+
+from shardai import APIKeyPool, InvalidAPIKeyError, ShardClient, keypool
+
+
+class Clock:
+    """
+    Stands in for time.monotonic in the keypool module
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def __enter__(self):
+        self.monotonic, keypool.monotonic = keypool.monotonic, self
+        return self
+
+    def __exit__(self, *exc_info):
+        keypool.monotonic = self.monotonic
+
+
+class StubResponse:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, body: dict):
+        self.content = dumps(body).encode()
+
+
+class StubSession:
+    """
+    Stands in for the requests session, recording the key of every request
+    """
+
+    def __init__(self, body: dict):
+        self.body = body
+        self.keys = []
+
+    def request(self, method, url, json=None, headers=None, timeout=None):
+        self.keys.append(headers["api-key"])
+        return StubResponse(self.body)
+
+
+def stub_client(keys, body: dict) -> tuple:
+    client = ShardClient(keys)
+    session = StubSession(body)
+    client.transport._session = session
+    return client, session
+
+
+def check_tts_rotation():
+    audio = {
+        "audio": "data:audio/mp3;base64,AAAA",
+        "generation-time": 0.1,
+        "warning!": None,
+        "info": {"model": "google"},
+    }
+    pool = APIKeyPool(["k1", "k2"], strategy="round_robin")
+    client, session = stub_client(pool, audio)
+    for _ in range(4):
+        client.tts.completions("hi", model="google")
+    assert session.keys == ["k1", "k2", "k1", "k2"], session.keys
+
+
+def take(pool: APIKeyPool, count: int) -> list:
+    keys = []
+    for _ in range(count):
+        key, delay = pool.acquire()
+        assert delay == 0.0
+        keys.append(key)
+    return keys
+
+
+def check_strategies():
+    pool = APIKeyPool({"a": 2, "b": 1}, strategy="round_robin")
+    assert take(pool, 6) == ["a", "b", "a"] * 2
+    pool = APIKeyPool({"a": 2, "b": 1})
+    assert take(pool, 3) == ["a", "b", "a"]
+    assert [pool.keys[key].in_flight for key in "ab"] == [2, 1]
+    pool.release("a", 200)
+    assert take(pool, 1) == ["a"]
+
+
+def check_cooldown():
+    with Clock() as clock:
+        pool = APIKeyPool(["a", "b"], strategy="round_robin", cooldown=30)
+        take(pool, 2)
+        pool.release("a", 429, "5")
+        pool.release("b", 429)
+        assert pool.acquire() == (None, 5.0)
+        clock.now += 5
+        assert take(pool, 1) == ["a"]
+        pool.release("a", 429, "100")
+        assert pool.acquire() == (None, 25.0)
+        clock.now += 25
+        assert pool.acquire()[0] == "b"
+
+
+def check_failures():
+    with Clock() as clock:
+        pool = APIKeyPool(["a"], cooldown=10, max_failures=3)
+        for status in (500, None, 200, 503, 502):
+            take(pool, 1)
+            pool.release("a", status)
+        assert take(pool, 1) == ["a"]
+        pool.release("a", None)
+        assert pool.acquire() == (None, 10.0)
+        clock.now += 10
+        assert take(pool, 1) == ["a"]
+
+
+def check_disable():
+    pool = APIKeyPool(["a", "b"], strategy="round_robin")
+    take(pool, 2)
+    pool.release("a", 401)
+    pool.release("b", 200)
+    assert pool.active == ["b"] and take(pool, 2) == ["b", "b"]
+    pool.release("b", 403)
+    try:
+        pool.acquire()
+    except InvalidAPIKeyError as error:
+        assert error.status == 401
+    else:
+        raise AssertionError("a pool without active keys handed out a key")
+    pool.enable("a")
+    assert take(pool, 1) == ["a"]
+
+
+def check_quota():
+    with Clock() as clock:
+        pool = APIKeyPool(["a"], quotas=2, quota_period=60)
+        take(pool, 2)
+        clock.now += 20
+        assert pool.acquire() == (None, 40.0)
+        pool.release("a", 200)
+        pool.release("a", 200, sent=False)
+        assert take(pool, 1) == ["a"]
+        assert pool.acquire() == (None, 40.0)
+        clock.now += 40
+        assert take(pool, 2) == ["a", "a"]
+
+
+def test_strategies():
+    check_strategies()
+
+
+def test_cooldown():
+    check_cooldown()
+
+
+def test_failures():
+    check_failures()
+
+
+def test_disable():
+    check_disable()
+
+
+def test_quota():
+    check_quota()
+
+
+def test_tts_rotation():
+    check_tts_rotation()
+
+
+if __name__ == "__main__":
+    for name, check in list(globals().items()):
+        if name.startswith("test_"):
+            check()
+            print(f"{name}: ok")
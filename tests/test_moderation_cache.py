@@ -0,0 +1,93 @@
+"""
+Checks of the bloom filter and the ModerationCache in front of it
+
+    python tests/test_moderation_cache.py
+"""
+
+from shardai import ModerationCache, cache
+from shardai.cache import BloomFilter
+
+
+class Clock:
+    """
+    Stands in for time.monotonic in the cache module
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def __enter__(self):
+        self.monotonic, cache.monotonic = cache.monotonic, self
+        return self
+
+    def __exit__(self, *exc_info):
+        cache.monotonic = self.monotonic
+
+
+def verdict(score: float) -> dict:
+    return {
+        "score": score,
+        "languages": {"language": "en"},
+        "data": {"prompt": "stored", "attribute": "TOXICITY"},
+    }
+
+
+def check_bloom_filter():
+    bloom = BloomFilter(capacity=10000, error_rate=0.01)
+    for index in range(10000):
+        bloom.add(f"key-{index}")
+    assert all(f"key-{index}" in bloom for index in range(10000))
+    false_positives = sum(f"other-{index}" in bloom for index in range(10000))
+    assert false_positives < 200, false_positives
+    bloom.clear()
+    assert not any(f"key-{index}" in bloom for index in range(1000))
+
+
+def check_normalized_hits():
+    moderation = ModerationCache()
+    key = moderation.prompt_key("  Hello\tWORLD ", "TOXICITY")
+    moderation.store(key, verdict(0.2))
+    assert moderation.prompt_key("hello world", "TOXICITY") == key
+    assert moderation.prompt_key("ｈｅｌｌｏ world", "TOXICITY") == key
+    assert moderation.prompt_key("hello world", "INSULT") != key
+    response = moderation.load(key, "hello world")
+    assert response.score == 0.2 and response.cached
+    assert response.prompt == "hello world" and response.attribute == "TOXICITY"
+
+
+def check_expiry_and_eviction():
+    with Clock() as clock:
+        moderation = ModerationCache(ttl=60, max_entries=2)
+        for name in "abc":
+            moderation.store(name, verdict(0.1))
+        assert len(moderation) == 2 and moderation.load("a") is None
+        assert moderation.load("b") is not None
+        moderation.store("d", verdict(0.1))
+        assert moderation.load("c") is None and moderation.load("b") is not None
+        clock.now += 60
+        assert moderation.load("b") is None and moderation.load("d") is None
+        assert len(moderation) == 0
+        moderation.store("e", verdict(0.3))
+        assert "b" not in moderation.bloom and moderation.load("e").score == 0.3
+
+
+def test_bloom_filter():
+    check_bloom_filter()
+
+
+def test_normalized_hits():
+    check_normalized_hits()
+
+
+def test_expiry_and_eviction():
+    check_expiry_and_eviction()
+
+
+if __name__ == "__main__":
+    for name, check in list(globals().items()):
+        if name.startswith("test_"):
+            check()
+            print(f"{name}: ok")
@@ -0,0 +1,126 @@
+"""
+Deterministic checks of the Scheduler's weighted fair queuing
+
+    python tests/test_scheduler.py
+"""
+
+from asyncio import ensure_future, gather, run, sleep
+
+from shardai import Scheduler
+
+
+async def grant_order(scheduler: Scheduler, queued: dict, held: str) -> list:
+    """
+    Queue calls behind one held slot, then free the slot one call at a time
+
+    :param queued: The number of calls to queue per priority class
+    :param held: The priority class of the call holding the only slot
+
+    :return: The priority classes in the order their calls were started
+    """
+    order = []
+
+    async def call(priority: str):
+        await scheduler.acquire_async(priority)
+        order.append(priority)
+
+    tasks = [
+        ensure_future(call(priority))
+        for priority, count in queued.items()
+        for _ in range(count)
+    ]
+    await sleep(0)
+    current = held
+    for started in range(1, len(tasks) + 1):
+        scheduler.release(current)
+        while len(order) < started:
+            await sleep(0)
+        current = order[-1]
+    scheduler.release(current)
+    await gather(*tasks)
+    return order
+
+
+def check_weighted_shares():
+    scheduler = Scheduler(concurrency=1)
+    scheduler.acquire("bulk")
+    queued = {"bulk": 20, "normal": 20, "interactive": 20}
+    order = run(grant_order(scheduler, queued, "bulk"))
+    # The held bulk call took virtual time [0, 1), so bulk is next due at 1
+    first = order[:12]
+    assert first.count("interactive") == 8 and first.count("normal") == 4, order
+    assert order[12:15] == ["interactive", "normal", "bulk"], order
+    window = order[:25]
+    assert window.count("interactive") == 16, order
+    assert window.count("normal") == 8 and window.count("bulk") == 1, order
+    assert scheduler.in_flight == 0
+    stats = scheduler.stats()
+    assert [stats[priority]["started"] for priority in queued] == [21, 20, 20]
+
+
+def check_ties_favour_heavier_class():
+    scheduler = Scheduler(concurrency=1)
+    scheduler.acquire("interactive")
+    order = run(grant_order(scheduler, {"bulk": 1, "normal": 1}, "interactive"))
+    assert order == ["normal", "bulk"], order
+
+
+def check_idle_class_banks_no_credit():
+    scheduler = Scheduler(concurrency=1, weights={"fast": 1, "slow": 1})
+    for _ in range(10):
+        scheduler.acquire("fast")
+        scheduler.release("fast")
+    scheduler.acquire("fast")
+    order = run(grant_order(scheduler, {"slow": 4, "fast": 4}, "fast"))
+    assert order == ["slow", "fast"] * 4, order
+
+
+def check_budget_and_timeout():
+    scheduler = Scheduler(concurrency=2)
+    assert scheduler.acquire("bulk", timeout=0) and scheduler.acquire("bulk", 0)
+    assert not scheduler.acquire("interactive", timeout=0.01)
+    assert scheduler.stats()["interactive"]["queued"] == 0
+    scheduler.release("bulk")
+    assert scheduler.acquire("interactive", timeout=0)
+    assert scheduler.stats()["interactive"]["in_flight"] == 1
+
+
+def check_unknown_priority():
+    scheduler = Scheduler()
+    assert scheduler.priority_of("chat") == "interactive"
+    assert scheduler.priority_of("sdxl") == "bulk"
+    assert scheduler.priority_of("unknown") == "normal"
+    assert scheduler.priority_of("sdxl", "interactive") == "interactive"
+    try:
+        scheduler.priority_of("chat", "urgent")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("an unknown priority class was accepted")
+
+
+def test_weighted_shares():
+    check_weighted_shares()
+
+
+def test_ties_favour_heavier_class():
+    check_ties_favour_heavier_class()
+
+
+def test_idle_class_banks_no_credit():
+    check_idle_class_banks_no_credit()
+
+
+def test_budget_and_timeout():
+    check_budget_and_timeout()
+
+
+def test_unknown_priority():
+    check_unknown_priority()
+
+
+if __name__ == "__main__":
+    for name, check in list(globals().items()):
+        if name.startswith("test_"):
+            check()
+            print(f"{name}: ok")
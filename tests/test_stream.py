@@ -0,0 +1,118 @@
+"""
+Checks of server-sent event streams against a local server
+
+Events must be decoded as utf-8 whatever the Content-Type says, and a
+connection dropped mid-stream must surface as APIError on both paths.
+
+    python tests/test_stream.py
+"""
+
+from asyncio import run
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+from shardai import APIError
+from shardai.transport import Transport
+
+EVENTS = 'data: {"text": "hé"}\n\ndata: [DONE]\n\n'.encode("utf-8")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        content_type = {
+            "/sse": "text/event-stream",
+            "/ndjson": "application/x-ndjson",
+        }.get(self.path, "text/event-stream")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        if self.path == "/drop":
+            chunk = b'data: {"text": "partial"}\n\n'
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"40\r\ndata: {")
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(EVENTS), EVENTS))
+
+    def log_message(self, *args):
+        pass
+
+
+def serve() -> tuple:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def check_decoding(base_url: str):
+    transport = Transport(base_url=base_url)
+    for path in ("/sse", "/ndjson"):
+        assert list(transport.stream("POST", path, {})) == [{"text": "hé"}]
+
+
+async def check_decoding_async(base_url: str):
+    transport = Transport(base_url=base_url)
+    try:
+        for path in ("/sse", "/ndjson"):
+            events = [event async for event in transport.stream_async("POST", path)]
+            assert events == [{"text": "hé"}]
+    finally:
+        await transport.close_async()
+
+
+def check_dropped(base_url: str):
+    transport = Transport(base_url=base_url)
+    events = []
+    try:
+        for event in transport.stream("POST", "/drop", {}):
+            events.append(event)
+    except APIError as error:
+        assert error.status == 200 and error.attempts == 1
+    else:
+        raise AssertionError("a dropped stream did not raise APIError")
+    assert events == [{"text": "partial"}]
+
+
+async def check_dropped_async(base_url: str):
+    transport = Transport(base_url=base_url)
+    events = []
+    try:
+        async for event in transport.stream_async("POST", "/drop", {}):
+            events.append(event)
+    except APIError as error:
+        assert error.status == 200 and error.attempts == 1
+    else:
+        raise AssertionError("a dropped stream did not raise APIError")
+    finally:
+        await transport.close_async()
+    assert events == [{"text": "partial"}]
+
+
+def test_decoding():
+    server, base_url = serve()
+    try:
+        check_decoding(base_url)
+        run(check_decoding_async(base_url))
+    finally:
+        server.shutdown()
+
+
+def test_dropped():
+    server, base_url = serve()
+    try:
+        check_dropped(base_url)
+        run(check_dropped_async(base_url))
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    for name, check in list(globals().items()):
+        if name.startswith("test_"):
+            check()
+            print(f"{name}: ok")